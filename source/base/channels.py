@@ -0,0 +1,86 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import base.constants as c
+from lib.protocol import Protocol
+from lib.serialization import CODECS
+
+"""
+    Messages on channels, independent of the transport (not Qt): a message is wrapped in a dict (letter) together with
+    the name of the channel it is sent on. The content is either given as is ('content') or already encoded separately
+    ('encoded'), which allows to encode large messages once and send them many times.
+"""
+
+# replies to requests (see base.network.NetworkClient.request) come on channels with this prefix and the request id
+REQUEST_REPLY_PREFIX = 'request.reply.'
+
+
+def build_preset_dictionary():
+    """
+        Builds the preset dictionary for compression of messages from typical message parts (channel names, keys) in
+        all codecs. zlib profits most from content near the end of the dictionary, so the most common parts go last.
+    """
+    keys = [c.CH_SCENARIO_PREVIEW, c.CH_CORE_SCENARIO_TITLES, 'scenarios', 'scenario', 'nations', 'map']
+    for names in (c.PropertyKeyNames, c.NationPropertyKeyNames):
+        keys.extend(value for key, value in vars(names).items() if not key.startswith('_'))
+    samples = [{key: None} for key in keys]
+    for channel in (c.CH_SCENARIO_PREVIEW, c.CH_CORE_SCENARIO_TITLES):
+        samples.append({'channel': channel, 'content': {'reply-to': None}})
+    samples.append({'channel': None, 'content': None})
+    samples.append({'channel': None, 'encoded': b''})
+    codecs = {codec.id: codec for codec in CODECS.values()}.values()
+    return b''.join(codec.dumps(sample) for sample in samples for codec in codecs)
+
+
+# the same for every client
+PRESET_DICTIONARY = build_preset_dictionary()
+
+
+def create_protocol(session=None):
+    """
+        A protocol (lib.protocol.Protocol) with the default settings and the preset dictionary (and optionally a session
+        key).
+    """
+    return Protocol(dictionary=PRESET_DICTIONARY, session=session)
+
+
+def letter(channel_name, message=None):
+    """
+        Wraps a message for sending on a channel.
+    """
+    return {
+        'channel': channel_name,
+        'content': message
+    }
+
+
+def encoded_letter(channel_name, encoded):
+    """
+        Wraps an already encoded message (see lib.protocol.encode) for sending on a channel.
+    """
+    return {
+        'channel': channel_name,
+        'encoded': encoded
+    }
+
+
+def letter_content(letter, decode):
+    """
+        The message in a received letter (decoded with the given function if it was encoded separately).
+    """
+    if 'encoded' in letter:
+        return decode(letter['encoded'])
+    return letter['content']
@@ -70,6 +70,8 @@ Global_Stylesheet = extend(Graphics_UI_Folder, 'style.css')
 
 # network communication
 Network_Port = 42932
+# name of the local server (client and server on the same machine), None for connecting via Network_Port
+Local_Server_Name = None
 
 # minimal screen resolution
 Screen_Min_Size = (1024, 768)
@@ -108,6 +110,12 @@ O.BG_MUTE.default = False
 # predefined channel names for network communication
 CH_SCENARIO_PREVIEW = 'general.scenario.preview'
 CH_CORE_SCENARIO_TITLES = 'general.core.scenarios.titles'
+CH_SERVER_METRICS = 'general.server.metrics'
+CH_SCENARIO_DOWNLOAD = 'general.scenario.download'
+CH_TRANSFER = 'general.transfer'
+CH_TRANSFER_CONTROL = 'general.transfer.control'
+CH_STATE_SYNC = 'general.state.sync'
+CH_STATE_DELTA_PREFIX = 'general.state.delta.'
 
 
 class TileDirections(u.AutoNumberedEnum):
@@ -14,9 +14,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
+import time
+
 from PySide import QtCore
 
+from base.channels import create_protocol, letter, encoded_letter, letter_content, REQUEST_REPLY_PREFIX
 from lib.network import Client
+from lib.recording import SessionRecorder, RECEIVED, SENT
+from base.transfer import Transfers
 
 """
     Using Signals of Qt, we refine on the network Client class in lib/network.py. Channels are introduced which have
@@ -24,6 +29,10 @@ from lib.network import Client
 """
 
 
+# default timeout of requests in seconds
+REQUEST_TIMEOUT = 10
+
+
 class NetworkClient(Client):
     """
         Extending the Client class (wrapper around QTcpSocket sending and receiving messages) with channels (see Channel
@@ -35,13 +44,20 @@ class NetworkClient(Client):
         transport and message processing.
     """
 
-    def __init__(self):
+    def __init__(self, protocol=None):
         """
-            We start with an empty channels list.
+            We start with an empty channels list. By default the protocol uses the preset dictionary for compression.
         """
-        super().__init__()
+        if protocol is None:
+            protocol = create_protocol()
+        super().__init__(protocol)
         self.received.connect(self.process)
+        self.disconnected.connect(self.fail_requests)
         self.channels = {}
+        self.requests = {}
+        self.request_counter = 0
+        self.last_decode = (0, 0)
+        self.recorder = None
 
     def create_new_channel(self, channel_name):
         """
@@ -90,13 +106,36 @@ class NetworkClient(Client):
         """
         channel_name = message['channel']
 
+        if self.recorder is not None:
+            self.recorder.record(RECEIVED, message)
+
+        # replies to requests that were cancelled or timed out are just ignored
+        if channel_name.startswith(REQUEST_REPLY_PREFIX) and channel_name not in self.requests:
+            return
+
         # do we have receivers in this category
-        if channel_name not in self.channels:
+        if channel_name not in self.channels and channel_name not in self.requests:
             raise RuntimeError('Channel with this name not existing.')
 
+        if self.metrics is not None:
+            self.metrics.record_received(channel_name, self.protocol.decoded_raw_size, *self.last_decode)
+
+        # content may have been encoded separately (see send_encoded)
+        content = letter_content(message, self.decode)
+
+        # a reply to one of our requests
+        if channel_name in self.requests:
+            self.requests.pop(channel_name).resolve(content)
+            return
+
         # send to channel and increase counter
         self.channels[channel_name].message_counter += 1
-        self.channels[channel_name].received.emit(self, message['content'])
+        if self.metrics is None:
+            self.channels[channel_name].received.emit(self, content)
+        else:
+            start = time.perf_counter()
+            self.channels[channel_name].received.emit(self, content)
+            self.metrics.record_handled(channel_name, time.perf_counter() - start)
 
         # note: channel with name channel_name may now already not be existing anymore (may be removed during processing)
 
@@ -104,13 +143,97 @@ class NetworkClient(Client):
         """
             Given a channel name and a message (optional) wraps them in one dict (a letter) and send it.
         """
-        # wrap content
-        letter = {
-            'channel': channel_name,
-            'content': message
-        }
-        # send
-        super().send(letter)
+        # wrap content and send
+        self.send_letter(channel_name, letter(channel_name, message))
+
+    def encode_letter(self, channel_name, message=None):
+        """
+            Encodes a message on a channel exactly like send() would. The result can be sent with send_bytes() to all
+            clients with equal send settings (see Client.send_settings).
+        """
+        return self.encode_for_sending(letter(channel_name, message))
+
+    def send_encoded(self, channel_name, encoded):
+        """
+            Given a channel name and an already encoded message (see Client.encode) sends it. The encoded message can
+            be reused for many sends and many channels and is decoded again on the receiving side.
+        """
+        # already compressed
+        self.send_letter(channel_name, encoded_letter(channel_name, encoded), compress=False)
+
+    def send_letter(self, channel_name, letter, compress=True):
+        """
+            Sends a letter (and records it in the metrics if there are metrics and in the recording if recording).
+        """
+        if self.recorder is not None:
+            self.recorder.record(SENT, letter)
+        if self.metrics is None:
+            super().send(letter, compress)
+            return
+        start = time.perf_counter()
+        if compress:
+            data = self.encode_for_sending(letter)
+        else:
+            data = self.protocol.encode(letter, False)
+        self.metrics.record_sent(channel_name, self.protocol.encoded_raw_size, len(data), time.perf_counter() - start)
+        self.send_bytes(data)
+
+    def decode(self, data):
+        """
+            Decodes a received message. With metrics, the size and the duration are remembered (see process()).
+        """
+        if self.metrics is None:
+            return super().decode(data)
+        start = time.perf_counter()
+        value = super().decode(data)
+        self.last_decode = (len(data), time.perf_counter() - start)
+        return value
+
+    def request(self, channel_name, message=None, callback=None, error_callback=None, timeout=REQUEST_TIMEOUT):
+        """
+            Sends a request (a message which must be a dict or None) on a channel and returns a Request. The reply is
+            expected on a unique reply channel (given as 'reply-to' in the message, the convention of all our
+            services) and is handed to callback(reply). If no reply comes within timeout seconds (None for no timeout),
+            or the connection is lost, error_callback(exception) is called instead.
+
+            Any number of requests can be outstanding at the same time.
+        """
+        self.request_counter += 1
+        reply_to = REQUEST_REPLY_PREFIX + str(self.request_counter)
+        content = dict(message) if message is not None else {}
+        content['reply-to'] = reply_to
+
+        request = Request(self, reply_to, callback, error_callback)
+        self.requests[reply_to] = request
+        if timeout is not None:
+            request.start_timer(timeout)
+        self.send(channel_name, content)
+        return request
+
+    def start_recording(self, file_name):
+        """
+            Records all received and sent messages to a file from now on (see lib.recording).
+        """
+        self.stop_recording()
+        self.recorder = SessionRecorder(file_name)
+        self.disconnected.connect(self.stop_recording)
+
+    def stop_recording(self):
+        """
+            Stops recording (if recording).
+        """
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def fail_requests(self):
+        """
+            The connection is lost, no outstanding request will ever get a reply.
+        """
+        requests = self.requests
+        self.requests = {}
+        for request in requests.values():
+            request.fail(ConnectionError('Connection lost.'))
 
 
 class Channel(QtCore.QObject):
@@ -124,4 +247,98 @@ class Channel(QtCore.QObject):
 
     def __init__(self):
         super().__init__()
-        self.message_counter = 0
\ No newline at end of file
+        self.message_counter = 0
+
+
+class TransferSignals(QtCore.QObject):
+    """
+        Qt signals for the progress of streaming transfers (see base.transfer.Transfers), e.g. for progress bars.
+    """
+
+    progress = QtCore.Signal(str, int, int)  # transfer id, bytes done, size
+    finished = QtCore.Signal(str, object, object)  # transfer id, meta, file name or bytes (None when sent)
+    failed = QtCore.Signal(str, str)  # transfer id, reason
+
+    def __init__(self, transfers=None):
+        """
+            Given transfers (new ones which keep incoming payloads in memory if None).
+        """
+        super().__init__()
+        self.transfers = transfers if transfers is not None else Transfers()
+        self.transfers.on_progress.append(self.progress.emit)
+        self.transfers.on_finished.append(self.finished.emit)
+        self.transfers.on_failed.append(self.failed.emit)
+
+
+class Request(QtCore.QObject):
+    """
+        An outstanding request (see NetworkClient.request), kind of a future. Either gets a reply (state 'done', result
+        is the reply), fails (state 'failed', result is the exception, e.g. a TimeoutError) or is cancelled (state
+        'cancelled'). Callbacks are only called for replies and failures.
+    """
+
+    def __init__(self, client, reply_to, callback, error_callback):
+        super().__init__()
+        self.client = client
+        self.reply_to = reply_to
+        self.callback = callback
+        self.error_callback = error_callback
+        self.state = 'pending'
+        self.result = None
+        self.timer = None
+
+    def start_timer(self, timeout):
+        """
+            Fails the request if there is no reply after timeout seconds.
+        """
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.time_out)
+        self.timer.start(int(timeout * 1000))
+
+    def time_out(self):
+        """
+            No reply in time.
+        """
+        self.client.requests.pop(self.reply_to, None)
+        self.fail(TimeoutError('Request {} timed out.'.format(self.reply_to)))
+
+    def resolve(self, reply):
+        """
+            The reply came.
+        """
+        if self.state != 'pending':
+            return
+        self._finish('done', reply)
+        if self.callback is not None:
+            self.callback(reply)
+
+    def fail(self, exception):
+        """
+            The request failed.
+        """
+        if self.state != 'pending':
+            return
+        self._finish('failed', exception)
+        if self.error_callback is not None:
+            self.error_callback(exception)
+        else:
+            print('request failed: {}'.format(exception))
+
+    def cancel(self):
+        """
+            We are not interested in the reply anymore (a reply arriving later is ignored).
+        """
+        if self.state != 'pending':
+            return
+        self.client.requests.pop(self.reply_to, None)
+        self._finish('cancelled', None)
+
+    def is_pending(self):
+        return self.state == 'pending'
+
+    def _finish(self, state, result):
+        self.state = state
+        self.result = result
+        if self.timer is not None:
+            self.timer.stop()
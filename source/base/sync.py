@@ -0,0 +1,269 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+
+from collections import deque
+import uuid
+
+import base.constants as c
+
+"""
+    Synchronization of a game state (a scenario on the server) with clients by versioned deltas, independent of the
+    transport (not Qt).
+
+    The server side (StateSync) records the changes of a scenario (see server.scenario.Scenario.track_changes) in a
+    change log. commit() bundles them into a delta with the next version and publishes it to all subscribed clients.
+    Tile changes are coalesced (only the last value of each tile is sent), so a delta costs bandwidth proportional to
+    the number of changes, not to the map size. The last deltas are kept, a client which (re)connects with a known
+    version gets the missing deltas or a full snapshot if it is too far behind (or knows another epoch, e.g. from
+    before a server restart).
+
+    The client side (StateReplica) keeps a copy of the state as plain values and applies the deltas.
+
+    Messages on c.CH_STATE_SYNC (requests, see base.network.NetworkClient.request):
+        {'name': state name, 'epoch': epoch or None, 'version': known version or None}
+    and the reply:
+        {'epoch', 'version', 'deltas': [delta, ..]} or {'epoch', 'version', 'snapshot': state}
+    Messages on the topic c.CH_STATE_DELTA_PREFIX + name (server to client):
+        {'epoch', 'version', 'tiles': {layer: [indices, values]}, 'changes': [change, ..]}
+"""
+
+# default number of deltas kept for clients which are behind
+DELTA_HISTORY = 64
+
+
+class ChangeLog():
+    """
+        The changes since the last delta. Tile changes are kept per layer (last value wins), all other changes (lists
+        starting with the kind of change, see server.scenario.Scenario) in order.
+    """
+
+    def __init__(self):
+        self.layers = {}
+        self.changes = []
+
+    def tile(self, layer, index, value):
+        """
+            A tile (index in the map) of a layer changed.
+        """
+        self.layers.setdefault(layer, {})[index] = value
+
+    def tiles(self, layer, indices, values):
+        """
+            Many tiles of a layer changed.
+        """
+        self.layers.setdefault(layer, {}).update(zip(indices, values))
+
+    def record(self, change):
+        """
+            Any other change.
+        """
+        self.changes.append(change)
+
+    def is_empty(self):
+        return not self.layers and not self.changes
+
+    def take(self):
+        """
+            Returns the content of a delta with all recorded changes and starts empty again. Tile indices are sorted and
+            sent as lists of ints (compact typed arrays with the binary codec).
+        """
+        tiles = {}
+        for layer, values in self.layers.items():
+            indices = sorted(values)
+            tiles[layer] = [indices, [values[index] for index in indices]]
+        delta = {
+            'tiles': tiles,
+            'changes': self.changes
+        }
+        self.layers = {}
+        self.changes = []
+        return delta
+
+
+class StateSync():
+    """
+        The server side of the synchronization of a scenario with the name name. Deltas are published with the publish
+        function (see server.services.ServerServices.publish) on the topic of this state.
+
+        Call commit() after changing the scenario (e.g. at the end of a turn).
+    """
+
+    def __init__(self, name, scenario, publish, history=DELTA_HISTORY):
+        self.name = name
+        self.topic = c.CH_STATE_DELTA_PREFIX + name
+        self.scenario = scenario
+        self.publish = publish
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self.deltas = deque(maxlen=history)
+        self.changes = ChangeLog()
+        scenario.track_changes(self.changes)
+
+    def close(self):
+        """
+            Stops recording the changes of the scenario.
+        """
+        self.scenario.track_changes(None)
+
+    def commit(self):
+        """
+            Bundles all changes since the last commit into a delta with a new version and publishes it. Returns the
+            version (unchanged if there were no changes).
+        """
+        if self.changes.is_empty():
+            return self.version
+        delta = self.changes.take()
+        self.version += 1
+        delta['epoch'] = self.epoch
+        delta['version'] = self.version
+        self.deltas.append(delta)
+        self.publish(self.topic, delta)
+        return self.version
+
+    def sync_reply(self, epoch, version):
+        """
+            The answer to a client which knows the given epoch and version. Either the missing deltas or a snapshot.
+            Uncommitted changes are committed first, so that the client can apply all following deltas.
+        """
+        self.commit()
+        reply = {
+            'epoch': self.epoch,
+            'version': self.version
+        }
+        if epoch == self.epoch and version is not None and version <= self.version:
+            missing = self.version - version
+            if missing == 0:
+                reply['deltas'] = []
+                return reply
+            if missing <= len(self.deltas):
+                reply['deltas'] = list(self.deltas)[-missing:]
+                return reply
+        # unknown, from the future or too far behind
+        reply['snapshot'] = self.scenario.state()
+        return reply
+
+
+class StateReplica():
+    """
+        The client side of the synchronization of a state with the name name, the state is a copy of the scenario on
+        the server as plain values (see server.scenario.Scenario.state).
+
+        attach() to a client (with the channel interface of base.network.NetworkClient including request), then the
+        replica is synchronized and stays synchronized. Whenever the state changed, on_changed(delta) is called (with
+        None for a new snapshot).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.topic = c.CH_STATE_DELTA_PREFIX + name
+        self.epoch = None
+        self.version = None
+        self.state = None
+        self.synchronizing = False
+        self.on_changed = []
+
+    def attach(self, client):
+        """
+            Receives the deltas from a client and synchronizes (again, e.g. after a reconnect).
+        """
+        client.connect_to_channel(self.topic, self.received_delta)
+        self.synchronize(client)
+
+    def detach(self, client):
+        client.disconnect_from_channel(self.topic, self.received_delta)
+
+    def synchronize(self, client):
+        """
+            Asks the server for what we are missing.
+        """
+        if self.synchronizing:
+            return
+        self.synchronizing = True
+        message = {
+            'name': self.name,
+            'epoch': self.epoch,
+            'version': self.version
+        }
+        client.request(c.CH_STATE_SYNC, message, self.received_sync, self.sync_failed)
+
+    def sync_failed(self, exception):
+        self.synchronizing = False
+        print('synchronization of state {} failed: {}'.format(self.name, exception))
+
+    def received_sync(self, reply):
+        """
+            The reply to synchronize().
+        """
+        self.synchronizing = False
+        if 'error' in reply:
+            print('synchronization of state {} failed: {}'.format(self.name, reply['error']))
+            return
+        if 'snapshot' in reply:
+            self.state = reply['snapshot']
+            self.epoch = reply['epoch']
+            self.version = reply['version']
+            for callback in self.on_changed:
+                callback(None)
+        else:
+            for delta in reply['deltas']:
+                self.apply(delta)
+
+    def received_delta(self, client, delta):
+        """
+            A new delta was published. If we missed one, synchronize again.
+        """
+        if self.synchronizing or self.state is None:
+            return
+        if delta['epoch'] != self.epoch or delta['version'] > self.version + 1:
+            self.synchronize(client)
+            return
+        self.apply(delta)
+
+    def apply(self, delta):
+        """
+            Applies a delta (if it is the next one) to the state.
+        """
+        if delta['version'] != self.version + 1:
+            return
+        state = self.state
+        for change in delta['changes']:
+            kind = change[0]
+            if kind == 'property':
+                state['properties'][change[1]] = change[2]
+            elif kind == 'river':
+                state['properties'][c.PropertyKeyNames.RIVERS].append({'name': change[1], 'tiles': change[2]})
+            elif kind == 'new province':
+                state['provinces'][change[1]] = {'nation': None}
+            elif kind == 'province':
+                state['provinces'][change[1]][change[2]] = change[3]
+            elif kind == 'new nation':
+                state['nations'][change[1]] = {'properties': {}, 'provinces': []}
+            elif kind == 'nation':
+                state['nations'][change[1]]['properties'][change[2]] = change[3]
+            elif kind == 'transfer':
+                province, nation = change[1], change[2]
+                state['nations'][nation]['provinces'].append(province)
+                state['provinces'][province]['nation'] = nation
+            else:
+                raise RuntimeError('Unknown change {}.'.format(kind))
+        for layer, (indices, values) in delta['tiles'].items():
+            data = state['map'][layer]
+            for index, value in zip(indices, values):
+                data[index] = value
+        self.version = delta['version']
+        for callback in self.on_changed:
+            callback(delta)
@@ -0,0 +1,390 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import io
+import os
+import time
+import uuid
+import zlib
+
+import base.constants as c
+
+"""
+    Streaming transfer of large payloads (files or blobs) over a connection with channels, independent of the transport
+    (not Qt).
+
+    The payload is split into chunks, each with a checksum. The sender only reads (from a file) what is sent and only
+    sends a window of chunks ahead of what the receiver acknowledged, so neither side holds the whole payload in memory
+    (if the receiver writes to a file) and other messages are not blocked. Transfers have an id independent of the
+    connection, after a reconnect the receiver asks to resume at the first missing chunk.
+
+    A receiver can accept only transfers it asked for (see Transfers.expect) and limits their size. Incoming payloads
+    are stored under file names of the receiver's choice, never under names given by the sender.
+
+    Messages on c.CH_TRANSFER (sender to receiver):
+        {'transfer': id, 'offer': {'size', 'chunk size', 'meta'}}
+        {'transfer': id, 'chunk': index, 'data': bytes, 'checksum': crc32 of data}
+        (the last chunk additionally contains 'total': crc32 of the whole payload)
+    Messages on c.CH_TRANSFER_CONTROL (receiver to sender):
+        {'transfer': id, 'ack': number of chunks received}
+        {'transfer': id, 'resume': number of chunks received}
+        {'transfer': id, 'cancel': reason}
+"""
+
+# default size of a chunk in bytes
+CHUNK_SIZE = 64 * 1024
+
+# default number of chunks that are sent but not yet acknowledged
+WINDOW = 8
+
+# seconds an outgoing transfer waits for a resume after the connection was lost
+RESUME_TIMEOUT = 300
+
+# default maximal size in bytes of incoming payloads
+MAX_SIZE = 256 * 1024 * 1024
+
+# maximal chunk size in bytes of incoming transfers
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class OutgoingTransfer():
+    """
+        The sending side of a transfer. The payload is a file (read chunk by chunk) or bytes.
+    """
+
+    def __init__(self, transfer_id, source, meta, chunk_size):
+        self.id = transfer_id
+        self.meta = meta
+        self.chunk_size = chunk_size
+        if isinstance(source, str):
+            self.file = open(source, 'rb')
+            self.size = os.fstat(self.file.fileno()).st_size
+        else:
+            self.file = io.BytesIO(source)
+            self.size = len(source)
+        self.chunks = (self.size + chunk_size - 1) // chunk_size
+        # crc32 of the first checksum_chunks chunks, the payload is only read once while sending
+        self.checksum = 0
+        self.checksum_chunks = 0
+        self.client = None
+        self.detached_since = None
+        self.next_chunk = 0
+        self.acknowledged = 0
+
+    def offer(self):
+        return {'size': self.size, 'chunk size': self.chunk_size, 'meta': self.meta}
+
+    def read_chunk(self, index):
+        """
+            Reads a chunk. Chunks are read in order (again from an earlier one after resuming), the checksum of the
+            whole payload is updated on the way.
+        """
+        self.file.seek(index * self.chunk_size)
+        data = self.file.read(self.chunk_size)
+        if index == self.checksum_chunks:
+            self.checksum = zlib.crc32(data, self.checksum)
+            self.checksum_chunks += 1
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class IncomingTransfer():
+    """
+        The receiving side of a transfer. Chunks are appended to a file (or kept in memory if there is no file name)
+        in order and checked, so the whole payload can be checked incrementally.
+    """
+
+    def __init__(self, transfer_id, offer, file_name, client):
+        self.id = transfer_id
+        self.size = offer['size']
+        self.chunk_size = offer['chunk size']
+        self.meta = offer['meta']
+        self.chunks = (self.size + self.chunk_size - 1) // self.chunk_size
+        self.checksum = 0  # of the whole payload, given with the last chunk
+        self.file_name = file_name
+        self.file = open(file_name + '.part', 'wb') if file_name is not None else io.BytesIO()
+        self.client = client
+        self.received = 0
+        self.running_checksum = 0
+
+    def add_chunk(self, index, data, checksum, total):
+        """
+            Adds the next chunk (total is the checksum of the whole payload, given with the last chunk). Returns False
+            (and ignores the chunk) if it is not the next one (e.g. sent again after resuming) and raises a RuntimeError
+            if it is corrupted or does not have the announced size.
+        """
+        if index != self.received:
+            return False
+        expected_length = min(self.chunk_size, self.size - index * self.chunk_size)
+        if len(data) != expected_length or zlib.crc32(data) != checksum:
+            raise RuntimeError('Chunk {} of transfer {} is corrupted.'.format(index, self.id))
+        self.file.write(data)
+        self.running_checksum = zlib.crc32(data, self.running_checksum)
+        self.received += 1
+        if self.is_complete():
+            self.checksum = total
+        return True
+
+    def is_complete(self):
+        return self.received == self.chunks
+
+    def finish(self):
+        """
+            Checks the whole payload and returns it (the file name or the bytes).
+        """
+        if self.running_checksum != self.checksum:
+            self.discard()
+            raise RuntimeError('Transfer {} is corrupted.'.format(self.id))
+        if self.file_name is None:
+            return self.file.getvalue()
+        self.file.close()
+        os.replace(self.file_name + '.part', self.file_name)
+        return self.file_name
+
+    def discard(self):
+        self.file.close()
+        if self.file_name is not None and os.path.exists(self.file_name + '.part'):
+            os.remove(self.file_name + '.part')
+
+
+class Transfers():
+    """
+        All transfers of one side (e.g. the server or a client) over any number of connections (clients with the channel
+        interface of base.network.NetworkClient, see attach()).
+
+        Progress is reported to callbacks: on_progress(transfer id, received or acknowledged bytes, size),
+        on_finished(transfer id, meta, result) for incoming transfers (result is the file name or the bytes) and for
+        outgoing transfers (result is None) and on_failed(transfer id, reason).
+    """
+
+    def __init__(self, folder=None, chunk_size=CHUNK_SIZE, window=WINDOW, accept_offers=True, max_size=MAX_SIZE):
+        """
+            Given a folder for incoming payloads (None for keeping them in memory), the chunk size and the window.
+
+            If accept_offers is False, only transfers we asked for (see expect()) are received, otherwise any offer up
+            to max_size bytes.
+        """
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.window = window
+        self.accept_offers = accept_offers
+        self.max_size = max_size
+        self.outgoing = {}
+        self.incoming = {}
+        self.expected = {}
+        self.on_progress = []
+        self.on_finished = []
+        self.on_failed = []
+
+    def attach(self, client):
+        """
+            Receive transfers and control messages on a connection.
+        """
+        client.connect_to_channel(c.CH_TRANSFER, self.received_transfer)
+        client.connect_to_channel(c.CH_TRANSFER_CONTROL, self.received_control)
+
+    def expect(self, max_size=None):
+        """
+            Allows the other side to send one payload of up to max_size bytes (default: the max_size of this object).
+            Returns the transfer id the sender must use (see send()).
+        """
+        transfer_id = uuid.uuid4().hex
+        self.expected[transfer_id] = max_size if max_size is not None else self.max_size
+        return transfer_id
+
+    def send(self, client, source, meta=None, transfer_id=None):
+        """
+            Starts sending a payload (file name or bytes) with some meta information. Returns the transfer id (a new
+            one unless the receiver gave one, see expect()).
+        """
+        if transfer_id is None:
+            transfer_id = uuid.uuid4().hex
+        transfer = OutgoingTransfer(transfer_id, source, meta, self.chunk_size)
+        transfer.client = client
+        self.outgoing[transfer.id] = transfer
+        client.send(c.CH_TRANSFER, {'transfer': transfer.id, 'offer': transfer.offer()})
+        self._send_window(transfer)
+        return transfer.id
+
+    def detach(self, client):
+        """
+            A connection was lost. Its outgoing transfers wait for a resume (for some time, older ones are dropped now),
+            its incoming transfers are dropped. (A receiver that wants to resume incoming transfers after a reconnect
+            does not detach but calls resume() with the new connection.)
+        """
+        for transfer in list(self.incoming.values()):
+            if transfer.client is client:
+                del self.incoming[transfer.id]
+                transfer.discard()
+                self._notify(self.on_failed, transfer.id, 'connection lost')
+        now = time.monotonic()
+        for transfer in list(self.outgoing.values()):
+            if transfer.client is client:
+                transfer.client = None
+                transfer.detached_since = now
+            elif transfer.detached_since is not None and now - transfer.detached_since > RESUME_TIMEOUT:
+                del self.outgoing[transfer.id]
+                transfer.close()
+                self._notify(self.on_failed, transfer.id, 'not resumed')
+
+    def resume(self, client):
+        """
+            After a reconnect, asks the sender to continue all incomplete incoming transfers on a new connection.
+        """
+        for transfer in self.incoming.values():
+            transfer.client = client
+            client.send(c.CH_TRANSFER_CONTROL, {'transfer': transfer.id, 'resume': transfer.received})
+
+    def cancel(self, transfer_id, reason='cancelled'):
+        """
+            Stops a transfer (tells the other side) and forgets it.
+        """
+        if transfer_id in self.outgoing:
+            transfer = self.outgoing.pop(transfer_id)
+            transfer.close()
+            if transfer.client is not None:
+                transfer.client.send(c.CH_TRANSFER, {'transfer': transfer_id, 'cancel': reason})
+        elif transfer_id in self.incoming:
+            transfer = self.incoming.pop(transfer_id)
+            transfer.discard()
+            self._notify(self.on_failed, transfer_id, reason)
+
+    def _send_window(self, transfer):
+        """
+            Sends chunks until the window is full (or the connection is lost while sending, see detach()).
+        """
+        end = min(transfer.acknowledged + self.window, transfer.chunks)
+        while transfer.next_chunk < end:
+            if transfer.client is None:
+                break
+            data = transfer.read_chunk(transfer.next_chunk)
+            message = {'transfer': transfer.id, 'chunk': transfer.next_chunk, 'data': data,
+                       'checksum': zlib.crc32(data)}
+            if transfer.next_chunk == transfer.chunks - 1:
+                message['total'] = transfer.checksum
+            transfer.client.send(c.CH_TRANSFER, message)
+            transfer.next_chunk += 1
+
+    def received_control(self, client, message):
+        """
+            The receiver acknowledged chunks, wants to resume or cancelled.
+        """
+        transfer = self.outgoing.get(message['transfer'], None)
+        if transfer is None:
+            if 'resume' in message:
+                # we do not know it (anymore)
+                client.send(c.CH_TRANSFER, {'transfer': message['transfer'], 'cancel': 'unknown transfer'})
+            return
+        if 'cancel' in message:
+            del self.outgoing[transfer.id]
+            transfer.close()
+            self._notify(self.on_failed, transfer.id, message['cancel'])
+            return
+        if 'resume' in message:
+            # continue on the new connection from the first missing chunk
+            transfer.client = client
+            transfer.detached_since = None
+            transfer.acknowledged = transfer.next_chunk = message['resume']
+        else:
+            if transfer.client is not client:
+                # acknowledgement from a lost connection
+                return
+            transfer.acknowledged = max(transfer.acknowledged, message['ack'])
+        self._notify(self.on_progress, transfer.id, min(transfer.acknowledged * transfer.chunk_size, transfer.size),
+                     transfer.size)
+        if transfer.acknowledged >= transfer.chunks:
+            del self.outgoing[transfer.id]
+            transfer.close()
+            self._notify(self.on_finished, transfer.id, transfer.meta, None)
+        else:
+            self._send_window(transfer)
+
+    def received_transfer(self, client, message):
+        """
+            An offer, a chunk or a cancel from the sender.
+        """
+        transfer_id = message['transfer']
+        if 'offer' in message:
+            reason = self._check_offer(transfer_id, message['offer'])
+            if reason is not None:
+                client.send(c.CH_TRANSFER_CONTROL, {'transfer': transfer_id, 'cancel': reason})
+                return
+            # never use the id given by the sender as file name
+            file_name = os.path.join(self.folder, uuid.uuid4().hex) if self.folder is not None else None
+            transfer = IncomingTransfer(transfer_id, message['offer'], file_name, client)
+            self.incoming[transfer_id] = transfer
+            self._notify(self.on_progress, transfer_id, 0, transfer.size)
+            if transfer.is_complete():
+                # nothing to send (empty payload)
+                client.send(c.CH_TRANSFER_CONTROL, {'transfer': transfer_id, 'ack': 0})
+                self._finish(transfer)
+            return
+        transfer = self.incoming.get(transfer_id, None)
+        if transfer is None:
+            return
+        if 'cancel' in message:
+            del self.incoming[transfer_id]
+            transfer.discard()
+            self._notify(self.on_failed, transfer_id, message['cancel'])
+            return
+        try:
+            if not transfer.add_chunk(message['chunk'], message['data'], message['checksum'],
+                                      message.get('total', None)):
+                return
+        except RuntimeError as e:
+            self.cancel(transfer_id, str(e))
+            client.send(c.CH_TRANSFER_CONTROL, {'transfer': transfer_id, 'cancel': str(e)})
+            return
+        client.send(c.CH_TRANSFER_CONTROL, {'transfer': transfer_id, 'ack': transfer.received})
+        self._notify(self.on_progress, transfer_id, min(transfer.received * transfer.chunk_size, transfer.size),
+                     transfer.size)
+        if transfer.is_complete():
+            self._finish(transfer)
+
+    def _check_offer(self, transfer_id, offer):
+        """
+            Returns why an offer is refused or None if it is accepted.
+        """
+        if not isinstance(transfer_id, str) or transfer_id in self.incoming:
+            return 'invalid transfer'
+        if transfer_id in self.expected:
+            max_size = self.expected.pop(transfer_id)
+        elif self.accept_offers:
+            max_size = self.max_size
+        else:
+            return 'not expected'
+        size, chunk_size = offer.get('size', None), offer.get('chunk size', None)
+        if type(size) is not int or type(chunk_size) is not int or size < 0 or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            return 'invalid offer'
+        if size > max_size:
+            return 'too large'
+        return None
+
+    def _finish(self, transfer):
+        del self.incoming[transfer.id]
+        try:
+            result = transfer.finish()
+        except RuntimeError as e:
+            self._notify(self.on_failed, transfer.id, str(e))
+            return
+        self._notify(self.on_finished, transfer.id, transfer.meta, result)
+
+    @staticmethod
+    def _notify(callbacks, *args):
+        for callback in callbacks:
+            callback(*args)
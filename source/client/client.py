@@ -22,6 +22,7 @@ from PySide import QtGui, QtCore
 
 import lib.graphics as g
 import lib.utils as u
+from lib.runlength import decode_to_pixels, row_segments
 from lib.browser import BrowserWidget
 import base.tools as t
 import base.constants as c
@@ -32,13 +33,13 @@ import client.graphics as cg
 import client.audio as audio
 from client.main_screen import GameMainScreen
 from client.editor import EditorScreen
+from server.monitor import ServerMonitorWidget
 
 """
     Starts the client and delivers most of the code reponsible for the main client screen and the diverse dialogs.
 """
 
 network_client = net.NetworkClient()
-network_client.set_socket()
 
 
 class MapItem(QtCore.QObject):
@@ -290,8 +291,6 @@ class SinglePlayerScenarioPreview(QtGui.QWidget):
         If a nation is selected the nation_selected signal is emitted with the nation name.
     """
 
-    CH_PREVIEW = 'SP.scenario-selection.preview'
-
     nation_selected = QtCore.Signal(str)
 
     def __init__(self, scenario_file):
@@ -301,20 +300,20 @@ class SinglePlayerScenarioPreview(QtGui.QWidget):
         """
         super().__init__()
 
-        # add a channel for us
-        network_client.connect_to_channel(self.CH_PREVIEW, self.received_preview)
-
-        # send a message and ask for preview
-        network_client.send(c.CH_SCENARIO_PREVIEW, {'scenario': scenario_file, 'reply-to': self.CH_PREVIEW})
+        # ask for the preview, the reply comes in received_preview
+        self.request = network_client.request(c.CH_SCENARIO_PREVIEW, {'scenario': scenario_file},
+                                              self.received_preview)
 
         self.selected_nation = None
 
-    def received_preview(self, client, message):
+    def received_preview(self, message):
         """
             Populates the widget after the network reply comes from the server with the preview.
         """
-        # immediately close the channel, we do not want to get this message twice
-        network_client.remove_channel(self.CH_PREVIEW)
+        if 'error' in message:
+            layout = QtGui.QVBoxLayout(self)
+            layout.addWidget(QtGui.QLabel('Preview not available ({}).'.format(message['error'])))
+            return
 
         # fill the widget with useful stuff
         layout = QtGui.QGridLayout(self)
@@ -373,12 +372,6 @@ class SinglePlayerScenarioPreview(QtGui.QWidget):
         rows = message[k.MAP_ROWS]
         self.map_scene.setSceneRect(0, 0, columns, rows)
 
-        # fill the ground layer with a neutral color
-        item = self.map_scene.addRect(0, 0, columns, rows)
-        item.setBrush(QtCore.Qt.lightGray)
-        item.setPen(g.TRANSPARENT_PEN)
-        item.setZValue(0)
-
         # text display
         self.map_name_item = self.map_scene.addSimpleText('')
         self.map_name_item.setPen(g.TRANSPARENT_PEN)
@@ -386,39 +379,27 @@ class SinglePlayerScenarioPreview(QtGui.QWidget):
         self.map_name_item.setZValue(3)
         self.map_name_item.setPos(0, 0)
 
-        # for all nations
-        for nation_id, nation in message['nations'].items():
-
-            # get nation color
-            color_string = nation['color']
-            color = QtGui.QColor()
-            color.setNamedColor(color_string)
-
-            # get nation name
-            nation_name = nation['name']
-
-            # get nation outline
-            path = QtGui.QPainterPath()
-            # TODO traversing everything is quite slow go only once and add to paths
-            for column in range(0, columns):
-                for row in range(0, rows):
-                    if nation_id == message['map'][column + row * columns]:
-                        path.addRect(column, row, 1, 1)
-            path = path.simplified()
-
-            item = MiniMapNationItem(path, 1, 2)
-            item.clicked.connect(partial(self.map_selected_nation, u.find_in_list(nation_names, nation_name)))
-            item.entered.connect(partial(self.change_map_name, nation_name))
-            item.left.connect(partial(self.change_map_name, ''))
-            brush = QtGui.QBrush(color)
-            item.setBrush(brush)
-
-            self.map_scene.addItem(item)
-            # item = self.map_scene.addPath(path, brush=brush) # will use the default pen for outline
+        # the nations map comes as palette (nation ids, -1 for no nation) and runs, decode it into a pixel buffer
+        self.map_palette = message['map']['palette']
+        self.map_runs = message['map']['runs']
+        self.map_columns = columns
+        colors = []
+        for nation_id in self.map_palette:
+            color = QtGui.QColor(QtCore.Qt.lightGray)  # neutral color for no nation
+            if nation_id in message['nations']:
+                color.setNamedColor(message['nations'][nation_id]['color'])
+            colors.append(color)
+        pixels = decode_to_pixels(self.map_runs, columns * rows)
+        item = cg.IndexedMapItem(pixels, columns, rows, colors, self.map_hovered, self.map_clicked)
+        item.setZValue(1)
+        self.map_scene.addItem(item)
+        self.map_colors = colors
+        self.map_nation_names = nation_names
+        self.map_highlight_item = None
 
         self.preview = message
 
-    def change_map_name(self, nation_name, event):
+    def change_map_name(self, nation_name):
         """
            Display of hoovered nation name.
 
@@ -426,11 +407,42 @@ class SinglePlayerScenarioPreview(QtGui.QWidget):
         """
         self.map_name_item.setText(nation_name)
 
-    def map_selected_nation(self, nation_row, event):
+    def map_hovered(self, index):
         """
-            Clicked on a nation in the map. Just selects the corresponding row in the nation table.
+            The mouse moved over another entry of the map palette (or left the map). Raise the hovered nation with an
+            effect (its outline is only built now, from the runs of the map) and display its name.
         """
-        self.nations_list.setCurrentRow(nation_row)
+        if self.map_highlight_item is not None:
+            self.map_scene.removeItem(self.map_highlight_item)
+            self.map_highlight_item = None
+        nation_id = self.map_palette[index] if index is not None else None
+        if nation_id not in self.preview['nations']:
+            self.change_map_name('')
+            return
+
+        path = QtGui.QPainterPath()
+        for segment_index, column, row, length in row_segments(self.map_runs, self.map_columns):
+            if segment_index == index:
+                path.addRect(column, row, length, 1)
+        item = MiniMapNationItem(path.simplified(), 1, 2)
+        item.setBrush(QtGui.QBrush(self.map_colors[index]))
+        # only for display, the map item below handles the mouse
+        item.setAcceptHoverEvents(False)
+        item.setAcceptedMouseButtons(QtCore.Qt.NoButton)
+        item.entered_item()
+        self.map_scene.addItem(item)
+        self.map_highlight_item = item
+
+        self.change_map_name(self.preview['nations'][nation_id][kn.NAME])
+
+    def map_clicked(self, index):
+        """
+            Clicked on the map. If it's a nation, selects the corresponding row in the nation table.
+        """
+        nation_id = self.map_palette[index]
+        if nation_id in self.preview['nations']:
+            nation_name = self.preview['nations'][nation_id][kn.NAME]
+            self.nations_list.setCurrentRow(u.find_in_list(self.map_nation_names, nation_name))
 
     def nations_list_selection_changed(self):
         """
@@ -453,8 +465,8 @@ class SinglePlayerScenarioPreview(QtGui.QWidget):
         """
             Interruption. Clean up network channels and the like.
         """
-        # network channel might still be open
-        network_client.remove_channel(self.CH_PREVIEW, ignore_not_existing=True)
+        # the reply might still be outstanding
+        self.request.cancel()
 
 
 class SinglePlayerScenarioTitleSelection(QtGui.QGroupBox):
@@ -466,8 +478,6 @@ class SinglePlayerScenarioTitleSelection(QtGui.QGroupBox):
 
     title_selected = QtCore.Signal(str)  # make sure to only connect with QtCore.Qt.QueuedConnection to this signal
 
-    CH_TITLES = 'SP.scenario-selection.titles'
-
     def __init__(self):
         """
 
@@ -475,40 +485,57 @@ class SinglePlayerScenarioTitleSelection(QtGui.QGroupBox):
         super().__init__()
         self.setTitle('Select Scenario')
         QtGui.QVBoxLayout(self)  # just set a standard layout
+        self.list = None
+        self.waiting_for_update = False
 
-        # add a channel for us
-        network_client.connect_to_channel(self.CH_TITLES, self.received_titles)
-
-        # send message and ask for scenario titles
-        network_client.send(c.CH_CORE_SCENARIO_TITLES, {'reply-to': self.CH_TITLES})
+        # ask for scenario titles, the reply comes in received_titles
+        self.request = network_client.request(c.CH_CORE_SCENARIO_TITLES, callback=self.received_titles)
 
-    def received_titles(self, client, message):
+    def received_titles(self, message):
         """
             Received all available scenario titles as a list together with the file names
             which act as unique identifiers. The list is sorted by title.
-        """
 
-        # immediately close the channel, we do not want to get this message twice
-        network_client.remove_channel(self.CH_TITLES)
+            If the server is still refreshing its catalog, the titles might be incomplete and the complete titles are
+            sent again later on the same channel.
+        """
+        if message.get('refreshing', False) and not self.waiting_for_update:
+            self.waiting_for_update = True
+            network_client.connect_to_channel(c.CH_CORE_SCENARIO_TITLES, self.received_updated_titles)
 
         # unpack message
-        scenario_titles, self.scenario_files = zip(*message['scenarios'])
-
-        # create list widget
-        self.list = QtGui.QListWidget()
-        self.list.itemSelectionChanged.connect(self.selection_changed)
-        self.list.setSelectionMode(QtGui.QAbstractItemView.SingleSelection)
-        self.list.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
-        self.list.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+        scenario_titles = [title for title, file_name in message['scenarios']]
+        self.scenario_files = [file_name for title, file_name in message['scenarios']]
+
+        # create list widget (or reuse it for updated titles)
+        if self.list is None:
+            self.list = QtGui.QListWidget()
+            self.list.itemSelectionChanged.connect(self.selection_changed)
+            self.list.setSelectionMode(QtGui.QAbstractItemView.SingleSelection)
+            self.list.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+            self.list.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+            self.layout().addWidget(self.list)
+        else:
+            self.list.clear()
         self.list.addItems(scenario_titles)
         # set size fixed to content, width at least 200px
         self.list.setFixedSize(max(self.list.sizeHintForColumn(0) + 2 * self.list.frameWidth(), 200),
                                self.list.sizeHintForRow(0) * self.list.count() + 2 * self.list.frameWidth())
 
-        self.layout().addWidget(self.list)
-
         # TODO if the height is higher than the window we may have to enable scroll bars, not now with one scenario though
 
+    def received_updated_titles(self, client, message):
+        """
+            The complete titles after the server finished refreshing its catalog.
+        """
+        self.stop_waiting_for_update()
+        self.received_titles(message)
+
+    def stop_waiting_for_update(self):
+        if self.waiting_for_update:
+            self.waiting_for_update = False
+            network_client.disconnect_from_channel(c.CH_CORE_SCENARIO_TITLES, self.received_updated_titles)
+
     def selection_changed(self):
         """
             A scenario title has been selected in the list.
@@ -523,8 +550,9 @@ class SinglePlayerScenarioTitleSelection(QtGui.QGroupBox):
         """
             Interruption. Clean up network channels and the like.
         """
-        # network channel might still be open
-        network_client.remove_channel(self.CH_TITLES, ignore_not_existing=True)
+        # the reply (or the update of the titles) might still be outstanding
+        self.request.cancel()
+        self.stop_waiting_for_update()
 
 
 class OptionsContentWidget(QtGui.QWidget):
@@ -911,7 +939,7 @@ class Client():
 
             Is invoked when pressing F2.
         """
-        monitor_widget = ServerMonitorWidget()
+        monitor_widget = ServerMonitorWidget(network_client)
         dialog = cg.GameDialog(self.main_window, monitor_widget, delete_on_close=True, title='Server Monitor')
         dialog.setFixedSize(QtCore.QSize(800, 600))
         dialog.show()
@@ -979,8 +1007,13 @@ def network_start():
         Starts the local server and connects the local client to it.
     """
 
-    # connect network client of client
-    network_client.connect_to_host(c.Network_Port)
+    # connect network client of client (locally if the server runs on the same machine)
+    if c.Local_Server_Name is not None:
+        network_client.set_socket(local=True)
+        network_client.connect_to_server(c.Local_Server_Name)
+    else:
+        network_client.set_socket()
+        network_client.connect_to_host(c.Network_Port)
 
     # TODO must be run at the end before app finishes
     # disconnect client
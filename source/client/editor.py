@@ -43,7 +43,7 @@ NEW_SCENARIO_DEFAULT_PROPERTIES = {
 }
 
 
-class EditorScenario(Scenario):
+class EditorScenario(QtCore.QObject, Scenario):
     """
         As a small wrapper this is a Scenario with a everything_changed signal that is emitted, if a new scenario is loaded.
         TODO Do we really need it or can we call the connected slot(s) also manually after loading?
@@ -51,6 +51,10 @@ class EditorScenario(Scenario):
 
     everything_changed = QtCore.Signal()
 
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        Scenario.__init__(self)
+
     def load(self, file_name):
         super().load(file_name)
         self.everything_changed.emit()
@@ -202,13 +206,11 @@ class EditorMiniMap(QtGui.QWidget):
             paths = {}
             for t in range(1, 7):
                 paths[t] = QtGui.QPainterPath()
-            for column in range(0, columns):
-                for row in range(0, rows):
-                    t = self.scenario.terrain_at(column, row)
-                    if t != 0:
-                        # not for sea
-                        sx, sy = self.scenario.scene_position(column, row)
-                        paths[t].addRect(sx * tile_width, sy * tile_height, tile_width, tile_height)
+            for index, t in enumerate(self.scenario.map_layer('terrain')):
+                if t != 0:
+                    # not for sea
+                    sx, sy = self.scenario.scene_position(index % columns, index // columns)
+                    paths[t].addRect(sx * tile_width, sy * tile_height, tile_width, tile_height)
             colors = {
                 1: QtCore.Qt.green,
                 2: QtCore.Qt.darkGreen,
@@ -332,13 +334,11 @@ class EditorMainMap(QtGui.QGraphicsView):
         paths = {}
         for t in range(1, 7):
             paths[t] = QtGui.QPainterPath()
-        for column in range(0, columns):
-            for row in range(0, rows):
-                t = self.scenario.terrain_at(column, row)
-                if t != 0:
-                    # not for sea
-                    sx, sy = self.scenario.scene_position(column, row)
-                    paths[t].addRect(sx * self.TILE_SIZE, sy * self.TILE_SIZE, self.TILE_SIZE, self.TILE_SIZE)
+        for index, t in enumerate(self.scenario.map_layer('terrain')):
+            if t != 0:
+                # not for sea
+                sx, sy = self.scenario.scene_position(index % columns, index // columns)
+                paths[t].addRect(sx * self.TILE_SIZE, sy * self.TILE_SIZE, self.TILE_SIZE, self.TILE_SIZE)
         for t in paths:
             path = paths[t]
             path = path.simplified()
@@ -797,7 +797,7 @@ class EditorScreen(QtGui.QWidget):
             QtGui.QFileDialog.getSaveFileName(self, 'Save Scenario', c.Scenario_Folder, 'Scenario Files (*.scenario)')[
                 0]
         if file_name:
-            self.scenario.save(file_name)
+            self.scenario.save_binary(file_name)
             path, name = os.path.split(file_name)
             self.client.schedule_notification('Saved to {}'.format(name))
 
@@ -134,4 +134,54 @@ class MiniMapNationItem(g.ClickablePathItem):
             Set the z value and disables the hover effect.
         """
         self.hover_effect.setEnabled(False)
-        self.setZValue(self.z_left)
\ No newline at end of file
+        self.setZValue(self.z_left)
+
+
+class IndexedMapItem(QtGui.QGraphicsPixmapItem):
+    """
+        A map with one pixel per tile drawn from a pixel buffer of palette indices (see lib.runlength). Reports the
+        palette index under the mouse (or None when leaving) to a hovered callback and clicked palette indices to a
+        clicked callback.
+    """
+
+    def __init__(self, pixels, columns, rows, colors, hovered, clicked):
+        """
+            Given the pixel buffer (bytearray, one palette index per tile), the size of the map, the colors of the
+            palette entries (list of QtGui.QColor) and the callbacks.
+        """
+        image = QtGui.QImage(bytes(pixels), columns, rows, columns, QtGui.QImage.Format_Indexed8).copy()
+        image.setColorTable([color.rgba() for color in colors])
+        super().__init__(QtGui.QPixmap.fromImage(image))
+        self.pixels = pixels
+        self.columns = columns
+        self.rows = rows
+        self.hovered = hovered
+        self.clicked = clicked
+        self.hovered_index = None
+        self.setAcceptHoverEvents(True)
+        self.setAcceptedMouseButtons(QtCore.Qt.LeftButton)
+
+    def index_at(self, position):
+        """
+            The palette index at a position in item coordinates (or None if outside).
+        """
+        column = int(position.x())
+        row = int(position.y())
+        if 0 <= column < self.columns and 0 <= row < self.rows:
+            return self.pixels[row * self.columns + column]
+        return None
+
+    def hoverMoveEvent(self, event):
+        index = self.index_at(event.pos())
+        if index != self.hovered_index:
+            self.hovered_index = index
+            self.hovered(index)
+
+    def hoverLeaveEvent(self, event):
+        self.hovered_index = None
+        self.hovered(None)
+
+    def mousePressEvent(self, event):
+        index = self.index_at(event.pos())
+        if index is not None:
+            self.clicked(index)
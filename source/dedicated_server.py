@@ -0,0 +1,57 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Starts a headless dedicated server (asyncio based, no Qt needed).
+    Start in project root folder with an optional port, 'any' as second parameter to listen on all interfaces and the
+    number of shards (worker processes, see server.sharding) as third parameter ('auto' for one per core).
+"""
+
+if __name__ == '__main__':
+
+    import sys
+
+    # test for python version
+    required_version = (3, 5)
+    if sys.version_info < required_version:
+        raise RuntimeError('Python version must be {}.{} at least.'.format(*required_version))
+
+    import os
+    import signal
+
+    from base import constants as c
+    from server.headless import HeadlessServer
+    from server.sharding import ShardedServer
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else c.Network_Port
+    scope = sys.argv[2] if len(sys.argv) > 2 else 'local'
+    shards = sys.argv[3] if len(sys.argv) > 3 else '0'
+    shards = os.cpu_count() or 1 if shards == 'auto' else int(shards)
+
+    # with shards the front process only forwards connections
+    if shards > 0:
+        server = ShardedServer(port, shards, scope)
+        print('{} shards on ports {} to {}'.format(shards, port + 1, port + shards))
+    else:
+        server = HeadlessServer(port, scope)
+
+    # stop on Ctrl+C or kill
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *args: server.stop())
+
+    print('headless server listening on port {}'.format(port))
+    server.run()
+    print('headless server stopped')
@@ -0,0 +1,100 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import bz2
+import lzma
+import zlib
+
+"""
+    Compression algorithms for messages (only Python standard library, not Qt). Each algorithm has an id (index in
+    COMPRESSIONS) that fits into three bits.
+
+    'zlib-dictionary' is raw deflate with a preset dictionary (which both sides must have), small messages with common
+    content compress much better with it.
+"""
+
+COMPRESSIONS = ('none', 'zlib', 'zlib-dictionary', 'lzma', 'bz2')
+
+# decompressed data larger than this (in bytes) is rejected (protection against compression bombs)
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+# default levels (used if no level is given)
+DEFAULT_LEVELS = {
+    'zlib': 6,
+    'zlib-dictionary': 6,
+    'lzma': 1,
+    'bz2': 9
+}
+
+
+def compression_id(name):
+    """
+        Returns the id of a compression algorithm given its name.
+    """
+    if name not in COMPRESSIONS:
+        raise RuntimeError('Unknown compression {}.'.format(name))
+    return COMPRESSIONS.index(name)
+
+
+def compress(data, name, level=None, dictionary=None):
+    """
+        Compresses bytes with an algorithm (name), a level (or the default level) and for 'zlib-dictionary' a preset
+        dictionary.
+    """
+    if name == 'none':
+        return data
+    if level is None:
+        level = DEFAULT_LEVELS[name]
+    if name == 'zlib':
+        return zlib.compress(data, level)
+    if name == 'zlib-dictionary':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY,
+                                      dictionary)
+        return compressor.compress(data) + compressor.flush()
+    if name == 'lzma':
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=[{'id': lzma.FILTER_LZMA2, 'preset': level}])
+    if name == 'bz2':
+        return bz2.compress(data, level)
+    raise RuntimeError('Unknown compression {}.'.format(name))
+
+
+def decompress(data, name, dictionary=None, max_size=MAX_DECOMPRESSED_SIZE):
+    """
+        Decompresses bytes that were compressed with an algorithm (name) and, for 'zlib-dictionary', a preset dictionary.
+        Raises a RuntimeError if the result would be larger than max_size bytes (without ever producing more).
+    """
+    if name == 'none':
+        result = data
+    elif name == 'zlib' or name == 'zlib-dictionary':
+        if name == 'zlib':
+            decompressor = zlib.decompressobj()
+        else:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, dictionary)
+        result = decompressor.decompress(data, max_size + 1)
+        if decompressor.unconsumed_tail:
+            result += b'\0'  # there is more
+        elif len(result) <= max_size:
+            result += decompressor.flush()
+    elif name == 'lzma':
+        decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=[{'id': lzma.FILTER_LZMA2}])
+        result = decompressor.decompress(data, max_size + 1)
+    elif name == 'bz2':
+        result = bz2.BZ2Decompressor().decompress(data, max_size + 1)
+    else:
+        raise RuntimeError('Unknown compression {}.'.format(name))
+    if len(result) > max_size:
+        raise RuntimeError('Decompressed data exceeds {} bytes.'.format(max_size))
+    return result
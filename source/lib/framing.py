@@ -0,0 +1,82 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import struct
+
+"""
+    Length prefixed framing of messages on a byte stream (like TCP), independent of the transport (not Qt).
+
+    Each frame is a 4 byte unsigned length (big endian, same as a QByteArray in a QDataStream) followed by that many
+    bytes.
+"""
+
+FRAME_HEADER = struct.Struct('>I')
+
+# default maximal size of a frame (larger frames are considered an error and not buffered)
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+def frame(data):
+    """
+        Puts the length in front of the data.
+    """
+    return FRAME_HEADER.pack(len(data)) + data
+
+
+class FrameBuffer():
+    """
+        Receive buffer for a stream. Accumulates arbitrary chunks of received bytes and returns all complete frames.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        """
+            Start with an empty buffer.
+        """
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+            Appends received data and returns a list of the contents of all frames that are complete now (possibly
+            empty). Raises an error if a frame announces a size larger than the maximal frame size or is empty (every
+            message has at least a header, see lib.protocol).
+        """
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        position = 0
+        available = len(buffer)
+        while available - position >= FRAME_HEADER.size:
+            length = FRAME_HEADER.unpack_from(buffer, position)[0]
+            if length == 0:
+                raise RuntimeError('Empty frame.')
+            if length > self.max_frame_size:
+                raise RuntimeError('Frame of size {} exceeds the maximal size {}.'.format(length, self.max_frame_size))
+            start = position + FRAME_HEADER.size
+            if available - start < length:
+                # incomplete, wait for more
+                break
+            frames.append(bytes(buffer[start:start + length]))
+            position = start + length
+        # remove everything consumed at once
+        del buffer[:position]
+        return frames
+
+    def pending(self):
+        """
+            Number of bytes of incomplete frames in the buffer.
+        """
+        return len(self.buffer)
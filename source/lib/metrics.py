@@ -0,0 +1,170 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import bisect
+
+"""
+    Collection of network metrics (not Qt): message counts and bytes per channel and histograms of durations (encoding,
+    decoding, handlers).
+"""
+
+# upper bounds of the buckets of duration histograms in seconds (10 microseconds to 10 seconds, 3 per decade)
+DURATION_BOUNDS = tuple(m * 10 ** e for e in range(-5, 1) for m in (1, 2, 5)) + (10,)
+
+
+class Histogram():
+    """
+        Counts values in buckets (given by their upper bounds, plus one bucket for larger values) and keeps the count,
+        total and maximum of all values.
+    """
+
+    def __init__(self, bounds=DURATION_BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        """
+            Adds a value.
+        """
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+            Estimates a quantile (0 <= q <= 1) by the upper bound of the bucket it falls in (the maximum for the last
+            bucket).
+        """
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for index, number in enumerate(self.buckets):
+            seen += number
+            if seen >= rank and number > 0:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        """
+            Summary as a dict of plain values (can be sent as a message).
+        """
+        return {
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'mean': self.total / self.count if self.count else 0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': list(self.buckets)
+        }
+
+
+class ChannelMetrics():
+    """
+        Number of messages and bytes received and sent on a channel. Raw bytes are after serialization, wire bytes after
+        compression.
+    """
+
+    def __init__(self):
+        self.received = 0
+        self.received_raw_bytes = 0
+        self.received_wire_bytes = 0
+        self.sent = 0
+        self.sent_raw_bytes = 0
+        self.sent_wire_bytes = 0
+        self.handler = Histogram()
+
+    def snapshot(self):
+        return {
+            'received': self.received,
+            'received raw bytes': self.received_raw_bytes,
+            'received wire bytes': self.received_wire_bytes,
+            'sent': self.sent,
+            'sent raw bytes': self.sent_raw_bytes,
+            'sent wire bytes': self.sent_wire_bytes,
+            'handler': self.handler.snapshot()
+        }
+
+
+class Metrics():
+    """
+        The metrics of many connections together, by channel. Channels starting with one of the grouped prefixes (e.g.
+        unique reply channels) are counted together under the prefix followed by '*'.
+    """
+
+    def __init__(self, grouped_prefixes=()):
+        self.grouped_prefixes = tuple(grouped_prefixes)
+        self.channels = {}
+        self.encode = Histogram()
+        self.decode = Histogram()
+
+    def channel(self, channel_name):
+        """
+            The metrics of a channel (created if not existing, shared by all channels of a grouped prefix).
+        """
+        metrics = self.channels.get(channel_name)
+        if metrics is None:
+            for prefix in self.grouped_prefixes:
+                if channel_name.startswith(prefix):
+                    channel_name = prefix + '*'
+                    metrics = self.channels.get(channel_name)
+                    break
+        if metrics is None:
+            metrics = self.channels[channel_name] = ChannelMetrics()
+        return metrics
+
+    def record_sent(self, channel_name, raw_bytes, wire_bytes, duration=None):
+        """
+            A message was encoded (taking duration seconds, None if it was encoded before) and sent.
+        """
+        metrics = self.channel(channel_name)
+        metrics.sent += 1
+        metrics.sent_raw_bytes += raw_bytes
+        metrics.sent_wire_bytes += wire_bytes
+        if duration is not None:
+            self.encode.observe(duration)
+
+    def record_received(self, channel_name, raw_bytes, wire_bytes, duration):
+        """
+            A message was received and decoded (taking duration seconds).
+        """
+        metrics = self.channel(channel_name)
+        metrics.received += 1
+        metrics.received_raw_bytes += raw_bytes
+        metrics.received_wire_bytes += wire_bytes
+        self.decode.observe(duration)
+
+    def record_handled(self, channel_name, duration):
+        """
+            The handlers of a received message took duration seconds.
+        """
+        self.channel(channel_name).handler.observe(duration)
+
+    def snapshot(self):
+        """
+            Summary of everything as a dict of plain values (can be sent as a message).
+        """
+        return {
+            'channels': {name: metrics.snapshot() for name, metrics in self.channels.items()},
+            'encode': self.encode.snapshot(),
+            'decode': self.decode.snapshot()
+        }
@@ -14,14 +14,18 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-import zlib
+import time
 
-import yaml
 from PySide import QtCore, QtNetwork
 
+from lib.framing import frame, FrameBuffer, MAX_FRAME_SIZE
+from lib import protocol as p
+
 """
-    Basic general network functionality (client and server) wrapping around QtNetwork.QTcpSocket. Messages are sent using
-    yaml (for serialization) and zlib (for compression).
+    Basic general network functionality (client and server) wrapping around QtNetwork.QTcpSocket (or
+    QtNetwork.QLocalSocket for connections on the same machine, a Unix domain socket or named pipe). Messages are
+    serialized and compressed as negotiated per connection (see lib.protocol) and framed by a length prefix (see
+    lib.framing).
 """
 
 SCOPE = {
@@ -32,108 +36,348 @@ SCOPE = {
 
 class Client(QtCore.QObject):
     """
-        Wrapper around QtNetwork.QTcpSocket (set it from outside via set_socket(..)).
+        Wrapper around QtNetwork.QTcpSocket or QtNetwork.QLocalSocket (set it from outside via set_socket(..)).
+
+        Additionally sends and reads messages via serialization (codec), compression and framing (length prefix).
 
-        Additionally sends and reads messages via serialization (yaml), compression (zlib) and wrapping (QByteArray).
+        The side that connects (connect_to_host) starts a handshake with the codecs and compressions it supports, the
+        other side chooses (see lib.protocol.Protocol) and answers. Afterwards both send with these.
     """
     connected = QtCore.Signal()
     disconnected = QtCore.Signal()
-    error = QtCore.Signal(QtNetwork.QAbstractSocket.SocketError)
+    error = QtCore.Signal(object)  # QAbstractSocket.SocketError or QLocalSocket.LocalSocketError
     received = QtCore.Signal(object)
+    congested = QtCore.Signal()
+    drained = QtCore.Signal()
 
-    def __init__(self):
+    def __init__(self, protocol=None, max_frame_size=MAX_FRAME_SIZE):
         """
-            Initially we do not have any socket and no bytes are written.
+            Initially we do not have any socket and no bytes are written. The protocol (lib.protocol.Protocol, default
+            settings if None) holds the supported and negotiated codecs and compressions. Received messages larger than
+            the maximal frame size abort the connection.
         """
         super().__init__()
         self.socket = None
         self.bytes_written = 0
+        self.frame_buffer = FrameBuffer(max_frame_size)
+        self.protocol = protocol if protocol is not None else p.Protocol()
+
+        # send queue (see set_coalescing)
+        self.coalescing = False
+        self.batch_compression = False
+        self.max_queued_bytes = 0
+        self.send_queue = []
+        self.queued_bytes = 0
+        self.flush_timer = QtCore.QTimer()
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.timeout.connect(self.flush)
+
+        # backpressure (see set_watermarks)
+        self.high_watermark = None
+        self.low_watermark = None
+        self.overflow_policy = None
+        self.is_congested = False
+        self.holding = False
+        self.overflowed = False
+        self.dropped_messages = 0
+
+        # measurements (see ping and lib.metrics)
+        self.metrics = None
+        self.round_trip_time = None
+
+    def set_coalescing(self, enabled=True, interval=0, max_queued_bytes=64 * 1024, batch_compression=False):
+        """
+            With coalescing, messages are not written immediately but queued and written together (in order) with a
+            single write. The queue is flushed after interval milliseconds (0 means at the end of the current event loop
+            iteration) or as soon as it holds max_queued_bytes. With batch compression the queued messages are sent
+            uncompressed and compressed together as a single batch message.
+        """
+        if not enabled:
+            self.flush()
+        self.coalescing = enabled
+        self.flush_timer.setInterval(interval)
+        self.max_queued_bytes = max_queued_bytes
+        self.batch_compression = batch_compression
 
-    def set_socket(self, socket=None):
+    def set_watermarks(self, high, low, policy='disconnect'):
         """
-            Set a socket (from outside) and does some wiring. If socket is None, a new one is created.
+            Limits the outbound data of this connection (not yet written by the socket plus queued). If sending a
+            message would exceed the high watermark (in bytes), the connection is congested (congested signal, producers
+            should pause) and the policy decides what happens to the message:
+              'drop' - the message is dropped
+              'coalesce' - the message is held in the send queue (written as soon as the connection drained), as long as
+                           the held messages do not exceed the high watermark themselves, then disconnect
+              'disconnect' - the connection is aborted
+            The policy can also be a function taking the client and the encoded message and returning one of these.
+            Once the outbound data (without held messages) falls to the low watermark, the drained signal is emitted.
+            High = None means no limits.
+        """
+        self.high_watermark = high
+        self.low_watermark = low
+        self.overflow_policy = policy
+
+    def outbound_bytes(self):
+        """
+            Number of bytes that were sent but are not yet written (socket buffer and send queue).
+        """
+        return self.socket.bytesToWrite() + self.queued_bytes
+
+    def set_socket(self, socket=None, local=False):
+        """
+            Set a socket (from outside) and does some wiring. If socket is None, a new one is created (a local socket
+            if local is True). Messages on local sockets are never compressed.
         """
         # only if no socket is set before
         if self.socket is not None:
             raise RuntimeError('Socket already set!')
         # or if none is set, just create one
         if socket is None:
-            socket = QtNetwork.QTcpSocket()
+            socket = QtNetwork.QLocalSocket() if local else QtNetwork.QTcpSocket()
         # store in local variable
         self.socket = socket
+        if self.is_local():
+            self.protocol.disable_compression()
         # new data is handled by receive()
         self.socket.readyRead.connect(self.receive)
         self.socket.error.connect(self.error)
         self.socket.connected.connect(self.connected)
+        self.socket.connected.connect(self.start_handshake)
         self.socket.disconnected.connect(self.disconnected)
         self.socket.bytesWritten.connect(self.count_bytes_written)
 
+    def is_local(self):
+        """
+            True if the socket is a local socket.
+        """
+        return isinstance(self.socket, QtNetwork.QLocalSocket)
+
     def disconnect_from_host(self):
         """
             If you want to disconnect, just call this method which basically just calls the same method on the socket.
         """
-        self.socket.disconnectFromHost()
+        self.flush()
+        if self.is_local():
+            self.socket.disconnectFromServer()
+        else:
+            self.socket.disconnectFromHost()
 
     def connect_to_host(self, port, host='local'):
         """
             If you want to connect
         """
-        if host is 'local':
+        if host == 'local':
             host = SCOPE['local']
         self.socket.connectToHost(host, port)
 
+    def connect_to_server(self, name):
+        """
+            Connects a local socket to a local server with a name (see Server.start_local).
+        """
+        self.socket.connectToServer(name)
+
     def receive(self):
         """
-            While there are messages available read them and process them.
-            Reading is reading of a QByteArray from the TCPSocket, uncompressing and deserializing.
+            Reads everything available from the socket into the receive buffer and processes all complete messages.
+            Incomplete messages stay in the buffer until the rest arrives.
         """
-        while self.socket.bytesAvailable() > 0:
-            # read a QByteArray using a data stream
-            reader = QtCore.QDataStream(self.socket)
-            bytearray = QtCore.QByteArray()
-            reader >> bytearray
+        try:
+            frames = self.frame_buffer.feed(self.socket.readAll().data())
+        except RuntimeError as e:
+            # we cannot resynchronize the stream, give up on this connection
+            print('aborting connection: {}'.format(e))
+            self.socket.abort()
+            return
 
-            # uncompress bytes from bytearray
-            uncompressed = zlib.decompress(bytearray.data())
+        self.process_frames(frames)
 
-            # security validator (check for everything that we do not like (!!python)
-            # TODO implement this
+    def process_frames(self, frames):
+        """
+            Decodes and processes received messages (including batches of messages).
+        """
+        for data in frames:
+            # a bad message is reported, but does not end the connection or the processing of the following messages
+            try:
+                self.process_message(data)
+            except Exception as e:
+                print('received message failed: {!r}'.format(e))
+
+    def process_message(self, data):
+        """
+            Decodes and processes a single received message (or batch of messages).
+        """
+        if p.is_batch(data):
+            # the content of the batch is a stream of complete frames
+            self.process_frames(FrameBuffer(self.frame_buffer.max_frame_size).feed(self.protocol.decode_batch(data)))
+            return
 
-            # decode from utf-8 bytes to unicode and deserialize from yaml
-            value = yaml.load(uncompressed.decode())
+        # uncompress and deserialize
+        value = self.decode(data)
 
+        if p.is_control(data):
+            self.process_control(value)
+        else:
             # print('connection id {} received {}'.format(self.id, value))
             self.received.emit(value)
 
-    def send(self, value):
+    def send(self, value, compress=True):
         """
             We send a message back to the client.
-            We do it by serialization, compressing and writing of a QByteArray to the TCPSocket.
+            We do it by serialization, compressing (unless compress is False or the message is small) and writing of a
+            frame to the TCPSocket.
+        """
+        # with batch compression everything is compressed later together
+        if compress:
+            self.send_bytes(self.encode_for_sending(value))
+        else:
+            self.send_bytes(self.protocol.encode(value, False))
+
+    def send_settings(self):
+        """
+            The settings send() encodes with. Clients with equal settings send identical bytes for the same message, so
+            a message sent to many of them only needs to be encoded once (see encode_for_sending()).
+        """
+        return self.protocol.settings(), not (self.coalescing and self.batch_compression)
+
+    def encode_for_sending(self, value):
+        """
+            Encodes a message exactly like send() would, to be sent (with send_bytes()) to all clients with equal send
+            settings.
+        """
+        compress = not (self.coalescing and self.batch_compression)
+        return self.protocol.encode(value, compress)
+
+    def send_bytes(self, data):
+        """
+            Sends an already serialized and compressed message (see encode()) by writing a frame to the TCPSocket
+            (or putting it in the send queue if coalescing). Useful if the same message is sent many times.
+        """
+        if self.high_watermark is not None and self.outbound_bytes() + len(data) > self.high_watermark:
+            if not self.is_congested:
+                self.is_congested = True
+                self.congested.emit()
+            policy = self.overflow_policy
+            if callable(policy):
+                policy = policy(self, data)
+            if policy == 'drop':
+                self.dropped_messages += 1
+                return
+            if policy == 'coalesce' and self.queued_bytes + len(data) <= self.high_watermark:
+                # hold in the send queue until drained
+                self.holding = True
+                self.send_queue.append(frame(data))
+                self.queued_bytes += len(data)
+                # if the socket has nothing to write, count_bytes_written will never be called, drain now
+                self.check_drained()
+                return
+            if not self.overflowed:
+                print('aborting connection: outbound data exceeds {} bytes'.format(self.high_watermark))
+                self.overflowed = True
+                self.socket.abort()
+            return
+
+        if not self.coalescing and not self.holding:
+            self.socket.write(QtCore.QByteArray(frame(data)))
+            return
+
+        self.send_queue.append(frame(data))
+        self.queued_bytes += len(data)
+        if self.holding:
+            self.check_drained()
+        elif self.queued_bytes >= self.max_queued_bytes:
+            self.flush()
+        elif not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        """
+            Writes all queued messages with a single write (as a batch message if batch compression is on).
+        """
+        self.flush_timer.stop()
+        if not self.send_queue or self.holding:
+            return
+        if self.batch_compression and len(self.send_queue) > 1:
+            data = frame(self.protocol.encode_batch(self.send_queue))
+        else:
+            data = b''.join(self.send_queue)
+        self.send_queue = []
+        self.queued_bytes = 0
+        self.socket.write(QtCore.QByteArray(data))
+
+    def start_handshake(self):
+        """
+            We connected to a host. Tell which codecs and compressions we support.
+        """
+        self.send_control(self.protocol.hello())
+
+    def ping(self):
+        """
+            Measures the round trip time (see round_trip_time), the other side answers with a pong.
         """
-        # serialize value to yaml
-        serialized = yaml.dump(value, allow_unicode=True)
+        self.send_control({'ping': time.perf_counter()})
 
-        # encode to utf-8 bytes and compress
-        compressed = zlib.compress(serialized.encode())
+    def process_control(self, value):
+        """
+            A control message was received (part of the handshake or a ping/pong), answer if needed.
+        """
+        if 'ping' in value:
+            self.send_control({'pong': value['ping']})
+            return
+        if 'pong' in value:
+            self.round_trip_time = time.perf_counter() - value['pong']
+            return
+        answer = self.protocol.process_control(value)
+        if answer is not None:
+            self.send_control(answer)
+
+    def send_control(self, value):
+        """
+            Sends a control message.
+        """
+        self.send_bytes(p.Protocol.encode_control(value))
 
-        # wrap in QByteArray
-        bytearray = QtCore.QByteArray(compressed)
+    @staticmethod
+    def encode(value):
+        """
+            Serializes and compresses a value with settings every client can decode (most preferred codec, zlib).
+        """
+        return p.encode(value)
 
-        # write using a data stream
-        writer = QtCore.QDataStream(self.socket)
-        writer.setVersion(QtCore.QDataStream.Qt_4_8)
-        writer << bytearray
+    def decode(self, data):
+        """
+            Uncompresses and deserializes bytes to a value. Inverse of encode() and of what send() sends.
+        """
+        return self.protocol.decode(data)
 
     def count_bytes_written(self, bytes):
+        """
+            The socket has written some bytes. Count them and check if a congested connection has drained.
+        """
         self.bytes_written += bytes
+        self.check_drained()
+
+    def check_drained(self):
+        """
+            A congested connection has drained if the data waiting to be written is below the low watermark. Then held
+            messages are written.
+        """
+        # held messages are not counted, they will be written now
+        if self.is_congested and self.socket.bytesToWrite() + (0 if self.holding else self.queued_bytes) <= \
+                self.low_watermark:
+            self.is_congested = False
+            if self.holding:
+                self.holding = False
+                self.flush()
+            self.drained.emit()
 
 
 class Server(QtCore.QObject):
     """
         Wrapper around QtNetwork.QTcpServer and a management of several clients (each a QtNetwork.QTcpSocket).
+
+        Can additionally listen for local connections (see start_local), these clients are QtNetwork.QLocalSocket.
     """
 
-    new_client = QtCore.Signal(QtNetwork.QTcpSocket)
+    new_client = QtCore.Signal(QtCore.QObject)
 
     def __init__(self):
         """
@@ -141,6 +385,7 @@ class Server(QtCore.QObject):
         super().__init__()
         self.server = QtNetwork.QTcpServer(self)
         self.server.newConnection.connect(self.new_connection)
+        self.local_server = None
 
     def start(self, port, scope='local'):
         """
@@ -151,6 +396,17 @@ class Server(QtCore.QObject):
         if not self.server.listen(host, port):
             raise RuntimeError('Network error: cannot listen')
 
+    def start_local(self, name):
+        """
+            Additionally listens for local connections under a name (a Unix domain socket or a named pipe). A stale
+            server of the same name (left over after a crash) is removed before.
+        """
+        QtNetwork.QLocalServer.removeServer(name)
+        self.local_server = QtNetwork.QLocalServer(self)
+        self.local_server.newConnection.connect(self.new_local_connection)
+        if not self.local_server.listen(name):
+            raise RuntimeError('Network error: cannot listen on {}'.format(name))
+
     def is_listening(self):
         return self.server.isListening()
 
@@ -167,6 +423,9 @@ class Server(QtCore.QObject):
         """
         if self.is_listening():
             self.server.close()
+        if self.local_server is not None:
+            self.local_server.close()
+            self.local_server = None
 
     def new_connection(self):
         """
@@ -177,3 +436,12 @@ class Server(QtCore.QObject):
             socket = self.server.nextPendingConnection()
             # emit signal
             self.new_client.emit(socket)
+
+    def new_local_connection(self):
+        """
+            Zero or more new local clients might be available, emit new_client signal for each of them.
+        """
+        while self.local_server.hasPendingConnections():
+            # returns a new QLocalSocket
+            socket = self.local_server.nextPendingConnection()
+            self.new_client.emit(socket)
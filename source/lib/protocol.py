@@ -0,0 +1,251 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import zlib
+
+from lib.compression import COMPRESSIONS, compression_id, compress, decompress
+from lib.serialization import get_codec
+
+"""
+    Encoding of messages (serialization, compression, header) and the handshake at the start of a connection,
+    independent of the transport (not Qt).
+
+    Each message starts with a header byte: the id of the codec (bits 0-3), the id of the compression (bits 4-6) and a
+    flag for control messages (bit 7, used for the handshake).
+
+    A batch is a message with the special codec id BATCH_CODEC_ID. Its content are several complete framed messages
+    compressed together.
+"""
+
+# codecs and compressions in order of preference, until negotiation messages are sent with the initial ones
+PREFERRED_CODECS = ('binary', 'yaml')
+INITIAL_CODEC = 'yaml'
+PREFERRED_COMPRESSIONS = ('zlib-dictionary', 'zlib', 'none')
+INITIAL_COMPRESSION = 'zlib'
+
+# messages smaller than this (in bytes after serialization) are not compressed
+COMPRESSION_THRESHOLD = 32
+
+# header byte of each message
+HEADER_CODEC_MASK = 0x0f
+HEADER_COMPRESSION_SHIFT = 4
+HEADER_COMPRESSION_MASK = 0x70
+HEADER_CONTROL = 0x80
+
+# codec id reserved for batches of messages
+BATCH_CODEC_ID = 0x0f
+
+
+def encode(value, codec=None, compression=INITIAL_COMPRESSION, level=None, dictionary=None,
+           threshold=COMPRESSION_THRESHOLD, flags=0):
+    """
+        Serializes (with a codec, by default the most preferred one) and compresses (unless the message is smaller
+        than the threshold or would not get smaller) a value to bytes and puts a header byte (codec id, compression id
+        and flags) in front.
+    """
+    return _encode(value, codec, compression, level, dictionary, threshold, flags)[0]
+
+
+def _encode(value, codec, compression, level, dictionary, threshold, flags):
+    """
+        Like encode(), but returns the encoded message and the number of serialized (uncompressed) bytes.
+    """
+    if codec is None:
+        codec = get_codec(PREFERRED_CODECS[0])
+    data = codec.dumps(value)
+    if compression != 'none' and len(data) >= threshold:
+        compressed = compress(data, compression, level, dictionary)
+        if len(compressed) < len(data):
+            header = codec.id | compression_id(compression) << HEADER_COMPRESSION_SHIFT | flags
+            return bytes((header,)) + compressed, len(data)
+    return bytes((codec.id | flags,)) + data, len(data)
+
+
+def decode(data, dictionary=None):
+    """
+        Uncompresses and deserializes bytes (codec and compression are given in the header byte) to a value. Inverse
+        of encode().
+    """
+    return _decode(data, dictionary)[0]
+
+
+def _decode(data, dictionary):
+    """
+        Like decode(), but returns the value and the number of serialized (uncompressed) bytes.
+    """
+    header = data[0]
+    codec = get_codec(header & HEADER_CODEC_MASK)
+    compression = COMPRESSIONS[(header & HEADER_COMPRESSION_MASK) >> HEADER_COMPRESSION_SHIFT]
+    raw = decompress(data[1:], compression, dictionary)
+    return codec.loads(raw), len(raw)
+
+
+def encode_batch(frames, compression=INITIAL_COMPRESSION, level=None, dictionary=None):
+    """
+        Compresses several framed messages (see lib.framing) together into a single batch message.
+    """
+    data = b''.join(frames)
+    if compression != 'none':
+        data = compress(data, compression, level, dictionary)
+    return bytes((BATCH_CODEC_ID | compression_id(compression) << HEADER_COMPRESSION_SHIFT,)) + data
+
+
+def decode_batch(data, dictionary=None):
+    """
+        Returns the uncompressed content of a batch message (framed messages).
+    """
+    compression = COMPRESSIONS[(data[0] & HEADER_COMPRESSION_MASK) >> HEADER_COMPRESSION_SHIFT]
+    return decompress(data[1:], compression, dictionary)
+
+
+def is_batch(data):
+    """
+        True if an encoded message is a batch of messages.
+    """
+    return data[0] & HEADER_CODEC_MASK == BATCH_CODEC_ID
+
+
+def is_control(data):
+    """
+        True if an encoded message is a control message.
+    """
+    return data[0] & HEADER_CONTROL != 0
+
+
+def dictionary_id(dictionary):
+    """
+        Short identifier of a preset dictionary, so that peers can check that they have the same one.
+    """
+    return zlib.crc32(dictionary) if dictionary else None
+
+
+class Protocol():
+    """
+        The encoding state of one connection: which codec, compression and level we send with, the compression
+        threshold and the preset dictionary as well as the handshake negotiating codec and compression.
+
+        The side that connects starts the handshake (hello()) with the codecs and compressions it supports, the other
+        side chooses the first ones in its own order of preference and answers. Afterwards both send with these.
+    """
+
+    def __init__(self, codecs=PREFERRED_CODECS, compressions=PREFERRED_COMPRESSIONS, level=None,
+                 threshold=COMPRESSION_THRESHOLD, dictionary=None, session=None):
+        """
+            Given the supported codecs and compressions (names in order of preference), the compression level (None
+            for the default of the compression), the compression threshold, a preset dictionary (or None) and a
+            session key (or None) which is sent with the handshake (a sharded server routes by it, see server.sharding).
+        """
+        self.codecs = codecs
+        self.compressions = [x for x in compressions if x != 'zlib-dictionary' or dictionary]
+        self.level = level
+        self.threshold = threshold
+        self.dictionary = dictionary
+        self.session = session
+        self.codec = get_codec(INITIAL_CODEC)
+        self.compression = INITIAL_COMPRESSION
+        # serialized size of the last encoded and decoded message (for metrics)
+        self.encoded_raw_size = 0
+        self.decoded_raw_size = 0
+
+    def disable_compression(self):
+        """
+            Never compress (e.g. for local connections where compression costs more than it saves), not even before the
+            handshake. The handshake will then choose no compression for both sides.
+        """
+        self.compressions = ['none']
+        self.compression = 'none'
+
+    def encode(self, value, compress=True):
+        """
+            Encodes a message with the current settings (compress=False for content which is already compressed).
+        """
+        data, self.encoded_raw_size = _encode(value, self.codec, self.compression if compress else 'none', self.level,
+                                              self.dictionary, self.threshold, 0)
+        return data
+
+    def settings(self):
+        """
+            The current settings of encode(). Protocols with equal settings encode a value to identical bytes.
+        """
+        return self.codec.id, self.compression, self.level, self.threshold, id(self.dictionary)
+
+    def decode(self, data):
+        """
+            Decodes a message.
+        """
+        value, self.decoded_raw_size = _decode(data, self.dictionary)
+        return value
+
+    def encode_batch(self, frames):
+        """
+            Compresses several framed messages together with the current settings.
+        """
+        return encode_batch(frames, self.compression, self.level, self.dictionary)
+
+    def decode_batch(self, data):
+        """
+            Returns the framed messages in a batch message.
+        """
+        return decode_batch(data, self.dictionary)
+
+    @staticmethod
+    def encode_control(value):
+        """
+            Encodes a control message (always with the initial codec and compression).
+        """
+        return encode(value, get_codec(INITIAL_CODEC), flags=HEADER_CONTROL)
+
+    def hello(self):
+        """
+            The start of the handshake, to be sent as control message.
+        """
+        hello = {
+            'codecs': list(self.codecs),
+            'compressions': list(self.compressions),
+            'dictionary': dictionary_id(self.dictionary)
+        }
+        if self.session is not None:
+            hello['session'] = self.session
+        return hello
+
+    def process_control(self, value):
+        """
+            Processes a received control message, either the start of the handshake (then returns the answer which must
+            be sent as control message) or the answer (then returns None).
+        """
+        if 'codecs' in value:
+            # choose the first of our codecs and compressions that the peer supports
+            codecs = [x for x in self.codecs if x in value['codecs']]
+            compressions = [x for x in self.compressions if x in value.get('compressions', ())]
+            if value.get('dictionary', None) != dictionary_id(self.dictionary) and 'zlib-dictionary' in compressions:
+                compressions.remove('zlib-dictionary')
+            answer = {
+                'codec': codecs[0] if codecs else INITIAL_CODEC,
+                'compression': compressions[0] if compressions else INITIAL_COMPRESSION
+            }
+            self.select(answer)
+            return answer
+        self.select(value)
+        return None
+
+    def select(self, value):
+        """
+            Starts sending with the negotiated codec and compression.
+        """
+        if 'codec' in value:
+            self.codec = get_codec(value['codec'])
+        if 'compression' in value:
+            self.compression = value['compression']
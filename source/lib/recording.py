@@ -0,0 +1,174 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import socket
+import struct
+import threading
+import time
+
+from lib.framing import frame, FrameBuffer, MAX_FRAME_SIZE
+from lib import protocol as p
+from lib.serialization import get_codec
+
+"""
+    Recording of the messages of a connection to a compact log file and replaying them later against a server (not
+    Qt).
+
+    A recording starts with a header (magic bytes and version), followed by records: the time since the start of the
+    recording (seconds, double), the direction (received or sent) and the message encoded with the binary codec
+    (uncompressed, so recordings do not depend on negotiated settings or preset dictionaries) as a frame.
+"""
+
+RECORDING_MAGIC = b'IRSR'
+RECORDING_VERSION = 1
+RECORDING_HEADER = struct.Struct('<4sH')
+RECORD_HEADER = struct.Struct('<dB')
+
+# directions of recorded messages
+RECEIVED = 0
+SENT = 1
+
+_codec = get_codec('binary')
+
+
+class SessionRecorder():
+    """
+        Writes timestamped messages to a recording file.
+    """
+
+    def __init__(self, file_name):
+        self.file = open(file_name, 'wb')
+        self.file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION))
+        self.start = time.perf_counter()
+
+    def record(self, direction, message):
+        """
+            Records a message (received or sent).
+        """
+        self.file.write(RECORD_HEADER.pack(time.perf_counter() - self.start, direction))
+        self.file.write(frame(p.encode(message, _codec, 'none')))
+
+    def close(self):
+        self.file.close()
+
+
+def read_recording(file_name):
+    """
+        Generates (time, direction, message) for all records in a recording file.
+    """
+    with open(file_name, 'rb') as file:
+        data = file.read()
+    magic, version = RECORDING_HEADER.unpack_from(data)
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+        raise RuntimeError('{} is not a recording of version {}.'.format(file_name, RECORDING_VERSION))
+    position = RECORDING_HEADER.size
+    while position < len(data):
+        timestamp, direction = RECORD_HEADER.unpack_from(data, position)
+        position += RECORD_HEADER.size
+        length = struct.unpack_from('>I', data, position)[0]
+        position += 4
+        yield timestamp, direction, p.decode(data[position:position + length])
+        position += length
+
+
+class SessionReplayer():
+    """
+        Sends the received messages of a recording (what a client sent to the server) again to a server, either as fast
+        as possible or with the original pacing. Measures the time until the replies to requests (messages with a
+        'reply-to') arrive.
+    """
+
+    def __init__(self, file_name, protocol):
+        """
+            Given a recording file and a protocol (lib.protocol.Protocol, should be the one of the server's clients).
+        """
+        self.messages = [(timestamp, message) for timestamp, direction, message in read_recording(file_name) if
+                         direction == RECEIVED]
+        self.protocol = protocol
+        self.pending = {}
+        self.latencies = []
+        self.replies = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.sending = False
+        self.duration = 0
+
+    def replay(self, host, port, paced=False, timeout=10):
+        """
+            Connects, does the handshake, sends all messages and waits (at most timeout seconds) for outstanding
+            replies.
+        """
+        connection = socket.create_connection((host, port))
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        receiver = threading.Thread(target=self.receive, args=(connection,), daemon=True)
+
+        # handshake (as the connecting side) before anything else
+        self.handshake = threading.Event()
+        receiver.start()
+        connection.sendall(frame(p.Protocol.encode_control(self.protocol.hello())))
+        if not self.handshake.wait(timeout):
+            connection.close()
+            raise RuntimeError('No handshake answer from the server.')
+
+        start = time.perf_counter()
+        self.sending = True
+        for timestamp, message in self.messages:
+            if paced:
+                delay = timestamp - self.messages[0][0] - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            content = message.get('content')
+            if isinstance(content, dict) and 'reply-to' in content:
+                with self.lock:
+                    self.pending[content['reply-to']] = time.perf_counter()
+            connection.sendall(frame(self.protocol.encode(message)))
+
+        with self.lock:
+            self.sending = False
+            if not self.pending:
+                self.done.set()
+        self.done.wait(timeout)
+        self.duration = time.perf_counter() - start
+        connection.close()
+
+    def receive(self, connection):
+        """
+            Reads the replies (on its own thread).
+        """
+        frame_buffer = FrameBuffer(MAX_FRAME_SIZE)
+        while True:
+            try:
+                data = connection.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            for message in frame_buffer.feed(data):
+                value = self.protocol.decode(message)
+                if p.is_control(message):
+                    if 'ping' in value:
+                        connection.sendall(frame(p.Protocol.encode_control({'pong': value['ping']})))
+                    else:
+                        self.protocol.process_control(value)
+                        self.handshake.set()
+                    continue
+                with self.lock:
+                    self.replies += 1
+                    sent = self.pending.pop(value['channel'], None)
+                    if sent is not None:
+                        self.latencies.append(time.perf_counter() - sent)
+                        if not self.pending and not self.sending:
+                            self.done.set()
@@ -0,0 +1,89 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from itertools import groupby
+
+"""
+    Compact encoding of maps (one small integer per tile) as runs of palette indices (not Qt).
+
+    The distinct values of a map form a palette (at most 256 entries). The map is then a sequence of runs, each stored
+    as the palette index (one byte) followed by the length of the run (unsigned LEB128 variable length integer).
+"""
+
+
+def encode_runs(values):
+    """
+        Encodes a sequence of values. Returns the palette (sorted list of the distinct values) and the runs (bytes).
+    """
+    palette = sorted(set(values))
+    if len(palette) > 256:
+        raise RuntimeError('Too many distinct values {} for a palette.'.format(len(palette)))
+    index_of = {value: index for index, value in enumerate(palette)}
+    data = bytearray()
+    for value, run in groupby(values):
+        data.append(index_of[value])
+        length = sum(1 for _ in run)
+        while length >= 0x80:
+            data.append(length & 0x7f | 0x80)
+            length >>= 7
+        data.append(length)
+    return palette, bytes(data)
+
+
+def decode_runs(data):
+    """
+        Generates (palette index, length) for all runs.
+    """
+    position = 0
+    size = len(data)
+    while position < size:
+        index = data[position]
+        length = 0
+        shift = 0
+        while True:
+            position += 1
+            byte = data[position]
+            length |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        position += 1
+        yield index, length
+
+
+def decode_to_pixels(data, size):
+    """
+        Decodes runs into a pixel buffer (bytearray of palette indices, one byte per value) of a given size.
+    """
+    pixels = bytearray(b''.join(bytes((index,)) * length for index, length in decode_runs(data)))
+    if len(pixels) != size:
+        raise RuntimeError('Runs have {} values instead of {}.'.format(len(pixels), size))
+    return pixels
+
+
+def row_segments(data, columns):
+    """
+        Generates (palette index, column, row, length) for all runs split at the ends of rows (of a map with a number of
+        columns), e.g. for drawing them as rectangles.
+    """
+    position = 0
+    for index, length in decode_runs(data):
+        while length > 0:
+            row, column = divmod(position, columns)
+            segment = min(length, columns - column)
+            yield index, column, row, segment
+            position += segment
+            length -= segment
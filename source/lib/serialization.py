@@ -0,0 +1,314 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from array import array
+import struct
+import sys
+
+import yaml
+
+"""
+    Codecs for serializing messages (Python values made of None, bool, int, float, str, bytes, lists, tuples, dicts and
+    typed arrays) to bytes and back. Only based on Python and common libraries (not Qt).
+
+    Every codec has a (small) id, so that the codec of a message can be stored in one byte in front of it. Use
+    get_codec(..) to obtain a codec by its id or name.
+"""
+
+
+class YamlCodec():
+    """
+        Human readable serialization via YAML (safe subset only, no Python objects). Slow, but useful for debugging.
+    """
+
+    id = 0
+    name = 'yaml'
+
+    def __init__(self):
+        # use libyaml if available
+        base = yaml.CSafeDumper if hasattr(yaml, 'CSafeDumper') else yaml.SafeDumper
+        self.Dumper = type('Dumper', (base,), {})
+        self.Dumper.add_representer(array, lambda dumper, data: dumper.represent_list(data.tolist()))
+        self.Loader = yaml.CSafeLoader if hasattr(yaml, 'CSafeLoader') else yaml.SafeLoader
+
+    def dumps(self, value):
+        """
+            Serializes a value to UTF-8 encoded YAML.
+        """
+        return yaml.dump(value, allow_unicode=True, Dumper=self.Dumper).encode()
+
+    def loads(self, data):
+        """
+            Deserializes UTF-8 encoded YAML.
+        """
+        return yaml.load(bytes(data).decode(), Loader=self.Loader)
+
+
+# type tags of the binary codec (msgpack like, small values are packed into the tag byte)
+_NONE = 0xc0
+_FALSE = 0xc2
+_TRUE = 0xc3
+_BIN8, _BIN16, _BIN32 = 0xc4, 0xc5, 0xc6
+_TYPED_ARRAY = 0xc8
+_TYPED_LIST = 0xc9
+_FLOAT64 = 0xcb
+_BIGINT = 0xcf
+_INT8, _INT16, _INT32, _INT64 = 0xd0, 0xd1, 0xd2, 0xd3
+_STR8, _STR16, _STR32 = 0xd9, 0xda, 0xdb
+_LIST16, _LIST32 = 0xdc, 0xdd
+_MAP16, _MAP32 = 0xde, 0xdf
+_FIXMAP, _FIXLIST, _FIXSTR = 0x80, 0x90, 0xa0
+
+# lists of ints with at least this many entries are sent as typed arrays
+_TYPED_LIST_MIN_LENGTH = 16
+
+_struct_b = struct.Struct('<b')
+_struct_h = struct.Struct('<h')
+_struct_i = struct.Struct('<i')
+_struct_q = struct.Struct('<q')
+_struct_B = struct.Struct('<B')
+_struct_H = struct.Struct('<H')
+_struct_I = struct.Struct('<I')
+_struct_d = struct.Struct('<d')
+_struct_typed = struct.Struct('<cI')
+
+
+def _smallest_typecode(minimum, maximum):
+    """
+        Returns the typecode of the smallest signed integer array type holding all values between minimum and maximum
+        (or None if not even 64 bit suffice).
+    """
+    for typecode in ('b', 'h', 'i', 'q'):
+        bits = 8 * array(typecode).itemsize
+        if -(1 << (bits - 1)) <= minimum and maximum < (1 << (bits - 1)):
+            return typecode
+    return None
+
+
+class BinaryCodec():
+    """
+        Compact binary serialization in the style of msgpack. Lists of ints (like maps) and typed arrays (array.array)
+        are stored as raw little endian arrays with the smallest fitting item size. Lists come back as lists, typed
+        arrays as typed arrays.
+    """
+
+    id = 1
+    name = 'binary'
+
+    def dumps(self, value):
+        """
+            Serializes a value to bytes.
+        """
+        buffer = bytearray()
+        self._pack(value, buffer)
+        return bytes(buffer)
+
+    def _pack(self, value, buffer):
+        """
+            Appends a single value to the buffer.
+        """
+        t = type(value)
+        if value is None:
+            buffer.append(_NONE)
+        elif t is bool:
+            buffer.append(_TRUE if value else _FALSE)
+        elif t is int:
+            self._pack_int(value, buffer)
+        elif t is float:
+            buffer.append(_FLOAT64)
+            buffer += _struct_d.pack(value)
+        elif t is str:
+            data = value.encode()
+            self._pack_length(len(data), buffer, _FIXSTR, 32, _STR8, _STR16, _STR32)
+            buffer += data
+        elif t is bytes or t is bytearray or t is memoryview:
+            self._pack_length(len(value), buffer, None, 0, _BIN8, _BIN16, _BIN32)
+            buffer += value
+        elif t is list or t is tuple:
+            if len(value) >= _TYPED_LIST_MIN_LENGTH and all(type(x) is int for x in value):
+                typecode = _smallest_typecode(min(value), max(value))
+                if typecode is not None:
+                    self._pack_typed(_TYPED_LIST, array(typecode, value), buffer)
+                    return
+            self._pack_length(len(value), buffer, _FIXLIST, 16, None, _LIST16, _LIST32)
+            for x in value:
+                self._pack(x, buffer)
+        elif t is dict:
+            self._pack_length(len(value), buffer, _FIXMAP, 16, None, _MAP16, _MAP32)
+            for key, x in value.items():
+                self._pack(key, buffer)
+                self._pack(x, buffer)
+        elif t is array:
+            self._pack_typed(_TYPED_ARRAY, value, buffer)
+        else:
+            raise RuntimeError('Cannot serialize type {}.'.format(t))
+
+    @staticmethod
+    def _pack_int(value, buffer):
+        """
+            Appends an int in the smallest form.
+        """
+        if -32 <= value < 128:
+            buffer += _struct_b.pack(value) if value < 0 else bytes((value,))
+        elif -0x80 <= value < 0x80:
+            buffer.append(_INT8)
+            buffer += _struct_b.pack(value)
+        elif -0x8000 <= value < 0x8000:
+            buffer.append(_INT16)
+            buffer += _struct_h.pack(value)
+        elif -0x80000000 <= value < 0x80000000:
+            buffer.append(_INT32)
+            buffer += _struct_i.pack(value)
+        elif -0x8000000000000000 <= value < 0x8000000000000000:
+            buffer.append(_INT64)
+            buffer += _struct_q.pack(value)
+        else:
+            data = str(value).encode()
+            buffer.append(_BIGINT)
+            buffer += _struct_I.pack(len(data))
+            buffer += data
+
+    @staticmethod
+    def _pack_length(length, buffer, fix_tag, fix_limit, tag8, tag16, tag32):
+        """
+            Appends a tag with a length (packed in the tag itself if small enough).
+        """
+        if length < fix_limit:
+            buffer.append(fix_tag | length)
+        elif tag8 is not None and length < 0x100:
+            buffer.append(tag8)
+            buffer.append(length)
+        elif length < 0x10000:
+            buffer.append(tag16)
+            buffer += _struct_H.pack(length)
+        else:
+            buffer.append(tag32)
+            buffer += _struct_I.pack(length)
+
+    @staticmethod
+    def _pack_typed(tag, data, buffer):
+        """
+            Appends a typed array (tag, typecode, number of items, raw little endian data).
+        """
+        buffer.append(tag)
+        buffer += _struct_typed.pack(data.typecode.encode(), len(data))
+        if sys.byteorder != 'little' and data.itemsize > 1:
+            data = array(data.typecode, data)
+            data.byteswap()
+        buffer += data.tobytes()
+
+    def loads(self, data):
+        """
+            Deserializes bytes.
+        """
+        value, position = self._unpack(memoryview(data), 0)
+        if position != len(data):
+            raise RuntimeError('Trailing data after message.')
+        return value
+
+    def _unpack(self, data, position):
+        """
+            Reads a single value at a position. Returns the value and the position after it.
+        """
+        tag = data[position]
+        position += 1
+        if tag < 0x80:
+            return tag, position
+        if tag >= 0xe0:
+            return tag - 0x100, position
+        if tag & 0xe0 == _FIXSTR:
+            end = position + (tag & 0x1f)
+            return str(data[position:end], 'utf-8'), end
+        if tag & 0xf0 == _FIXLIST:
+            return self._unpack_list(data, position, tag & 0x0f)
+        if tag & 0xf0 == _FIXMAP:
+            return self._unpack_map(data, position, tag & 0x0f)
+        if tag == _NONE:
+            return None, position
+        if tag == _FALSE:
+            return False, position
+        if tag == _TRUE:
+            return True, position
+        if tag in _INT_STRUCTS:
+            s = _INT_STRUCTS[tag]
+            return s.unpack_from(data, position)[0], position + s.size
+        if tag == _FLOAT64:
+            return _struct_d.unpack_from(data, position)[0], position + 8
+        if tag in _STR_LENGTHS:
+            length, position = self._unpack_length(data, position, _STR_LENGTHS[tag])
+            return str(data[position:position + length], 'utf-8'), position + length
+        if tag in _BIN_LENGTHS:
+            length, position = self._unpack_length(data, position, _BIN_LENGTHS[tag])
+            return data[position:position + length].tobytes(), position + length
+        if tag in _LIST_LENGTHS:
+            length, position = self._unpack_length(data, position, _LIST_LENGTHS[tag])
+            return self._unpack_list(data, position, length)
+        if tag in _MAP_LENGTHS:
+            length, position = self._unpack_length(data, position, _MAP_LENGTHS[tag])
+            return self._unpack_map(data, position, length)
+        if tag == _TYPED_ARRAY or tag == _TYPED_LIST:
+            typecode, length = _struct_typed.unpack_from(data, position)
+            position += _struct_typed.size
+            values = array(typecode.decode())
+            end = position + length * values.itemsize
+            values.frombytes(data[position:end])
+            if sys.byteorder != 'little' and values.itemsize > 1:
+                values.byteswap()
+            return (values.tolist() if tag == _TYPED_LIST else values), end
+        if tag == _BIGINT:
+            length, position = self._unpack_length(data, position, _struct_I)
+            return int(str(data[position:position + length], 'ascii')), position + length
+        raise RuntimeError('Unknown type tag {}.'.format(tag))
+
+    @staticmethod
+    def _unpack_length(data, position, s):
+        return s.unpack_from(data, position)[0], position + s.size
+
+    def _unpack_list(self, data, position, length):
+        values = []
+        for _ in range(length):
+            value, position = self._unpack(data, position)
+            values.append(value)
+        return values, position
+
+    def _unpack_map(self, data, position, length):
+        values = {}
+        for _ in range(length):
+            key, position = self._unpack(data, position)
+            values[key], position = self._unpack(data, position)
+        return values, position
+
+
+_INT_STRUCTS = {_INT8: _struct_b, _INT16: _struct_h, _INT32: _struct_i, _INT64: _struct_q}
+_STR_LENGTHS = {_STR8: _struct_B, _STR16: _struct_H, _STR32: _struct_I}
+_BIN_LENGTHS = {_BIN8: _struct_B, _BIN16: _struct_H, _BIN32: _struct_I}
+_LIST_LENGTHS = {_LIST16: _struct_H, _LIST32: _struct_I}
+_MAP_LENGTHS = {_MAP16: _struct_H, _MAP32: _struct_I}
+
+# all available codecs by id and by name
+CODECS = {}
+for _codec in (YamlCodec(), BinaryCodec()):
+    CODECS[_codec.id] = _codec
+    CODECS[_codec.name] = _codec
+
+
+def get_codec(key):
+    """
+        Returns a codec by id or name.
+    """
+    if key not in CODECS:
+        raise RuntimeError('Unknown codec {}.'.format(key))
+    return CODECS[key]
@@ -15,6 +15,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 from enum import Enum
+from array import array
+import mmap
+import os
+import struct
+import sys
+import tempfile
 import zipfile
 
 import yaml
@@ -98,16 +104,85 @@ class ZipArchiveReader():
         self.zip.close()
 
 
-class ZipArchiveWriter():
+class ReplacingWriter():
     """
-        Ecapsulates a zip file to write files into it or even whole Python objects via JSON.
+        Base of the archive writers. Writes to a temporary file in the folder of the file, which only replaces the file
+        when the writer is closed (close()). So a file which is still read (e.g. memory mapped) is never truncated and a
+        failed or unfinished write (abort(), or the writer is just deleted) never destroys the file.
+
+        Can be used as context manager, which closes at the end or aborts if there was an exception.
     """
 
     def __init__(self, file):
         """
-            Open the zip file in write mode with standard zlib compression mode.
+            Opens the temporary file in binary write mode.
+        """
+        self.file_name = file
+        handle, self.temporary_name = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(file)))
+        # mkstemp only allows the owner to read, use the usual permissions of new files instead
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(self.temporary_name, 0o666 & ~umask)
+        self.file = os.fdopen(handle, 'wb')
+
+    def finish(self):
+        """
+            Writes what is needed at the end of the file (in derived classes).
+        """
+        pass
+
+    def close(self):
         """
-        self.zip = zipfile.ZipFile(file, mode='w', compression=zipfile.ZIP_DEFLATED)
+            Finishes and closes the temporary file and (atomically) replaces the file with it.
+        """
+        if self.file.closed:
+            return
+        try:
+            self.finish()
+            self.file.close()
+        except Exception:
+            self.abort()
+            raise
+        os.replace(self.temporary_name, self.file_name)
+
+    def abort(self):
+        """
+            Closes and deletes the temporary file, the file stays as it was.
+        """
+        if self.file.closed:
+            return
+        self.file.close()
+        os.remove(self.temporary_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __del__(self):
+        """
+            Never closed, so not complete.
+        """
+        if hasattr(self, 'file'):
+            self.abort()
+
+
+class ZipArchiveWriter(ReplacingWriter):
+    """
+        Ecapsulates a zip file to write files into it or even whole Python objects via JSON. The file is only replaced
+        when the archive is closed (see ReplacingWriter).
+    """
+
+    def __init__(self, file):
+        """
+            Open the zip file (a temporary file first) in write mode with standard zlib compression mode.
+        """
+        super().__init__(file)
+        self.zip = zipfile.ZipFile(self.file, mode='w', compression=zipfile.ZIP_DEFLATED)
 
     def write(self, name, bytes):
         """
@@ -122,12 +197,155 @@ class ZipArchiveWriter():
         bytes = yaml.dump(obj, allow_unicode=True, Dumper=Dumper).encode()
         self.write(name, bytes)
 
-    def __del__(self):
+    def finish(self):
         """
-            Close the zip upon deletion.
+            Writes the directory of the zip.
         """
         self.zip.close()
 
+    def abort(self):
+        if not self.file.closed and hasattr(self, 'zip'):
+            # the zip would write its directory into the closed file later
+            self.zip.close()
+        super().abort()
+
+
+# magic bytes, version and header layout (magic, version, reserved, offset of the table of contents) of columnar archives
+COLUMNAR_ARCHIVE_MAGIC = b'IRCA'
+COLUMNAR_ARCHIVE_VERSION = 1
+COLUMNAR_ARCHIVE_HEADER = struct.Struct('<4sHHQ')
+
+
+def is_columnar_archive(file_name):
+    """
+        Returns True if the file starts with the magic bytes of a columnar archive.
+    """
+    with open(file_name, 'rb') as file:
+        return file.read(len(COLUMNAR_ARCHIVE_MAGIC)) == COLUMNAR_ARCHIVE_MAGIC
+
+
+class ColumnarArchiveReader():
+    """
+        Reads a columnar archive (see ColumnarArchiveWriter). The file is memory mapped, typed arrays are returned as
+        views into the mapped file without any decoding or copying. Changes to these views are private (copy on write)
+        and never reach the file.
+    """
+
+    def __init__(self, file):
+        """
+            Maps the file and reads the header and the table of contents.
+        """
+        with open(file, 'rb') as f:
+            # the mapping keeps its own handle, so we can close the file right away
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, version, _, toc_offset = COLUMNAR_ARCHIVE_HEADER.unpack_from(self.map)
+        if magic != COLUMNAR_ARCHIVE_MAGIC:
+            raise RuntimeError('{} is not a columnar archive.'.format(file))
+        if version > COLUMNAR_ARCHIVE_VERSION:
+            raise RuntimeError('Columnar archive version {} is not supported.'.format(version))
+        self.version = version
+        self.toc = yaml.load(self.map[toc_offset:].decode(), Loader=Loader)
+
+    def names(self):
+        """
+            Returns the names of all entries.
+        """
+        return self.toc['entries'].keys()
+
+    def read(self, name):
+        """
+            Just reads an entry as bytes (copy).
+        """
+        entry = self.toc['entries'][name]
+        return self.map[entry['offset']:entry['offset'] + entry['length']]
+
+    def read_as_yaml(self, name):
+        """
+            Reads an entry as bytes, converts to UTF-8 and then by YAML to a Python object.
+        """
+        return yaml.load(self.read(name).decode(), Loader=Loader)
+
+    def read_array(self, name):
+        """
+            Returns a typed array entry as memoryview (with the typecode as format) directly on the mapped file. If the
+            archive was written on a machine with a different byte order, a swapped copy (array) is returned instead.
+        """
+        entry = self.toc['entries'][name]
+        typecode = entry['typecode']
+        if array(typecode).itemsize != entry['itemsize']:
+            raise RuntimeError('Item size of typed array {} does not match.'.format(name))
+        view = memoryview(self.map)[entry['offset']:entry['offset'] + entry['length']]
+        if entry['byteorder'] != sys.byteorder and entry['itemsize'] > 1:
+            data = array(typecode, view.tobytes())
+            data.byteswap()
+            return data
+        return view.cast(typecode)
+
+
+class ColumnarArchiveWriter(ReplacingWriter):
+    """
+        Writes a simple versioned binary archive with named entries, either raw bytes (e.g. small YAML documents) or
+        typed arrays which are stored unmodified (aligned to 8 bytes) so that they can later be memory mapped.
+
+        Layout: header (magic, version, offset of table of contents), entries, table of contents (YAML).
+
+        The archive is written to a temporary file which replaces the file when closed (see ReplacingWriter), so an
+        archive can be saved over the archive it was read from (which is memory mapped, see ColumnarArchiveReader).
+    """
+
+    def __init__(self, file):
+        """
+            Open the (temporary) file in binary write mode and write a preliminary header.
+        """
+        super().__init__(file)
+        self.file.write(COLUMNAR_ARCHIVE_HEADER.pack(COLUMNAR_ARCHIVE_MAGIC, COLUMNAR_ARCHIVE_VERSION, 0, 0))
+        self.entries = {}
+
+    def write(self, name, bytes):
+        """
+            Writes a byte array as entry.
+        """
+        self._write_entry(name, bytes, {})
+
+    def write_as_yaml(self, name, obj):
+        """
+            Write a Python object via YAML as entry.
+        """
+        self.write(name, yaml.dump(obj, allow_unicode=True, Dumper=Dumper).encode())
+
+    def write_array(self, name, data):
+        """
+            Writes a typed array (array.array or a memoryview as returned by ColumnarArchiveReader) as entry.
+        """
+        info = {
+            'typecode': data.typecode if isinstance(data, array) else data.format,
+            'itemsize': data.itemsize,
+            'byteorder': sys.byteorder
+        }
+        self._write_entry(name, data.tobytes(), info)
+
+    def _write_entry(self, name, bytes, info):
+        """
+            Aligns the file position, writes the data and stores the position in the table of contents.
+        """
+        if name in self.entries:
+            raise RuntimeError('Entry {} already existing.'.format(name))
+        padding = -self.file.tell() % 8
+        self.file.write(b'\0' * padding)
+        info['offset'] = self.file.tell()
+        info['length'] = len(bytes)
+        self.file.write(bytes)
+        self.entries[name] = info
+
+    def finish(self):
+        """
+            Writes the table of contents and its position in the header.
+        """
+        toc_offset = self.file.tell()
+        self.file.write(yaml.dump({'entries': self.entries}, Dumper=Dumper).encode())
+        self.file.seek(0)
+        self.file.write(COLUMNAR_ARCHIVE_HEADER.pack(COLUMNAR_ARCHIVE_MAGIC, COLUMNAR_ARCHIVE_VERSION, 0, toc_offset))
+
 
 class List2D():
     """
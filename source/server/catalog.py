@@ -0,0 +1,209 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import os
+from threading import Thread, Lock, Event
+
+import lib.utils as u
+from base.constants import PropertyKeyNames as k
+from server.scenario import Scenario
+
+"""
+    A catalog of all scenarios in a folder, kept in memory and persisted to a file, so that listing scenarios does not
+    need to open every scenario file.
+"""
+
+
+def file_identity(file_name):
+    """
+        Returns the identity (path, modification time, size) of a file, which changes whenever the file changes.
+    """
+    status = os.stat(file_name)
+    return file_name, status.st_mtime, status.st_size
+
+
+class ScenarioCatalog():
+    """
+        Index of all scenario files in a folder with title, map size and number of nations for each of them (keyed by
+        file path, modification time and size).
+
+        Refreshing is incremental (only new or changed files are read) and can run regularly in a background thread,
+        queries are answered from memory.
+    """
+
+    def __init__(self, folder, cache_file=None, refresh_interval=10, first_refresh_callback=None):
+        """
+            Given a folder with scenario files, an optional file where the catalog is persisted between runs, the
+            interval in seconds of the background refresh and an optional function (without arguments) which is called
+            (from the refreshing thread) when the first refresh ends if there was no persisted catalog.
+        """
+        self.folder = folder
+        self.cache_file = cache_file
+        self.refresh_interval = refresh_interval
+        self.first_refresh_callback = first_refresh_callback
+        self._entries = {}
+        self._titles = []
+        self._lock = Lock()
+        self._refreshed = Event()
+        self._stopped = Event()
+        self._thread = None
+
+        # start with the persisted catalog if there is one, it is served right away and validated by the first refresh
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                self._set_entries(u.read_as_yaml(cache_file))
+                self._refreshed.set()
+            except Exception:
+                # corrupt catalogs are just rebuilt
+                pass
+
+    def start(self):
+        """
+            Starts the background thread, which refreshes immediately and then regularly.
+        """
+        if self._thread is None:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+            Stops the background thread.
+        """
+        self._stopped.set()
+
+    def _run(self):
+        """
+            Body of the background thread.
+        """
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                # e.g. the folder is not readable, try again next time
+                print('refreshing the catalog of {} failed: {}'.format(self.folder, e))
+            self._stopped.wait(self.refresh_interval)
+
+    def refresh(self):
+        """
+            Brings the catalog up to date with the folder. Only reads scenario files that are new or have changed since
+            the last refresh. Returns True if the catalog changed.
+
+            Even if it fails, the first refresh (see is_refreshing()) ends.
+        """
+        try:
+            return self._refresh()
+        finally:
+            if not self._refreshed.is_set():
+                self._refreshed.set()
+                if self.first_refresh_callback is not None:
+                    self.first_refresh_callback()
+
+    def _refresh(self):
+        """
+            See refresh().
+        """
+        scenario_files = [os.path.join(self.folder, x) for x in os.listdir(self.folder) if x.endswith('.scenario')]
+
+        with self._lock:
+            old_entries = self._entries
+
+        entries = {}
+        for scenario_file in scenario_files:
+            try:
+                file_name, mtime, size = file_identity(scenario_file)
+            except OSError:
+                # removed in the meantime
+                continue
+            entry = old_entries.get(file_name, None)
+            if entry is None or entry['mtime'] != mtime or entry['size'] != size:
+                try:
+                    entry = self._read_entry(file_name)
+                except Exception:
+                    # not a valid scenario (or still being written), try again next time
+                    continue
+                entry['mtime'] = mtime
+                entry['size'] = size
+            entries[file_name] = entry
+
+        changed = entries != old_entries
+        if changed:
+            self._set_entries(entries)
+            if self.cache_file is not None:
+                u.write_as_yaml(self.cache_file, entries)
+        return changed
+
+    @staticmethod
+    def _read_entry(file_name):
+        """
+            Reads the catalog entry of a scenario file. Lazy loading, only properties and nations are read.
+        """
+        scenario = Scenario()
+        scenario.load(file_name, lazy=True)
+        entry = {
+            'file': file_name,
+            'title': scenario[k.TITLE],
+            'columns': scenario[k.MAP_COLUMNS],
+            'rows': scenario[k.MAP_ROWS],
+            'nations': len(scenario.all_nations())
+        }
+        return entry
+
+    def _set_entries(self, entries):
+        """
+            Replaces all entries and the sorted list of titles at once.
+        """
+        titles = sorted((entry['title'], file_name) for file_name, entry in entries.items())
+        with self._lock:
+            self._entries = entries
+            self._titles = titles
+
+    def is_refreshing(self):
+        """
+            True before the end of the first refresh (without a persisted catalog), the catalog might be incomplete
+            until then.
+        """
+        return not self._refreshed.is_set()
+
+    def entries(self, wait=True):
+        """
+            Returns a dictionary (file name to entry) of all scenarios. With wait=False the entries known so far are
+            returned right away even if the first refresh has not yet ended (see is_refreshing()).
+        """
+        if wait:
+            self._wait_for_first_refresh()
+        with self._lock:
+            return dict(self._entries)
+
+    def titles(self, wait=True):
+        """
+            Returns a list of (title, file name) pairs of all scenarios sorted by title. With wait=False the titles
+            known so far are returned right away even if the first refresh has not yet ended (see is_refreshing()).
+        """
+        if wait:
+            self._wait_for_first_refresh()
+        with self._lock:
+            return list(self._titles)
+
+    def _wait_for_first_refresh(self):
+        """
+            Before the first refresh (without a persisted catalog), the catalog might be incomplete. Either wait for the
+            background thread or refresh now.
+        """
+        if not self._refreshed.is_set():
+            if self._thread is not None:
+                self._refreshed.wait()
+            else:
+                self.refresh()
@@ -0,0 +1,296 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import asyncio
+import time
+
+from base.channels import create_protocol, letter, encoded_letter, letter_content
+from lib.framing import frame, FrameBuffer, MAX_FRAME_SIZE
+from lib import protocol as p
+from server.services import ServerServices
+
+"""
+    Headless server based on asyncio (no Qt needed). Speaks the same protocol as the Qt server (see lib.network): length
+    prefixed frames of messages encoded as negotiated in the handshake (see lib.protocol), wrapped in letters with a
+    channel name (see base.channels). The general services are the same (see server.services).
+"""
+
+# hosts to listen on
+HOSTS = {
+    'local': '127.0.0.1',
+    'any': None
+}
+
+# seconds between measurements of the round trip times to the clients
+PING_INTERVAL = 5
+
+
+class HeadlessClient(asyncio.Protocol):
+    """
+        A connection to the headless server. Provides the same channel interface as base.network.NetworkClient, so the
+        services can deal with it in the same way.
+    """
+
+    def __init__(self, services, watermarks, max_frame_size=MAX_FRAME_SIZE):
+        """
+            Given the services, the watermarks and overflow policy (high, low, policy) for outbound data (see
+            lib.network.Client.set_watermarks) and the maximal size of received messages.
+        """
+        self.services = services
+        self.high_watermark, self.low_watermark, self.overflow_policy = watermarks
+        self.protocol = create_protocol()
+        self.frame_buffer = FrameBuffer(max_frame_size)
+        self.channels = {}
+        self.transport = None
+        self.client_id = None
+        self.is_congested = False
+        self.dropped_messages = 0
+        self.metrics = None
+        self.round_trip_time = None
+
+    def connection_made(self, transport):
+        """
+            A client connected. Let the transport signal congestion at our watermarks and register at the services.
+        """
+        self.transport = transport
+        if self.high_watermark is not None:
+            transport.set_write_buffer_limits(self.high_watermark, self.low_watermark)
+        self.services.add_client(self)
+
+    def connection_lost(self, exception):
+        """
+            The client is gone.
+        """
+        self.transport = None
+        self.services.client_disconnected(self)
+
+    def pause_writing(self):
+        self.is_congested = True
+
+    def resume_writing(self):
+        self.is_congested = False
+
+    def data_received(self, data):
+        """
+            Processes all complete messages. Incomplete messages stay in the buffer until the rest arrives.
+        """
+        try:
+            frames = self.frame_buffer.feed(data)
+        except RuntimeError as e:
+            # we cannot resynchronize the stream, give up on this connection
+            print('aborting connection: {}'.format(e))
+            self.transport.abort()
+            return
+        self.process_frames(frames)
+
+    def process_frames(self, frames):
+        """
+            Decodes and processes received messages (including batches of messages).
+        """
+        for data in frames:
+            # a bad message (or a failing handler) is reported, but does not end the connection (like with Qt, where
+            # exceptions in slots are only printed)
+            try:
+                self.process_message(data)
+            except Exception as e:
+                print('message from client {} failed: {!r}'.format(self.client_id, e))
+
+    def process_message(self, data):
+        """
+            Decodes and processes a single received message (or batch of messages).
+        """
+        if p.is_batch(data):
+            self.process_frames(FrameBuffer(self.frame_buffer.max_frame_size).feed(self.protocol.decode_batch(data)))
+            return
+
+        start = time.perf_counter()
+        value = self.protocol.decode(data)
+
+        if p.is_control(data):
+            self.process_control(value)
+        else:
+            if self.metrics is not None and value['channel'] in self.channels:
+                self.metrics.record_received(value['channel'], self.protocol.decoded_raw_size, len(data),
+                                             time.perf_counter() - start)
+            self.process(value)
+
+    def ping(self):
+        """
+            Measures the round trip time (see lib.network.Client.ping).
+        """
+        self.send_bytes(p.Protocol.encode_control({'ping': time.perf_counter()}))
+
+    def process_control(self, value):
+        """
+            A control message was received (part of the handshake or a ping/pong), answer if needed.
+        """
+        if 'ping' in value:
+            answer = {'pong': value['ping']}
+        elif 'pong' in value:
+            self.round_trip_time = time.perf_counter() - value['pong']
+            return
+        else:
+            answer = self.protocol.process_control(value)
+        if answer is not None:
+            self.send_bytes(p.Protocol.encode_control(answer))
+
+    def process(self, message):
+        """
+            A letter was received, call all callbacks connected to its channel.
+        """
+        channel_name = message['channel']
+        if channel_name not in self.channels:
+            raise RuntimeError('Channel with this name not existing.')
+        content = letter_content(message, self.protocol.decode)
+        start = time.perf_counter()
+        for callback in list(self.channels[channel_name]):
+            callback(self, content)
+        if self.metrics is not None:
+            self.metrics.record_handled(channel_name, time.perf_counter() - start)
+
+    def connect_to_channel(self, channel_name, callback):
+        """
+            Connects a callback(client, message) to a channel (creates the channel if not existing).
+        """
+        self.channels.setdefault(channel_name, []).append(callback)
+
+    def disconnect_from_channel(self, channel_name, callback):
+        """
+            Disconnects a callback from a channel.
+        """
+        if channel_name not in self.channels:
+            raise RuntimeError('Channel with this name not existing.')
+        self.channels[channel_name].remove(callback)
+
+    def remove_channel(self, channel_name, ignore_not_existing=False):
+        """
+            Removes a channel with all its callbacks.
+        """
+        if channel_name in self.channels:
+            del self.channels[channel_name]
+        elif not ignore_not_existing:
+            raise RuntimeError('Channel with this name not existing.')
+
+    def send(self, channel_name, message=None):
+        """
+            Sends a message on a channel.
+        """
+        self.send_letter(channel_name, letter(channel_name, message))
+
+    def send_encoded(self, channel_name, encoded):
+        """
+            Sends an already encoded message (see lib.protocol.encode) on a channel.
+        """
+        self.send_letter(channel_name, encoded_letter(channel_name, encoded), False)
+
+    def send_letter(self, channel_name, letter, compress=True):
+        """
+            Sends a letter (and records it in the metrics if there are metrics).
+        """
+        start = time.perf_counter()
+        data = self.protocol.encode(letter, compress)
+        if self.metrics is not None:
+            self.metrics.record_sent(channel_name, self.protocol.encoded_raw_size, len(data),
+                                     time.perf_counter() - start)
+        self.send_bytes(data)
+
+    def send_settings(self):
+        """
+            See lib.network.Client.send_settings.
+        """
+        return self.protocol.settings(), True
+
+    def encode_letter(self, channel_name, message=None):
+        """
+            Encodes a message on a channel exactly like send() would.
+        """
+        return self.protocol.encode(letter(channel_name, message))
+
+    def send_bytes(self, data):
+        """
+            Writes an encoded message as a frame. The transport buffers what cannot be written immediately, the
+            watermarks and overflow policy limit how much (see lib.network.Client.set_watermarks, with 'coalesce' the
+            buffer may grow up to twice the high watermark).
+        """
+        if self.transport is None:
+            return
+        buffered = self.transport.get_write_buffer_size()
+        if self.high_watermark is not None and buffered + len(data) > self.high_watermark:
+            policy = self.overflow_policy
+            if callable(policy):
+                policy = policy(self, data)
+            if policy == 'drop':
+                self.dropped_messages += 1
+                return
+            if policy != 'coalesce' or buffered + len(data) > 2 * self.high_watermark:
+                print('aborting connection: outbound data exceeds {} bytes'.format(self.high_watermark))
+                self.transport.abort()
+                return
+        self.transport.write(frame(data))
+
+
+class HeadlessServer():
+    """
+        Listens on a port and runs the services on an asyncio event loop.
+    """
+
+    def __init__(self, port, scope='local', send_high_watermark=4 * 1024 * 1024, send_low_watermark=1024 * 1024,
+                 overflow_policy='disconnect', **options):
+        """
+            Given a port, a scope ('local' or 'any'), the watermarks and overflow policy for outbound data of each
+            client and the options of the services (see server.services.ServerServices).
+        """
+        self.port = port
+        self.host = HOSTS[scope]
+        self.watermarks = (send_high_watermark, send_low_watermark, overflow_policy)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.services = ServerServices(self.loop.call_soon_threadsafe, **options)
+        self.server = None
+        self.loop.call_later(PING_INTERVAL, self.ping)
+
+    def ping(self):
+        """
+            Regularly measures the round trip times to all clients.
+        """
+        self.services.ping_all()
+        self.loop.call_later(PING_INTERVAL, self.ping)
+
+    def start(self):
+        """
+            Starts listening.
+        """
+        factory = lambda: HeadlessClient(self.services, self.watermarks)
+        self.server = self.loop.run_until_complete(self.loop.create_server(factory, self.host, self.port))
+
+    def run(self):
+        """
+            Starts listening and runs the event loop until stop() is called.
+        """
+        self.start()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.services.stop()
+            self.loop.close()
+
+    def stop(self):
+        """
+            Stops the event loop (can be called from any thread).
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
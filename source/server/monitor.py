@@ -16,36 +16,106 @@
 
 from PySide import QtCore, QtGui
 
+import base.constants as c
+
 """
     Monitors the server state
 """
 
+# columns of the channel table (title, key in the channel metrics, format)
+CHANNEL_COLUMNS = (
+    ('received', 'received', '{}'),
+    ('received KiB (raw/wire)', ('received raw bytes', 'received wire bytes'), '{:.1f} / {:.1f}'),
+    ('sent', 'sent', '{}'),
+    ('sent KiB (raw/wire)', ('sent raw bytes', 'sent wire bytes'), '{:.1f} / {:.1f}'),
+    ('handler ms (mean/p99/max)', 'handler', '{:.2f} / {:.2f} / {:.2f}')
+)
+
+
+def _format_duration(histogram):
+    """
+        Mean, 99th percentile and maximum of a duration histogram snapshot (see lib.metrics) in milliseconds.
+    """
+    return 1000 * histogram['mean'], 1000 * histogram['p99'], 1000 * histogram['max']
+
 
 class ServerMonitorWidget(QtGui.QWidget):
     """
-        Displays server stats
+        Displays server stats (queried from the server regularly, see c.CH_SERVER_METRICS): the connected clients and
+        their round trip times, encoding and decoding times and for each channel the number of messages, the bytes and
+        the execution time of the handlers.
     """
 
-    def __init__(self):
+    def __init__(self, network_client):
+        """
+            Given the network client connected to the server.
+        """
         super().__init__()
+        self.network_client = network_client
+        self.request = None
 
-        layout = QtGui.QGridLayout(self)
+        layout = QtGui.QVBoxLayout(self)
 
         self.status_label = QtGui.QLabel()
-        layout.addWidget(self.status_label, 0, 0)
+        layout.addWidget(self.status_label)
+
+        self.channel_table = QtGui.QTableWidget(0, len(CHANNEL_COLUMNS))
+        self.channel_table.setHorizontalHeaderLabels([title for title, key, form in CHANNEL_COLUMNS])
+        self.channel_table.horizontalHeader().setResizeMode(QtGui.QHeaderView.ResizeToContents)
+        self.channel_table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.channel_table)
 
         # set timer for update
-        self.timer = QtCore.QTimer()
+        self.timer = QtCore.QTimer(self)
         # noinspection PyUnresolvedReferences
         self.timer.timeout.connect(self.update_monitor)
-        self.timer.setInterval(5000)  # update every 5 seconds
+        self.timer.setInterval(1000)  # update every second
         self.timer.start()
         # and one initial update
         self.update_monitor()
 
     def update_monitor(self):
         """
-            Regular updates of the server stats
+            Regular updates of the server stats (asks the server, unless the last answer is still outstanding).
+        """
+        if self.request is not None and self.request.is_pending():
+            return
+        self.request = self.network_client.request(c.CH_SERVER_METRICS, callback=self.received_metrics)
+
+    def received_metrics(self, metrics):
+        """
+            The server answered, display the metrics.
+        """
+        clients = metrics['clients']
+        round_trip_times = ', '.join('{}: {:.1f} ms'.format(client_id, 1000 * rtt) for client_id, rtt in
+                                     sorted(clients.items()) if rtt is not None)
+        lines = [
+            '{} clients (round trip times {})'.format(len(clients), round_trip_times or 'not yet measured'),
+            'encode ms (mean/p99/max): {:.3f} / {:.3f} / {:.3f}'.format(*_format_duration(metrics['encode'])),
+            'decode ms (mean/p99/max): {:.3f} / {:.3f} / {:.3f}'.format(*_format_duration(metrics['decode'])),
+            '{} worker jobs running'.format(metrics['jobs']['jobs'])
+        ]
+        self.status_label.setText('\n'.join(lines))
+
+        # channels with the most expensive handlers first
+        channels = sorted(metrics['channels'].items(), key=lambda item: -item[1]['handler']['total'])
+        self.channel_table.setRowCount(len(channels))
+        self.channel_table.setVerticalHeaderLabels([name for name, values in channels])
+        for row, (name, values) in enumerate(channels):
+            for column, (title, key, form) in enumerate(CHANNEL_COLUMNS):
+                if key == 'handler':
+                    text = form.format(*_format_duration(values[key]))
+                elif isinstance(key, tuple):
+                    text = form.format(*[values[x] / 1024 for x in key])
+                else:
+                    text = form.format(values[key])
+                self.channel_table.setItem(row, column, QtGui.QTableWidgetItem(text))
+
+    def hideEvent(self, event):
+        """
+            No more updates when closed.
         """
-        text = '{} clients'.format(len(server_manager.server_clients))
-        self.status_label.setText(text)
\ No newline at end of file
+        self.timer.stop()
+        if self.request is not None:
+            self.request.cancel()
+        super().hideEvent(event)
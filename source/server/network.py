@@ -14,20 +14,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-import random
+from multiprocessing import Process
 import os
 import time
-from multiprocessing import Process
 from threading import Thread
 
 from PySide import QtCore
 
 from lib.network import Server
-import lib.utils as u
-import base.constants as c
-from base.constants import PropertyKeyNames as k, NationPropertyKeyNames as kn
 from base.network import NetworkClient
-from server.scenario import Scenario
+from server.services import ServerServices
 
 
 """
@@ -35,19 +31,31 @@ from server.scenario import Scenario
 """
 
 # TODO start this in its own process
-# TODO ping server clients regularly and throw them out if not reacting
+# TODO throw server clients out if not reacting to pings
+
+# seconds between measurements of the round trip times to the clients
+PING_INTERVAL = 5
+
 
 class ServerProcess(Process):
 
-    def __init__(self, port, child_conn):
+    def __init__(self, port, child_conn, local_name=None, **options):
+        """
+            Given a port, the child end of a pipe, optionally a name for additionally listening for local connections
+            and options for the ServerManager.
+        """
         super().__init__()
         self.port = port
+        self.local_name = local_name
         self.child_conn = child_conn
+        self.options = options
 
     def run(self):
         app = QtCore.QCoreApplication([])
-        server_manager = ServerManager()
+        server_manager = ServerManager(**self.options)
         server_manager.server.start(self.port)
+        if self.local_name is not None:
+            server_manager.server.start_local(self.local_name)
 
         # start thread which listens on the child_connection
         t = Thread(target=self.listen, args = (app, server_manager))
@@ -60,123 +68,93 @@ class ServerProcess(Process):
         while True:
             message = self.child_conn.recv()
             if message == 'quit':
-                server_manager.server.stop()
+                server_manager.stop()
                 app.quit()
                 return
 
 
-class ServerManager(QtCore.QObject):
+class EventLoopPoster(QtCore.QObject):
     """
-        Manages the server, the clients on the server and the general services on the server. In particular creates new
-        clients on the server (server clients),
+        Calls functions on the thread of the Qt event loop this object lives in. post(..) can be called from any thread,
+        the signal is then delivered as a queued connection.
     """
 
+    posted = QtCore.Signal(object)
+
     def __init__(self):
-        """
-            We start with a server and an empty list of server clients.
-        """
         super().__init__()
-        self.server = Server()
-        self.server.new_client.connect(self.new_client)
-        self.server_clients = []
+        self.posted.connect(self.call)
 
-    def new_client(self, socket):
+    def post(self, function):
         """
-            A new connection to the server. Give an id and add some general receivers to the new server client.
-            Finally append new server client to the internal client list.
+            Schedules a function (without arguments) to be called on the event loop.
         """
-        client = NetworkClient()
-        client.set_socket(socket)
+        self.posted.emit(function)
 
-        # give a new id
-        while True:
-            # theoretically this could take forever, practically only if we have 1e6 clients already
-            new_id = random.randint(0, 1e6)
-            if not any([new_id == client.id for client in self.server_clients]):
-                # not any == none
-                break
-        client.client_id = new_id
+    @staticmethod
+    def call(function):
+        function()
 
-        # add some general receivers.
-        client.connect_to_channel(c.CH_SCENARIO_PREVIEW, self.scenario_preview)
-        client.connect_to_channel(c.CH_CORE_SCENARIO_TITLES, self.core_scenario_titles)
 
-        # finally add to list of clients
-        self.server_clients.append(client)
+class ServerManager(QtCore.QObject):
+    """
+        Manages the server and the clients on the server. In particular creates new clients on the server (server
+        clients) for new connections and hands them to the general services (see server.services.ServerServices).
+    """
 
-    @staticmethod
-    def core_scenario_titles(client, message):
-        """
-            A server client received a message on the c.CH_CORE_SCENARIO_TITLES channel. Return all available core
-            scenario titles and file names.
+    def __init__(self, send_high_watermark=4 * 1024 * 1024, send_low_watermark=1024 * 1024,
+                 overflow_policy='disconnect', record_folder=None, **options):
         """
-        # get all core scenario files
-        scenario_files = [x for x in os.listdir(c.Core_Scenario_Folder) if x.endswith('.scenario')]
+            We start with a server and the general services (options are given to ServerServices), which post the
+            results of background work back to the Qt event loop.
 
-        # joing the path
-        scenario_files = [os.path.join(c.Core_Scenario_Folder, x) for x in scenario_files]
+            If a record folder is given, the messages of every server client are recorded there (see lib.recording),
+            one file per connection.
 
-        # read scenario titles
-        scenario_titles = []
-        for scenario_file in scenario_files:
-            reader = u.ZipArchiveReader(scenario_file)
-            properties = reader.read_as_yaml('properties')
-            scenario_titles.append(properties[k.TITLE])
+            The outbound data of each server client is limited by watermarks and an overflow policy (see
+            lib.network.Client.set_watermarks), so slow clients cannot bloat the server memory.
+        """
+        super().__init__()
+        self.server = Server()
+        self.server.new_client.connect(self.new_client)
+        self.watermarks = (send_high_watermark, send_low_watermark, overflow_policy)
+        self.record_folder = record_folder
+        self.record_prefix = time.strftime('session-%Y%m%d-%H%M%S')
+        self.poster = EventLoopPoster()
+        self.services = ServerServices(self.poster.post, **options)
+
+        # regularly measure the round trip times
+        self.ping_timer = QtCore.QTimer()
+        self.ping_timer.timeout.connect(self.services.ping_all)
+        self.ping_timer.start(int(PING_INTERVAL * 1000))
+
+    def stop(self):
+        """
+            Stops listening and all background activities.
+        """
+        self.server.stop()
+        self.services.stop()
+
+    def new_client(self, socket):
+        """
+            A new connection to the server. Create a server client and hand it to the services.
+        """
+        client = NetworkClient()
+        client.set_socket(socket)
+        client.set_watermarks(*self.watermarks)
 
-        # zip files and titles together
-        scenarios = zip(scenario_titles, scenario_files)
+        # clean up when gone
+        client.disconnected.connect(lambda: self.client_disconnected(client))
 
-        # sort them
-        scenarios = sorted(scenarios)  # default sort order is by first element anyway
+        self.services.add_client(client)
 
-        # return message
-        titles = {
-            'scenarios': scenarios
-        }
-        client.send(message['reply-to'], titles)
+        if self.record_folder is not None:
+            client.start_recording(os.path.join(self.record_folder, '{}-{}.recording'.format(self.record_prefix,
+                                                                                             client.client_id)))
 
-    def scenario_preview(self, client, message):
+    def client_disconnected(self, client):
         """
-            A client got a message on the c.CH_SCENARIO_PREVIEW channel. In the message should be a scenario file name
-            (key = 'scenario'). Assemble a preview and send it back.
+            A server client disconnected.
         """
-        t0 = time.clock()
-
-        scenario = Scenario()
-        file_name = message['scenario']  # should be the file name
-        # TODO existing? can be loaded?
-        scenario.load(file_name)
-        print('reading the file took {}s'.format(time.clock() - t0))
-
-        preview = {'scenario': file_name}
-
-        # some scenario properties should be copied
-        scenario_copy_keys = [k.MAP_COLUMNS, k.MAP_ROWS, k.TITLE, k.DESCRIPTION]
-        for key in scenario_copy_keys:
-            preview[key] = scenario[key]
-
-        # some nations properties should be copied
-        nations = {}
-        nation_copy_keys = [kn.COLOR, kn.NAME, kn.DESCRIPTION]
-        for nation in scenario.all_nations():
-            nations[nation] = {}
-            for key in nation_copy_keys:
-                nations[nation][key] = scenario.get_nation_property(nation, key)
-        preview['nations'] = nations
-
-        # assemble a nations map (-1 means no nation)
-        columns = scenario[k.MAP_COLUMNS]
-        rows = scenario[k.MAP_ROWS]
-        nations_map = [-1] * (columns * rows)
-        for nation_id in scenario.all_nations():
-            provinces = scenario.get_provinces_of_nation(nation_id)
-            for province in provinces:
-                tiles = scenario.get_province_property(province, 'tiles')
-                for column, row in tiles:
-                    nations_map[row * columns + column] = nation_id
-        preview['map'] = nations_map
-
-        # send return message
-        client.send(message['reply-to'], preview)
-
-        print('generating preview took {}s'.format(time.clock() - t0))
+        self.services.client_disconnected(client)
+        client.socket.deleteLater()
@@ -0,0 +1,156 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from collections import OrderedDict
+from threading import Lock
+
+from base.constants import PropertyKeyNames as k, NationPropertyKeyNames as kn
+from lib.runlength import encode_runs
+from server.catalog import file_identity
+from server.scenario import Scenario
+
+"""
+    Scenario previews (what is shown in the lobby before a scenario is started) and a cache of them.
+"""
+
+
+def build_preview(file_name):
+    """
+        Assembles the preview of a scenario file: some scenario properties, some nation properties and a nations map.
+
+        The nations map is encoded compactly as palette (nation ids and -1 for no nation) and runs (see lib.runlength).
+    """
+    scenario = Scenario()
+    # TODO existing? can be loaded?
+    scenario.load(file_name, lazy=True)  # the map section is never needed
+
+    preview = {'scenario': file_name}
+
+    # some scenario properties should be copied
+    scenario_copy_keys = [k.MAP_COLUMNS, k.MAP_ROWS, k.TITLE, k.DESCRIPTION]
+    for key in scenario_copy_keys:
+        preview[key] = scenario[key]
+
+    # some nations properties should be copied
+    nations = {}
+    nation_copy_keys = [kn.COLOR, kn.NAME, kn.DESCRIPTION]
+    for nation in scenario.all_nations():
+        nations[nation] = {}
+        for key in nation_copy_keys:
+            nations[nation][key] = scenario.get_nation_property(nation, key)
+    preview['nations'] = nations
+
+    # assemble a nations map (-1 means no nation)
+    columns = scenario[k.MAP_COLUMNS]
+    rows = scenario[k.MAP_ROWS]
+    nations_map = [-1] * (columns * rows)
+    for nation_id in scenario.all_nations():
+        provinces = scenario.get_provinces_of_nation(nation_id)
+        for province in provinces:
+            tiles = scenario.get_province_property(province, 'tiles')
+            for column, row in tiles:
+                nations_map[row * columns + column] = nation_id
+    palette, runs = encode_runs(nations_map)
+    preview['map'] = {'palette': palette, 'runs': runs}
+
+    return preview
+
+
+class PreviewCache():
+    """
+        Bounded least recently used cache of scenario previews. Entries are keyed by file name and are rebuilt whenever
+        the identity of the file (modification time, size) changes.
+
+        A preview is sent encoded with the settings of each connection (e.g. not compressed on local connections, see
+        lib.protocol). The encoded previews are cached too, once per group of connections with equal settings.
+    """
+
+    def __init__(self, capacity=16):
+        """
+            Given the maximal number of cached previews.
+        """
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, file_name):
+        """
+            Returns the preview of a scenario file, either from the cache or freshly built.
+        """
+        preview, identity = self.lookup(file_name)
+        if preview is None:
+            # build outside of the lock, this is the expensive part
+            preview = build_preview(file_name)
+            self.store(file_name, identity, preview)
+        return preview
+
+    def lookup(self, file_name):
+        """
+            Returns the cached preview (or None if not cached or outdated) and the current identity of the file.
+        """
+        identity = file_identity(file_name)
+        with self._lock:
+            entry = self._cache.get(file_name, None)
+            if entry is not None and entry[0] == identity:
+                self._cache.move_to_end(file_name)
+                return entry[1], identity
+        return None, identity
+
+    def store(self, file_name, identity, preview):
+        """
+            Puts a preview (built for a given identity of the file) in the cache.
+        """
+        with self._lock:
+            self._cache[file_name] = (identity, preview, {})
+            self._cache.move_to_end(file_name)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+    def encode(self, file_name, preview, protocol):
+        """
+            Returns a preview (of a file) encoded with a protocol (see lib.protocol.Protocol), encoded only once for all
+            protocols with equal settings as long as the preview is cached.
+        """
+        settings = protocol.settings()
+        with self._lock:
+            entry = self._cache.get(file_name, None)
+            if entry is None or entry[1] is not preview:
+                # not (or not anymore) cached
+                return protocol.encode(preview)
+            encodings = entry[2]
+            if settings not in encodings:
+                encodings[settings] = protocol.encode(preview)
+            return encodings[settings]
+
+    def prewarm(self, file_names):
+        """
+            Builds the previews of some scenario files in advance. Invalid files are ignored.
+        """
+        for file_name in file_names[:self.capacity]:
+            try:
+                self.get(file_name)
+            except Exception:
+                pass
+
+    def invalidate(self, file_name=None):
+        """
+            Removes the preview of a file or of all files (file_name is None) from the cache.
+        """
+        with self._lock:
+            if file_name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(file_name, None)
@@ -0,0 +1,106 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from itertools import count
+
+"""
+    Bookkeeping of the clients connected to the server.
+"""
+
+
+class ClientRegistry():
+    """
+        All server clients by id, additionally grouped by state (e.g. 'connected'). Ids are given in increasing order
+        and never reused during the lifetime of the registry. Adding, looking up, changing the state and removing are
+        all O(1).
+
+        Iterating over the registry yields the clients in order of registration.
+    """
+
+    def __init__(self):
+        self.clients = {}
+        self.states = {}
+        self.clients_by_state = {}
+        self.ids = count(1)
+
+    def add(self, client, state='connected'):
+        """
+            Registers a client with a state and returns its new id.
+        """
+        client_id = next(self.ids)
+        self.clients[client_id] = client
+        self.states[client_id] = state
+        self.clients_by_state.setdefault(state, {})[client_id] = client
+        return client_id
+
+    def remove(self, client_id):
+        """
+            Unregisters a client (if registered) and returns it (or None).
+        """
+        client = self.clients.pop(client_id, None)
+        if client is not None:
+            self._leave_state(client_id, self.states.pop(client_id))
+        return client
+
+    def get(self, client_id):
+        """
+            The client with an id (or None).
+        """
+        return self.clients.get(client_id, None)
+
+    def state(self, client_id):
+        """
+            The state of a client.
+        """
+        return self.states[client_id]
+
+    def set_state(self, client_id, state):
+        """
+            Changes the state of a client.
+        """
+        client = self.clients[client_id]
+        self._leave_state(client_id, self.states[client_id])
+        self.states[client_id] = state
+        self.clients_by_state.setdefault(state, {})[client_id] = client
+
+    def in_state(self, state):
+        """
+            All clients in a state (a list, so the registry may be changed while iterating over it).
+        """
+        return list(self.clients_by_state.get(state, {}).values())
+
+    def count(self, state=None):
+        """
+            Number of clients (in a state or in total).
+        """
+        if state is None:
+            return len(self.clients)
+        return len(self.clients_by_state.get(state, ()))
+
+    def _leave_state(self, client_id, state):
+        clients = self.clients_by_state[state]
+        del clients[client_id]
+        if not clients:
+            del self.clients_by_state[state]
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __iter__(self):
+        return iter(list(self.clients.values()))
+
+    def __contains__(self, client_id):
+        return client_id in self.clients
@@ -15,8 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 import math
-
-from PySide import QtCore
+from array import array
 
 import lib.utils as u
 from base import constants as c
@@ -28,9 +27,67 @@ from base import constants as c
 
 # TODO rivers are implemented inefficiently
 
-class Scenario(QtCore.QObject):
+# names of the map layers (one value per tile each) and the typecode of their compact storage
+MAP_LAYERS = {
+    'terrain': 'B',
+    'resource': 'B'
+}
+
+# sections of a scenario archive and the internal attributes they are stored in
+SECTIONS = ('properties', 'map', 'provinces', 'nations')
+_SECTION_OF_ATTRIBUTE = {
+    '_properties': 'properties',
+    '_rules': 'properties',
+    '_map': 'map',
+    '_provinces': 'provinces',
+    '_province_index': 'provinces',
+    '_nations': 'nations'
+}
+
+# neighbor tables already built for a map size (columns, rows)
+_neighbor_tables = {}
+
+
+def neighbor_table(columns, rows):
+    """
+        Returns the neighbor table of a map of a given size. It's a flat typed array with six entries per tile (in the
+        order of c.TileDirections) which are the indices of the neighbored tiles or -1 if the neighbor would be outside
+        of the map. The table is only built once for each map size.
+    """
+    key = (columns, rows)
+    if key not in _neighbor_tables:
+        _neighbor_tables[key] = _build_neighbor_table(columns, rows)
+    return _neighbor_tables[key]
+
+
+def _build_neighbor_table(columns, rows):
+    """
+        Builds the neighbor table for our staggered tile layout where the second and all other odd rows are shifted
+        half a tile to the right.
+    """
+    table = array('i')
+    for row in range(0, rows):
+        # column offsets of the north/south neighbors (west, east) in even (0, 2, 4, ..) and odd (1, 3, 5, ..) rows
+        west, east = (-1, 0) if row % 2 == 0 else (0, 1)
+        north = row > 0
+        south = row < rows - 1
+        for column in range(0, columns):
+            index = row * columns + column
+            has_west = column + west >= 0
+            has_east = column + east < columns
+            table.extend((
+                index - 1 if column > 0 else -1,
+                index - columns + west if north and has_west else -1,
+                index - columns + east if north and has_east else -1,
+                index + 1 if column < columns - 1 else -1,
+                index + columns + east if south and has_east else -1,
+                index + columns + west if south and has_west else -1))
+    return table
+
+
+class Scenario():
     """
-        Has several dictionaries (properties, provinces, nations) and a list (map) defining everything.
+        Has several dictionaries (properties, provinces, nations) and typed arrays (map layers) defining everything.
     """
 
     def __init__(self):
@@ -38,6 +95,7 @@ class Scenario(QtCore.QObject):
             Start with a clean state.
         """
         super().__init__()
+        self._changes = None
         self.reset()
 
     # noinspection PyAttributeOutsideInit
@@ -46,19 +104,49 @@ class Scenario(QtCore.QObject):
             Just empty
         """
         self._properties = {c.PropertyKeyNames.RIVERS: []}
+        self._rules = {}
         self._provinces = {}
         self._nations = {}
         self._map = {}
+        self._province_index = []
+        self._reader = None
+
+    def track_changes(self, changes):
+        """
+            From now on all changes of terrain, resources, provinces, nations and properties are recorded in a change
+            log (see base.sync.ChangeLog). None stops recording. Structural changes (create_map, load) are not
+            recorded.
+        """
+        self._changes = changes
+
+    def state(self):
+        """
+            Returns the whole state as plain values (properties, map layers including the tile to province index as
+            typed arrays, provinces without tile lists and nations), e.g. as snapshot for clients (see base.sync). Only
+            the map layers are copied, so encode it right away.
+        """
+        layers = {layer: array(typecode, self._map[layer]) for layer, typecode in MAP_LAYERS.items()}
+        layers['province'] = array('i', self._province_index)
+        provinces = {}
+        for province, content in self._provinces.items():
+            provinces[province] = {key: value for key, value in content.items() if key != 'tiles'}
+        return {
+            'properties': self._properties,
+            'map': layers,
+            'provinces': provinces,
+            'nations': self._nations
+        }
 
     def create_map(self, columns, rows):
         """
-            Given a size, constructs a map (list of two sub lists with each the number of tiles entries) which is 0.
+            Given a size, constructs a map (a typed array with the number of tiles entries for each layer) which is 0.
         """
         self._properties[c.PropertyKeyNames.MAP_COLUMNS] = columns
         self._properties[c.PropertyKeyNames.MAP_ROWS] = rows
         number_tiles = columns * rows
-        self._map['terrain'] = [0] * number_tiles
-        self._map['resource'] = [0] * number_tiles
+        for layer, typecode in MAP_LAYERS.items():
+            self._map[layer] = array(typecode, [0]) * number_tiles
+        self._province_index = array('i', [-1]) * number_tiles
 
     def add_river(self, name, tiles):
         """
@@ -69,12 +157,17 @@ class Scenario(QtCore.QObject):
             'tiles': tiles
         }
         self._properties[c.PropertyKeyNames.RIVERS].extend([river])
+        if self._changes is not None:
+            self._changes.record(['river', name, tiles])
 
     def set_terrain_at(self, column, row, terrain):
         """
             Sets the terrain at a given position.
         """
-        self._map['terrain'][self.map_index(column, row)] = terrain
+        index = self.map_index(column, row)
+        self._map['terrain'][index] = terrain
+        if self._changes is not None:
+            self._changes.tile('terrain', index, terrain)
 
     def terrain_at(self, column, row):
         """
@@ -86,7 +179,10 @@ class Scenario(QtCore.QObject):
         """
             Sets the resource value at a given position.
         """
-        self._map['resource'][self.map_index(column, row)] = resource
+        index = self.map_index(column, row)
+        self._map['resource'][index] = resource
+        if self._changes is not None:
+            self._changes.tile('resource', index, resource)
 
     def resource_at(self, column, row):
         """
@@ -94,6 +190,109 @@ class Scenario(QtCore.QObject):
         """
         return self._map['resource'][self.map_index(column, row)]
 
+    def map_layer(self, layer):
+        """
+            Returns the whole map layer (typed array with one value per tile, row after row). Fastest way to traverse
+            all tiles, but do not change the size of it.
+        """
+        return self._map[layer]
+
+    def get_layer_rect(self, layer, column, row, width, height):
+        """
+            Returns the values of a map layer in a rectangle (of width columns and height rows starting at column, row)
+            as a typed array (row after row).
+        """
+        self._check_rect(column, row, width, height)
+        data = self._map[layer]
+        columns = self._properties[c.PropertyKeyNames.MAP_COLUMNS]
+        values = array(MAP_LAYERS[layer])
+        for r in range(row, row + height):
+            start = r * columns + column
+            values.extend(data[start:start + width])
+        return values
+
+    def set_layer_rect(self, layer, column, row, width, height, value):
+        """
+            Sets the values of a map layer in a rectangle either to a single value or to a sequence of width * height
+            values (row after row).
+        """
+        self._check_rect(column, row, width, height)
+        data = self._map[layer]
+        columns = self._properties[c.PropertyKeyNames.MAP_COLUMNS]
+        if isinstance(value, int):
+            values = array(MAP_LAYERS[layer], [value]) * (width * height)
+        else:
+            values = array(MAP_LAYERS[layer], value)
+            if len(values) != width * height:
+                raise RuntimeError('Number of values does not match the rectangle size.')
+        for r in range(0, height):
+            start = (row + r) * columns + column
+            data[start:start + width] = values[r * width:(r + 1) * width]
+            if self._changes is not None:
+                self._changes.tiles(layer, range(start, start + width), values[r * width:(r + 1) * width])
+
+    def get_layer_at(self, layer, positions):
+        """
+            Returns the values of a map layer at a list of positions (column, row) as a list (None for positions
+            outside of the map).
+        """
+        data = self._map[layer]
+        columns = self._properties[c.PropertyKeyNames.MAP_COLUMNS]
+        rows = self._properties[c.PropertyKeyNames.MAP_ROWS]
+        return [data[row * columns + column] if 0 <= column < columns and 0 <= row < rows else None for column, row in
+                positions]
+
+    def set_layer_at(self, layer, positions, value):
+        """
+            Sets the values of a map layer at a list of positions (column, row) either to a single value or to a
+            sequence of values (one for each position). Raises an error if a position is outside of the map.
+        """
+        data = self._map[layer]
+        columns = self._properties[c.PropertyKeyNames.MAP_COLUMNS]
+        for position in positions:
+            if not self.is_valid_position(position):
+                raise RuntimeError('Position {} is not inside the map.'.format(position))
+        if isinstance(value, int):
+            value = [value] * len(positions)
+        indices = [row * columns + column for column, row in positions]
+        for index, v in zip(indices, value):
+            data[index] = v
+        if self._changes is not None:
+            self._changes.tiles(layer, indices, value)
+
+    def layer_mask(self, layer, value):
+        """
+            Returns a mask (typed array of 0 and 1 for each tile) of all tiles where a map layer has a certain value.
+        """
+        return array('B', [v == value for v in self._map[layer]])
+
+    def get_layer_masked(self, layer, mask):
+        """
+            Returns the values of a map layer for all tiles where the mask (sequence with one entry per tile) is set.
+        """
+        data = self._map[layer]
+        return array(MAP_LAYERS[layer], [v for v, m in zip(data, mask) if m])
+
+    def set_layer_masked(self, layer, mask, value):
+        """
+            Sets the values of a map layer to a value for all tiles where the mask (sequence with one entry per tile)
+            is set.
+        """
+        data = self._map[layer]
+        for index, m in enumerate(mask):
+            if m:
+                data[index] = value
+                if self._changes is not None:
+                    self._changes.tile(layer, index, value)
+
+    def _check_rect(self, column, row, width, height):
+        """
+            Raises an error if a rectangle is not fully inside the map.
+        """
+        if column < 0 or row < 0 or width < 0 or height < 0 or column + width > self._properties[
+                c.PropertyKeyNames.MAP_COLUMNS] or row + height > self._properties[c.PropertyKeyNames.MAP_ROWS]:
+            raise RuntimeError('Rectangle {} is not inside the map.'.format((column, row, width, height)))
+
     def map_position(self, x, y):
         """
             Converts a scene position to a map position (or return (-1,-1) if
@@ -113,6 +312,14 @@ class Scenario(QtCore.QObject):
         # TODO move to client side, has nothing to do with server (or has it?)
         return column + (row % 2) / 2, row
 
+    def is_valid_position(self, position):
+        """
+            Checks if a position (column, row) lies within the map.
+        """
+        column, row = position
+        return 0 <= column < self._properties[c.PropertyKeyNames.MAP_COLUMNS] and 0 <= row < self._properties[
+            c.PropertyKeyNames.MAP_ROWS]
+
     def map_index(self, column, row):
         """
             Calculates the index in the linear map for a given 2D position (first row, then column)?
@@ -120,83 +327,61 @@ class Scenario(QtCore.QObject):
         index = row * self._properties[c.PropertyKeyNames.MAP_COLUMNS] + column
         return index
 
+    def neighbor_table(self):
+        """
+            Returns the neighbor table of this map (see neighbor_table(columns, rows)).
+        """
+        return neighbor_table(self._properties[c.PropertyKeyNames.MAP_COLUMNS],
+                              self._properties[c.PropertyKeyNames.MAP_ROWS])
+
     def get_neighbor_position(self, column, row, direction):
         """
             Given a positon (column, row) and a direction (c.TileDirections) return the position of the next neighbor
             tile in that direction given our staggered tile layout where the second and all other odd rows are shifted
             half a tile to the right. Returns None if we would be outside of the map area.
         """
-        if direction is c.TileDirections.West:
-            # west
-            if column > 0:
-                return [column - 1, row]
-            else:
-                return None
-        elif direction is c.TileDirections.NorthWest:
-            # north-west
-            if row > 0:
-                if row % 2 == 0:
-                    # even rows (0, 2, 4, ..)
-                    return [column - 1, row - 1]
-                else:
-                    # odd rows (1, 3, 5, ..)
-                    return [column, row - 1]
-            else:
-                return None
-        elif direction is c.TileDirections.NorthEast:
-            # north-east
-            if row > 0:
-                if row % 2 == 0:
-                    # even rows (0, 2, 4, ..)
-                    return [column, row - 1]
-                else:
-                    # odd rows (1, 3, 5, ..)
-                    return [column + 1, row - 1]
-            else:
-                return None
-        elif direction is c.TileDirections.East:
-            # east
-            if column < self._properties[c.PropertyKeyNames.MAP_COLUMNS] - 1:
-                return [column + 1, row]
-            else:
-                return None
-        elif direction is c.TileDirections.SouthEast:
-            # south-east
-            if row < self._properties[c.PropertyKeyNames.MAP_ROWS] - 1:
-                if row % 2 == 0:
-                    # even rows (0, 2, 4, ..)
-                    return [column, row + 1]
-                else:
-                    # odd rows (1, 3, 5, ..)
-                    return [column + 1, row + 1]
-            else:
-                return None
-        elif direction is c.TileDirections.SouthWest:
-            # south-west
-            if row < self._properties[c.PropertyKeyNames.MAP_ROWS] - 1:
-                if row % 2 == 0:
-                    # even rows (0, 2, 4, ..)
-                    return [column - 1, row + 1]
-                else:
-                    # odd rows (1, 3, 5, ..)
-                    return [column, row + 1]
-            else:
-                return None
+        columns = self._properties[c.PropertyKeyNames.MAP_COLUMNS]
+        neighbor = self.neighbor_table()[6 * (row * columns + column) + direction.value - 1]
+        if neighbor == -1:
+            return None
+        return [neighbor % columns, neighbor // columns]
 
     def get_neighbored_tiles(self, column, row):
         """
-            For all directions, get all neighbored tiles.
+            For all directions, get all neighbored tiles (None for directions where we would be outside of the map).
+        """
+        columns = self._properties[c.PropertyKeyNames.MAP_COLUMNS]
+        start = 6 * (row * columns + column)
+        neighbors = self.neighbor_table()[start:start + 6]
+        return [[n % columns, n // columns] if n != -1 else None for n in neighbors]
+
+    def neighbor_indices(self, index):
+        """
+            Iterates over the map indices of all neighbors of a tile given by its map index (skips outside neighbors).
         """
-        tiles = []
-        for direction in c.TileDirections:
-            tiles.append(self.get_neighbor_position(column, row, direction))
-        return tiles
+        start = 6 * index
+        for neighbor in self.neighbor_table()[start:start + 6]:
+            if neighbor != -1:
+                yield neighbor
+
+    def get_neighbor_indices(self, indices):
+        """
+            Given a sequence of map indices returns a typed array with the six neighbor indices (-1 for outside) of each
+            of them, the same layout as the neighbor table.
+        """
+        table = self.neighbor_table()
+        neighbors = array('i')
+        for index in indices:
+            neighbors.extend(table[6 * index:6 * index + 6])
+        return neighbors
 
     def __setitem__(self, key, value):
         """
             Given a key and a value, sets a scenario property.
         """
         self._properties[key] = value
+        if self._changes is not None:
+            self._changes.record(['property', key, value])
 
     def __getitem__(self, key):
         """
@@ -215,6 +400,8 @@ class Scenario(QtCore.QObject):
         self._provinces[province] = {}
         self._provinces[province]['tiles'] = []
         self._provinces[province]['nation'] = None
+        if self._changes is not None:
+            self._changes.record(['new province', province])
         return province
 
     def set_province_property(self, province, key, value):
@@ -223,6 +410,8 @@ class Scenario(QtCore.QObject):
         """
         if province in self._provinces:
             self._provinces[province][key] = value
+            if self._changes is not None:
+                self._changes.record(['province', province, key, value])
         else:
             raise RuntimeError('Unknown province {}.'.format(province))
 
@@ -242,6 +431,10 @@ class Scenario(QtCore.QObject):
         """
         if province in self._provinces and self.is_valid_position(position):
             self._provinces[province]['tiles'].append(position)
+            index = self.map_index(*position)
+            self._province_index[index] = province
+            if self._changes is not None:
+                self._changes.tile('province', index, province)
 
     def all_nations(self):
         """
@@ -257,6 +450,8 @@ class Scenario(QtCore.QObject):
         self._nations[nation] = {}
         self._nations[nation]['properties'] = {}
         self._nations[nation]['provinces'] = []
+        if self._changes is not None:
+            self._changes.record(['new nation', nation])
         return nation
 
     def set_nation_property(self, nation, key, value):
@@ -265,6 +460,8 @@ class Scenario(QtCore.QObject):
         """
         if nation in self._nations:
             self._nations[nation]['properties'][key] = value
+            if self._changes is not None:
+                self._changes.record(['nation', nation, key, value])
         else:
             raise RuntimeError('Unknown nation {}.'.format(nation))
 
@@ -288,15 +485,40 @@ class Scenario(QtCore.QObject):
 
     def get_province_at(self, column, row):
         """
-            Given a position (column, row) returns the province.
+            Given a position (column, row) returns the province (or None if the tile is not part of any province or
+            outside of the map).
 
-            TODO speed up by having a reference in the map. (see also programmers.SE question)
+            Constant time lookup in the tile to province index.
         """
-        position = [column, row]  # internally because of JSON saving we only have []
-        for province in self._provinces:
-            if position in self._provinces[province]['tiles']:
-                return province
-        return None
+        if not self.is_valid_position((column, row)):
+            return None
+        province = self._province_index[self.map_index(column, row)]
+        return province if province != -1 else None
+
+    def get_provinces_at(self, positions):
+        """
+            Given a list of positions (column, row) returns the list of provinces (None for tiles without a province
+            and for positions outside of the map) at these positions.
+        """
+        index = self._province_index
+        columns = self._properties[c.PropertyKeyNames.MAP_COLUMNS]
+        rows = self._properties[c.PropertyKeyNames.MAP_ROWS]
+        provinces = [index[row * columns + column] if 0 <= column < columns and 0 <= row < rows else -1 for column, row
+                     in positions]
+        return [province if province != -1 else None for province in provinces]
+
+    def build_province_index(self):
+        """
+            (Re)builds the tile to province index (typed array with the province id for each tile or -1) from the
+            tiles lists of all provinces. Needed after the provinces have been loaded.
+        """
+        columns = self._properties[c.PropertyKeyNames.MAP_COLUMNS]
+        rows = self._properties[c.PropertyKeyNames.MAP_ROWS]
+        index = array('i', [-1]) * (columns * rows)
+        for province, content in self._provinces.items():
+            for column, row in content['tiles']:
+                index[row * columns + column] = province
+        self._province_index = index
 
     def transfer_province_to_nation(self, province, nation):
         """
@@ -306,6 +528,8 @@ class Scenario(QtCore.QObject):
         # wire it in both ways
         self._nations[nation]['provinces'].append(province)
         self._provinces[province]['nation'] = nation
+        if self._changes is not None:
+            self._changes.record(['transfer', province, nation])
 
     def get_terrain_name(self, terrain):
         """
@@ -313,36 +537,150 @@ class Scenario(QtCore.QObject):
 
             TODO move this to a special rules class. Only have rules() and setRules() here.
         """
-        return self._properties['rules']['terrain.names'][terrain]
+        return self._rules['terrain.names'][terrain]
 
-    def load(self, file_name):
+    def load(self, file_name, lazy=False):
         """
-            Loads/deserializes all internal variables from a zipped archive via JSON.
+            Loads/deserializes all internal variables either from a binary columnar archive (see save_binary) or from a
+            zipped archive via YAML.
+
+            If lazy is True, the archive is only opened and each section (see SECTIONS) is read the first time it is
+            accessed. See also materialized_sections().
         """
         self.reset()
-        reader = u.ZipArchiveReader(file_name)
-        self._properties = reader.read_as_yaml('properties')
-        self._map = reader.read_as_yaml('map')
-        self._provinces = reader.read_as_yaml('provinces')
-        # TODO check all ids are smaller then len()
-        self._nations = reader.read_as_yaml('nations')
-        # TODO check all ids are smaller then len()
-        self.load_rules()
+        if u.is_columnar_archive(file_name):
+            self._reader = u.ColumnarArchiveReader(file_name)
+        else:
+            self._reader = u.ZipArchiveReader(file_name)
+        # remove the sections, they will be read in __getattr__
+        for attribute in _SECTION_OF_ATTRIBUTE:
+            delattr(self, attribute)
+        if not lazy:
+            for section in SECTIONS:
+                self._load_section(section)
+            self._reader = None
+
+    def materialized_sections(self):
+        """
+            Returns a list of all sections (see SECTIONS) that are already read (all of them unless loaded lazily).
+        """
+        return [section for section in SECTIONS if all(attribute in self.__dict__ for attribute, s in
+                                                        _SECTION_OF_ATTRIBUTE.items() if s == section)]
+
+    def __getattr__(self, name):
+        """
+            Only called if an attribute does not exist. If it's a section attribute of a lazily loaded scenario, the
+            section is read now.
+        """
+        section = _SECTION_OF_ATTRIBUTE.get(name, None)
+        if section is None or self.__dict__.get('_reader', None) is None:
+            raise AttributeError(name)
+        self._load_section(section)
+        return self.__dict__[name]
+
+    def _load_section(self, section):
+        """
+            Reads a single section from the archive (binary columnar or zipped YAML).
+        """
+        reader = self._reader
+        binary = isinstance(reader, u.ColumnarArchiveReader)
+        if section == 'properties':
+            self._properties = reader.read_as_yaml('properties')
+            self.load_rules()
+        elif section == 'map':
+            self._map = {}
+            if binary:
+                # memory mapped, nothing is decoded
+                for layer in MAP_LAYERS:
+                    self._map[layer] = reader.read_array('map.' + layer)
+            else:
+                # convert the map layers to compact typed arrays
+                yaml_map = reader.read_as_yaml('map')
+                for layer, typecode in MAP_LAYERS.items():
+                    self._map[layer] = array(typecode, yaml_map[layer])
+        elif section == 'provinces':
+            # TODO check all ids are smaller then len()
+            self._provinces = reader.read_as_yaml('provinces')
+            if binary:
+                # the tiles lists of the provinces are only stored in the tile to province index
+                self._province_index = reader.read_array('map.province')
+                self._restore_province_tiles()
+            else:
+                self.build_province_index()
+        elif section == 'nations':
+            # TODO check all ids are smaller then len()
+            self._nations = reader.read_as_yaml('nations')
 
-    def load_rules(self):
+    def _restore_province_tiles(self):
         """
+            Fills the tile lists of all provinces from the tile to province index (row after row).
+        """
+        columns = self._properties[c.PropertyKeyNames.MAP_COLUMNS]
+        tiles = {}
+        for province in self._provinces:
+            tiles[province] = self._provinces[province]['tiles'] = []
+        for index, province in enumerate(self._province_index):
+            if province != -1:
+                tiles[province].append([index % columns, index // columns])
 
+    def load_rules(self):
+        """
+            Reads the rules from the ruleset file given in the 'rules' property. The property keeps the file name (it
+            is saved), the rules are kept separately.
         """
-        # read rules
         rule_file = c.extend(c.Scenario_Ruleset_Folder, self._properties['rules'])
-        self._properties['rules'] = u.read_as_yaml(rule_file)
+        self._rules = u.read_as_yaml(rule_file)
+
+    def release_file(self):
+        """
+            Reads all sections not yet read (if loaded lazily) and copies memory mapped map layers (if loaded from a
+            binary archive) into typed arrays, so that the loaded file is not used anymore and can be replaced (on
+            Windows a memory mapped file cannot be replaced).
+        """
+        for attribute in _SECTION_OF_ATTRIBUTE:
+            getattr(self, attribute)
+        self._reader = None
+        mappings = []
+        for layer, typecode in MAP_LAYERS.items():
+            if isinstance(self._map[layer], memoryview):
+                mappings.append(self._map[layer].obj)
+                self._map[layer] = array(typecode, self._map[layer])
+        if isinstance(self._province_index, memoryview):
+            mappings.append(self._province_index.obj)
+            self._province_index = array('i', self._province_index)
+        for mapping in mappings:
+            try:
+                mapping.close()
+            except BufferError:
+                # someone else still has a view into it (see map_layer), it is closed when that is gone
+                pass
 
     def save(self, file_name):
         """
-            Saves/serializes all internal variables via JSON into a zipped archive.
-        """
-        writer = u.ZipArchiveWriter(file_name)
-        writer.write_as_yaml('properties', self._properties)
-        writer.write_as_yaml('map', self._map)
-        writer.write_as_yaml('provinces', self._provinces)
-        writer.write_as_yaml('nations', self._nations)
+            Saves/serializes all internal variables via YAML into a zipped archive.
+        """
+        self.release_file()
+        with u.ZipArchiveWriter(file_name) as writer:
+            writer.write_as_yaml('properties', self._properties)
+            writer.write_as_yaml('map', {layer: self._map[layer].tolist() for layer in self._map})
+            writer.write_as_yaml('provinces', self._provinces)
+            writer.write_as_yaml('nations', self._nations)
+
+    def save_binary(self, file_name):
+        """
+            Saves all internal variables into a binary columnar archive (versioned, see lib.utils.ColumnarArchiveWriter).
+            Properties, provinces (without tile lists) and nations are small YAML entries, the map layers and the tile
+            to province index are stored as raw typed arrays.
+        """
+        self.release_file()
+        with u.ColumnarArchiveWriter(file_name) as writer:
+            writer.write_as_yaml('properties', self._properties)
+            for layer in MAP_LAYERS:
+                writer.write_array('map.' + layer, self._map[layer])
+            # the tile lists are contained in the tile to province index
+            provinces = {}
+            for province, content in self._provinces.items():
+                provinces[province] = {key: value for key, value in content.items() if key != 'tiles'}
+            writer.write_as_yaml('provinces', provinces)
+            writer.write_as_yaml('nations', self._nations)
+            writer.write_array('map.province', self._province_index)
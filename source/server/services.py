@@ -0,0 +1,309 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from threading import Thread
+import time
+
+import base.constants as c
+from base.channels import REQUEST_REPLY_PREFIX
+from base.sync import StateSync
+from base.transfer import Transfers
+from lib.metrics import Metrics
+from server.catalog import ScenarioCatalog
+from server.preview import PreviewCache, build_preview
+from server.registry import ClientRegistry
+from server.workers import TaskPool
+
+"""
+    The general services of the server and the management of its clients, independent of the transport (not Qt), so
+    they can be used by the Qt server (see server.network) as well as by the headless server (see server.headless).
+
+    A client only has to provide the channel interface of base.network.NetworkClient (connect_to_channel(name, callback)
+    with callback(client, message), send, send_encoded, send_bytes, send_settings and encode_letter) as well as ping,
+    round_trip_time and metrics.
+"""
+
+
+class ServerServices():
+    """
+        The clients on the server (server clients) and the general services on the server.
+    """
+
+    def __init__(self, post, catalog_file=None, prewarm_previews=False, workers=2, worker_processes=False,
+                 max_worker_jobs=32):
+        """
+            We start with an empty registry of server clients, a catalog of the core scenarios (optionally persisted in
+            a catalog file) which is refreshed in the background (see core_scenario_titles()) and a cache for scenario
+            previews (which can be filled for all core scenarios in the background right away).
+
+            Heavy requests are run in a pool of worker threads (or processes) with a limited number of jobs. Their
+            results are handed back with the post function, which must call a given function (without arguments) on
+            the thread of the event loop and may be called from any thread.
+
+            Server clients can be subscribed to topics (see publish()). Their traffic is measured (see lib.metrics).
+
+            Scenarios can be hosted as synchronized states (see host_state()). Clients can only send payloads (see
+            base.transfer) the server asked for.
+        """
+        self.server_clients = ClientRegistry()
+        self.metrics = Metrics(grouped_prefixes=(REQUEST_REPLY_PREFIX,))
+        self.transfers = Transfers(accept_offers=False)
+        self.topics = {}
+        self.states = {}
+        self.post = post
+        self.core_scenario_catalog = ScenarioCatalog(c.Core_Scenario_Folder, catalog_file,
+                                                     first_refresh_callback=self.post_catalog_refreshed)
+        self.core_scenario_catalog.start()
+        self.preview_cache = PreviewCache()
+        self.preview_jobs = {}
+        self.task_pool = TaskPool(post, workers, worker_processes, max_worker_jobs)
+        if prewarm_previews:
+            Thread(target=self.prewarm_previews, daemon=True).start()
+
+    def prewarm_previews(self):
+        """
+            Fills the preview cache for all core scenarios (waits for the catalog if needed).
+        """
+        core_scenario_files = [file_name for title, file_name in self.core_scenario_catalog.titles()]
+        self.preview_cache.prewarm(core_scenario_files)
+
+    def stop(self):
+        """
+            Stops all background activities.
+        """
+        self.core_scenario_catalog.stop()
+        self.task_pool.shutdown()
+
+    def add_client(self, client):
+        """
+            A new client connected. Add some general receivers to it and register it (which gives it an id).
+        """
+        # add some general receivers.
+        client.connect_to_channel(c.CH_SCENARIO_PREVIEW, self.scenario_preview)
+        client.connect_to_channel(c.CH_CORE_SCENARIO_TITLES, self.core_scenario_titles)
+        client.connect_to_channel(c.CH_SERVER_METRICS, self.server_metrics)
+        client.connect_to_channel(c.CH_SCENARIO_DOWNLOAD, self.scenario_download)
+        client.connect_to_channel(c.CH_STATE_SYNC, self.state_sync)
+        self.transfers.attach(client)
+
+        # measure all traffic
+        client.metrics = self.metrics
+
+        # finally register
+        client.client_id = self.server_clients.add(client)
+
+    def client_disconnected(self, client):
+        """
+            A server client disconnected. Remove it from the registry and from all topics.
+        """
+        self.unsubscribe_all(client)
+        self.transfers.detach(client)
+        self.server_clients.remove(client.client_id)
+
+    def subscribe(self, client, topic):
+        """
+            Subscribes a server client to a topic. Messages published on the topic are sent to the client on a channel
+            with the name of the topic.
+        """
+        self.topics.setdefault(topic, set()).add(client)
+
+    def unsubscribe(self, client, topic):
+        """
+            Unsubscribes a server client from a topic (if subscribed).
+        """
+        subscribers = self.topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(client)
+            if not subscribers:
+                del self.topics[topic]
+
+    def unsubscribe_all(self, client):
+        """
+            Unsubscribes a server client from all topics.
+        """
+        for topic in list(self.topics.keys()):
+            self.unsubscribe(client, topic)
+
+    def publish(self, topic, message=None):
+        """
+            Sends a message to all subscribers of a topic (on the channel with the name of the topic).
+        """
+        self.send_to_all(self.topics.get(topic, ()), topic, message)
+
+    def broadcast(self, channel_name, message=None):
+        """
+            Sends a message to all server clients.
+        """
+        self.send_to_all(self.server_clients, channel_name, message)
+
+    def send_to_all(self, clients, channel_name, message):
+        """
+            Sends the same message to many server clients. The message is serialized and compressed only once for all
+            clients with equal send settings (negotiated codec and compression) and the same bytes are written to all of
+            them. A client that disconnects while sending (e.g. because its outbound data overflows) leaves the
+            clients (topic subscribers or registry) during the loop, so a copy is iterated.
+        """
+        encoded = {}
+        for client in list(clients):
+            settings = client.send_settings()
+            duration = None
+            if settings not in encoded:
+                start = time.perf_counter()
+                encoded[settings] = (client.encode_letter(channel_name, message), client.protocol.encoded_raw_size)
+                duration = time.perf_counter() - start
+            data, raw_size = encoded[settings]
+            self.metrics.record_sent(channel_name, raw_size, len(data), duration)
+            client.send_bytes(data)
+
+    def host_state(self, name, scenario):
+        """
+            Synchronizes a scenario with all clients that ask for the state with this name (see base.sync). Returns the
+            StateSync, call its commit() after changing the scenario to send the changes.
+        """
+        if name in self.states:
+            raise RuntimeError('State {} already hosted.'.format(name))
+        state = StateSync(name, scenario, self.publish)
+        self.states[name] = state
+        return state
+
+    def remove_state(self, name):
+        """
+            Stops synchronizing a state.
+        """
+        state = self.states.pop(name)
+        state.close()
+        self.topics.pop(state.topic, None)
+
+    def ping_all(self):
+        """
+            Measures the round trip times to all server clients.
+        """
+        for client in self.server_clients:
+            client.ping()
+
+    def server_metrics(self, client, message):
+        """
+            A server client received a message on the c.CH_SERVER_METRICS channel. Return the metrics of all channels,
+            the round trip times of all clients and the statistics of the worker jobs.
+        """
+        metrics = self.metrics.snapshot()
+        metrics['clients'] = {client_id: self.server_clients.get(client_id).round_trip_time for client_id in
+                              self.server_clients.clients}
+        metrics['jobs'] = self.task_pool.statistics()
+        client.send(message['reply-to'], metrics)
+
+    def core_scenario_titles(self, client, message):
+        """
+            A server client received a message on the c.CH_CORE_SCENARIO_TITLES channel. Return all available core
+            scenario titles and file names (sorted by title) from the scenario catalog.
+
+            Before the end of the first refresh of the catalog (without a persisted catalog), the titles known so far
+            are returned together with 'refreshing' and the client is subscribed to the complete titles, which are
+            published on the c.CH_CORE_SCENARIO_TITLES channel when the refresh ends.
+        """
+        refreshing = self.core_scenario_catalog.is_refreshing()
+        titles = {
+            'scenarios': self.core_scenario_catalog.titles(wait=False)
+        }
+        if refreshing:
+            titles['refreshing'] = True
+            self.subscribe(client, c.CH_CORE_SCENARIO_TITLES)
+        client.send(message['reply-to'], titles)
+
+    def post_catalog_refreshed(self):
+        """
+            Called from the thread of the catalog when its first refresh ended.
+        """
+        self.post(self.core_scenario_catalog_refreshed)
+
+    def core_scenario_catalog_refreshed(self):
+        """
+            The first refresh of the catalog of core scenarios ended. Publish the complete titles to all clients that
+            got incomplete titles before (only once).
+        """
+        titles = {
+            'scenarios': self.core_scenario_catalog.titles()
+        }
+        self.publish(c.CH_CORE_SCENARIO_TITLES, titles)
+        self.topics.pop(c.CH_CORE_SCENARIO_TITLES, None)
+
+    def scenario_preview(self, client, message):
+        """
+            A client got a message on the c.CH_SCENARIO_PREVIEW channel. In the message should be a scenario file name
+            (key = 'scenario'). Get the preview from the preview cache and send it back (encoded with the settings of
+            the client, see PreviewCache.encode). If it is not cached, it is built by a worker (one job for all
+            requests of the same preview at the same time) and sent when ready. If that fails, an error is sent back.
+        """
+        file_name = message['scenario']  # should be the file name
+        reply_to = message['reply-to']
+
+        try:
+            preview, identity = self.preview_cache.lookup(file_name)
+        except OSError:
+            client.send(reply_to, {'error': 'unknown scenario'})
+            return
+        if preview is not None:
+            client.send_encoded(reply_to, self.preview_cache.encode(file_name, preview, client.protocol))
+            return
+
+        # already being built
+        if file_name in self.preview_jobs:
+            self.preview_jobs[file_name].append((client, reply_to))
+            return
+
+        def send_preview(preview):
+            self.preview_cache.store(file_name, identity, preview)
+            for waiting_client, waiting_reply_to in self.preview_jobs.pop(file_name):
+                encoded = self.preview_cache.encode(file_name, preview, waiting_client.protocol)
+                waiting_client.send_encoded(waiting_reply_to, encoded)
+
+        def report_error(exception):
+            print('preview of {} failed: {}'.format(file_name, exception))
+            for waiting_client, waiting_reply_to in self.preview_jobs.pop(file_name):
+                waiting_client.send(waiting_reply_to, {'error': 'preview failed'})
+
+        self.preview_jobs[file_name] = [(client, reply_to)]
+        if not self.task_pool.submit('preview', build_preview, (file_name,), send_preview, report_error):
+            print('preview of {} rejected, too many jobs'.format(file_name))
+            del self.preview_jobs[file_name]
+            client.send(reply_to, {'error': 'server busy'})
+
+    def scenario_download(self, client, message):
+        """
+            A client got a message on the c.CH_SCENARIO_DOWNLOAD channel. In the message should be the file name of a
+            core scenario (key = 'scenario'). Start a transfer of the scenario file (see base.transfer) and send back its
+            id.
+        """
+        file_name = message['scenario']
+        # a client only knows about scenarios from the titles, which are not newer than the catalog
+        if file_name not in [x for title, x in self.core_scenario_catalog.titles(False)]:
+            client.send(message['reply-to'], {'error': 'unknown scenario'})
+            return
+        transfer_id = self.transfers.send(client, file_name, {'scenario': file_name})
+        client.send(message['reply-to'], {'transfer': transfer_id})
+
+    def state_sync(self, client, message):
+        """
+            A client got a message on the c.CH_STATE_SYNC channel. In the message should be the name of a hosted state
+            and the epoch and version the client knows (or None). Subscribe the client to the deltas of the state and
+            send back the missing deltas or a snapshot.
+        """
+        state = self.states.get(message['name'], None)
+        if state is None:
+            client.send(message['reply-to'], {'error': 'unknown state'})
+            return
+        self.subscribe(client, state.topic)
+        client.send(message['reply-to'], state.sync_reply(message.get('epoch', None), message.get('version', None)))
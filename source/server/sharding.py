@@ -0,0 +1,251 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import asyncio
+import multiprocessing
+import signal
+import zlib
+
+from lib.framing import FRAME_HEADER
+from lib import protocol as p
+from server.headless import HeadlessServer, HOSTS
+
+"""
+    Sharding of the server over several processes (no Qt needed). A front process accepts all connections and forwards
+    each of them to one of several worker processes (shards), each running its own headless server (see
+    server.headless) with its own services and scenarios.
+
+    The shard is chosen by the session key in the handshake of the client (see lib.protocol.Protocol), so all
+    connections of a game or lobby session end up in the same shard. Connections without a session key are distributed
+    in turn. Crashed shards are restarted (on the same port, so the routing stays the same).
+
+    Shards are started as fresh interpreters ('spawn'), also when restarted from within the running event loop of the
+    front process, so they inherit neither its event loop nor its listening socket. Shards are daemon processes and
+    cannot have worker processes themselves, their services use worker threads.
+"""
+
+# largest handshake message we accept from a client before it is routed
+MAX_HELLO_SIZE = 64 * 1024
+
+# seconds between checks of the shard processes
+SUPERVISION_INTERVAL = 1
+
+# how shard processes are started (see the module description)
+SHARD_CONTEXT = multiprocessing.get_context('spawn')
+
+
+def run_shard(port, options):
+    """
+        Runs a headless server on a local port until terminated. The entry point of a shard process.
+    """
+    server = HeadlessServer(port, 'local', **options)
+    signal.signal(signal.SIGTERM, lambda *args: server.stop())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server.run()
+
+
+class Shard():
+    """
+        A worker process running a headless server on a local port.
+    """
+
+    def __init__(self, port, options):
+        self.port = port
+        self.options = options
+        self.process = None
+        self.restarts = 0
+
+    def start(self):
+        self.process = SHARD_CONTEXT.Process(target=run_shard, args=(self.port, self.options), daemon=True)
+        self.process.start()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        """
+            Terminates the process and waits for it.
+        """
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+
+
+class Forwarder(asyncio.Protocol):
+    """
+        One side of a forwarded connection. Everything received is written to the other side. If one side cannot write
+        fast enough, reading on the other side is paused.
+    """
+
+    def __init__(self, peer=None):
+        self.peer = peer
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        if self.peer is not None and self.peer.transport is not None:
+            self.peer.transport.write(data)
+
+    def pause_writing(self):
+        if self.peer is not None and self.peer.transport is not None:
+            self.peer.transport.pause_reading()
+
+    def resume_writing(self):
+        if self.peer is not None and self.peer.transport is not None:
+            self.peer.transport.resume_reading()
+
+    def connection_lost(self, exception):
+        self.transport = None
+        if self.peer is not None and self.peer.transport is not None:
+            self.peer.transport.close()
+
+
+class FrontConnection(Forwarder):
+    """
+        A connection of a client to the front process. Reads the handshake of the client to find the session key, then
+        connects to the chosen shard and forwards everything (including the handshake) in both directions.
+    """
+
+    def __init__(self, front):
+        super().__init__()
+        self.front = front
+        self.buffer = bytearray()
+
+    def data_received(self, data):
+        if self.peer is not None and self.peer.transport is not None:
+            self.peer.transport.write(data)
+            return
+
+        self.buffer += data
+        if self.peer is not None:
+            # still connecting to the shard
+            return
+
+        # wait for the complete first message
+        if len(self.buffer) < FRAME_HEADER.size:
+            return
+        size = FRAME_HEADER.unpack_from(self.buffer)[0]
+        if size > MAX_HELLO_SIZE:
+            print('aborting connection: handshake too large')
+            self.transport.abort()
+            return
+        if len(self.buffer) < FRAME_HEADER.size + size:
+            return
+        message = bytes(self.buffer[FRAME_HEADER.size:FRAME_HEADER.size + size])
+
+        # the session key (if any) decides the shard
+        session = None
+        try:
+            if p.is_control(message):
+                session = p.decode(message).get('session', None)
+        except Exception as e:
+            print('aborting connection: cannot read handshake: {}'.format(e))
+            self.transport.abort()
+            return
+        shard = self.front.route(session)
+
+        self.peer = Forwarder(self)
+        self.transport.pause_reading()
+        connecting = self.front.loop.create_task(
+            self.front.loop.create_connection(lambda: self.peer, '127.0.0.1', shard.port))
+        connecting.add_done_callback(self.shard_connected)
+
+    def shard_connected(self, future):
+        """
+            The connection to the shard is established (or failed). Send what we have so far.
+        """
+        if self.transport is None:
+            # client already gone
+            if future.exception() is None:
+                self.peer.transport.close()
+            return
+        if future.exception() is not None:
+            print('aborting connection: shard not reachable: {}'.format(future.exception()))
+            self.transport.abort()
+            return
+        self.peer.transport.write(bytes(self.buffer))
+        self.buffer = None
+        self.transport.resume_reading()
+
+
+class ShardedServer():
+    """
+        The front process: listens on a port, starts the shards (on the following ports), routes connections to them
+        and restarts crashed shards.
+    """
+
+    def __init__(self, port, shards, scope='local', **options):
+        """
+            Given a port, the number of shards, a scope ('local' or 'any') and the options of the headless servers in
+            the shards (see server.headless.HeadlessServer). The shards cannot use worker processes (see the module
+            description).
+        """
+        if options.get('worker_processes', False):
+            raise RuntimeError('Shards cannot use worker processes, they are worker processes themselves.')
+        self.port = port
+        self.host = HOSTS[scope]
+        self.shards = [Shard(port + 1 + i, options) for i in range(shards)]
+        self.next_shard = 0
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = None
+
+    def route(self, session):
+        """
+            The shard for a session key (always the same for the same key) or the next one in turn if there is no key.
+        """
+        if session is not None:
+            return self.shards[zlib.crc32(str(session).encode()) % len(self.shards)]
+        shard = self.shards[self.next_shard]
+        self.next_shard = (self.next_shard + 1) % len(self.shards)
+        return shard
+
+    def supervise(self):
+        """
+            Restarts crashed shards, then checks again after a while.
+        """
+        for shard in self.shards:
+            if not shard.is_alive():
+                shard.restarts += 1
+                print('shard on port {} died (exit code {}), restarting'.format(shard.port, shard.process.exitcode))
+                shard.start()
+        self.loop.call_later(SUPERVISION_INTERVAL, self.supervise)
+
+    def run(self):
+        """
+            Starts the shards, listens and runs the event loop until stop() is called.
+        """
+        for shard in self.shards:
+            shard.start()
+        self.server = self.loop.run_until_complete(
+            self.loop.create_server(lambda: FrontConnection(self), self.host, self.port))
+        self.loop.call_later(SUPERVISION_INTERVAL, self.supervise)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+            for shard in self.shards:
+                shard.stop()
+            self.loop.close()
+
+    def stop(self):
+        """
+            Stops the event loop (can be called from any thread).
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
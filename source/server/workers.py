@@ -0,0 +1,96 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+"""
+    Runs heavy server jobs (loading scenarios, building previews, saving) outside of the event loop.
+"""
+
+
+class TaskPool():
+    """
+        A pool of worker threads or processes. Jobs are submitted from the event loop, their results are posted back
+        to the event loop and handed to a callback there. The number of jobs in flight is limited and the execution
+        time of jobs is recorded by name.
+
+        The event loop is abstracted by a post function, which must call a given function (without arguments) on the
+        event loop thread and may be called from any thread.
+    """
+
+    def __init__(self, post, workers=2, processes=False, max_jobs=32):
+        """
+            Given a post function, the number of workers, whether these are processes (then functions and arguments
+            must be picklable, otherwise threads) and the maximal number of jobs queued or running at any time.
+        """
+        self.post = post
+        if processes:
+            self.executor = ProcessPoolExecutor(workers)
+        else:
+            self.executor = ThreadPoolExecutor(workers)
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        self.timings = {}
+
+    def submit(self, name, function, args, callback, error_callback=None):
+        """
+            Runs function(*args) in a worker and calls callback(result) or error_callback(exception) later on the event
+            loop. Returns False (and does nothing) if there are already too many jobs.
+        """
+        if self.jobs >= self.max_jobs:
+            return False
+        self.jobs += 1
+        start = time.perf_counter()
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(lambda f: self.post(partial(self._done, name, start, f, callback, error_callback)))
+        return True
+
+    def _done(self, name, start, future, callback, error_callback):
+        """
+            A job is finished, we are back on the event loop. Record the time and call the callbacks.
+        """
+        self.jobs -= 1
+        elapsed = time.perf_counter() - start
+        timing = self.timings.setdefault(name, {'count': 0, 'total': 0, 'max': 0})
+        timing['count'] += 1
+        timing['total'] += elapsed
+        timing['max'] = max(timing['max'], elapsed)
+
+        exception = future.exception()
+        if exception is None:
+            callback(future.result())
+        elif error_callback is not None:
+            error_callback(exception)
+        else:
+            print('job {} failed: {}'.format(name, exception))
+
+    def statistics(self):
+        """
+            Returns the number of jobs in flight and for each job name the number of finished jobs as well as the total
+            and maximal time (in seconds, from submitting until done).
+        """
+        return {
+            'jobs': self.jobs,
+            'timings': {name: dict(timing) for name, timing in self.timings.items()}
+        }
+
+    def shutdown(self):
+        """
+            No new jobs, running jobs are finished but not waited for.
+        """
+        self.executor.shutdown(wait=False)
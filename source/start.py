@@ -24,7 +24,7 @@ if __name__ == '__main__':
     import sys
 
     # test for python version
-    required_version = (3, 4)
+    required_version = (3, 5)
     if sys.version_info < required_version:
         raise RuntimeError('Python version must be {}.{} at least.'.format(*required_version))
 
@@ -104,7 +104,11 @@ if __name__ == '__main__':
     from server.network import ServerProcess
     from multiprocessing import Pipe
     parent_conn, child_conn = Pipe()
-    server_process = ServerProcess(c.Network_Port, child_conn)
+    Scenario_Catalog_File = os.path.join(User_Folder, 'scenarios.catalog')
+    # the client connects locally (unique name per instance)
+    c.Local_Server_Name = 'imperialism-remake-{}'.format(os.getpid())
+    server_process = ServerProcess(c.Network_Port, child_conn, local_name=c.Local_Server_Name,
+                                   catalog_file=Scenario_Catalog_File, prewarm_previews=True)
     server_process.start()
 
     # start client, we will return when the programm finishes
@@ -0,0 +1,197 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Synchronization of a scenario with replicas by deltas (see base.sync) without any network: messages are encoded and
+    decoded like on a connection and delivered directly. Checks that replicas always end up equal to the scenario, also
+    if they miss deltas or are too far behind. Fails with an AssertionError otherwise.
+
+    Start in the project root folder with source on the Python path, e.g.
+
+        PYTHONPATH=source python test/base/sync.py
+"""
+
+import random
+
+from base import constants as c
+from base.sync import ChangeLog, StateSync, StateReplica
+from lib import protocol as p
+from server.scenario import Scenario
+
+
+def transmit(message):
+    """
+        What the other side of a connection receives.
+    """
+    return p.decode(p.encode(message))
+
+
+class Connection():
+    """
+        A client connection to a StateSync (with the parts of the channel interface a StateReplica needs). Published
+        deltas can be lost (connected = False).
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.channels = {}
+        self.connected = True
+        self.requests = 0
+
+    def connect_to_channel(self, channel_name, callback):
+        self.channels[channel_name] = callback
+
+    def request(self, channel_name, message, callback, error_callback):
+        assert channel_name == c.CH_STATE_SYNC and message['name'] == self.state.name
+        self.requests += 1
+        message = transmit(message)
+        callback(transmit(self.state.sync_reply(message['epoch'], message['version'])))
+
+    def deliver(self, topic, delta):
+        if self.connected:
+            self.channels[topic](self, transmit(delta))
+
+
+def same(replica, scenario):
+    """
+        True if a replica has the state of the scenario.
+    """
+    return transmit(replica.state) == transmit(scenario.state())
+
+
+def check_change_log():
+    """
+        Tile changes are coalesced (last value wins) and sorted, other changes are kept in order.
+    """
+    log = ChangeLog()
+    assert log.is_empty()
+    log.tile('terrain', 5, 1)
+    log.tiles('terrain', [7, 5], [2, 3])
+    log.record(['property', 'a', 1])
+    log.record(['property', 'a', 2])
+    delta = log.take()
+    assert delta == {'tiles': {'terrain': [[5, 7], [3, 2]]}, 'changes': [['property', 'a', 1], ['property', 'a', 2]]}
+    assert log.is_empty()
+
+
+def random_changes(scenario, count):
+    """
+        Applies a number of random changes to a scenario.
+    """
+    columns, rows = scenario[c.PropertyKeyNames.MAP_COLUMNS], scenario[c.PropertyKeyNames.MAP_ROWS]
+    for _ in range(count):
+        kind = random.randrange(8)
+        column, row = random.randrange(columns), random.randrange(rows)
+        if kind == 0:
+            scenario.set_terrain_at(column, row, random.randrange(7))
+        elif kind == 1:
+            scenario.set_resource_at(column, row, random.randrange(4))
+        elif kind == 2:
+            width, height = random.randint(0, columns - column), random.randint(0, rows - row)
+            scenario.set_layer_rect('terrain', column, row, width, height, random.randrange(7))
+        elif kind == 3:
+            scenario.set_layer_at('resource', [(column, row), (0, 0)], [1, 2])
+        elif kind == 4:
+            scenario['turn'] = random.randrange(100)
+        elif kind == 5:
+            province = scenario.new_province()
+            scenario.add_province_map_tile(province, [column, row])
+            scenario.set_province_property(province, 'name', 'province {}'.format(province))
+        elif kind == 6:
+            nation = scenario.new_nation()
+            scenario.set_nation_property(nation, 'name', 'nation {}'.format(nation))
+        elif kind == 7:
+            provinces = list(scenario.state()['provinces'])
+            nations = list(scenario.all_nations())
+            if provinces and nations:
+                scenario.transfer_province_to_nation(random.choice(provinces), random.choice(nations))
+
+
+def check_sync():
+    """
+        Replicas follow the scenario by deltas, catch up after missed deltas and get a snapshot if too far behind.
+    """
+    scenario = Scenario()
+    scenario.create_map(40, 30)
+    state = StateSync('game', scenario, lambda topic, delta: [x.deliver(topic, delta) for x in connections],
+                      history=5)
+    connections = []
+
+    replica = StateReplica('game')
+    connection = Connection(state)
+    connections.append(connection)
+    replica.attach(connection)
+    assert replica.version == 0 and same(replica, scenario)
+
+    for _ in range(20):
+        random_changes(scenario, 10)
+        state.commit()
+        assert replica.version == state.version and same(replica, scenario)
+
+    # a few deltas lost, the next one reveals the gap
+    connection.connected = False
+    for _ in range(3):
+        random_changes(scenario, 10)
+        state.commit()
+    connection.connected = True
+    requests = connection.requests
+    random_changes(scenario, 10)
+    state.commit()
+    assert connection.requests == requests + 1 and same(replica, scenario)
+
+    # too far behind (more than the history), a snapshot
+    connection.connected = False
+    for _ in range(10):
+        random_changes(scenario, 10)
+        state.commit()
+    connection.connected = True
+    replica.synchronize(connection)
+    assert replica.version == state.version and same(replica, scenario)
+
+    # a state from before a restart (another epoch)
+    restarted = StateSync('game', scenario, lambda topic, delta: None)
+    connection.state = restarted
+    replica.synchronize(connection)
+    assert replica.epoch == restarted.epoch and same(replica, scenario)
+
+    # nothing changed, no delta
+    version = state.version
+    assert state.commit() == version
+    state.close()
+    random_changes(scenario, 10)
+    assert state.changes.is_empty()
+
+
+def check_delta_size():
+    """
+        A delta costs in proportion to the changes, not to the map size.
+    """
+    scenario = Scenario()
+    scenario.create_map(500, 300)
+    deltas = []
+    state = StateSync('big', scenario, lambda topic, delta: deltas.append(len(p.encode(delta))))
+    for column in range(10):
+        scenario.set_terrain_at(column, 0, 3)
+    state.commit()
+    assert deltas[-1] < 200, deltas
+
+
+if __name__ == '__main__':
+    random.seed(0)
+    check_change_log()
+    check_sync()
+    check_delta_size()
+    print('sync round trips ok')
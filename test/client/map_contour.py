@@ -5,7 +5,8 @@
 from PySide import QtGui
 
 from base import constants as c
-from server.scenario import *
+from base.constants import PropertyKeyNames as k
+from server.scenario import Scenario
 
 # load scenario
 
@@ -13,9 +14,9 @@ scenario = Scenario()
 scenario.load(c.extend(c.Core_Scenario_Folder, 'Europe1814.scenario'))
 
 # nation map
-columns = scenario[MAP_COLUMNS]
-rows = scenario[MAP_ROWS]
-map = [0] * (columns * rows)
+columns = scenario[k.MAP_COLUMNS]
+rows = scenario[k.MAP_ROWS]
+map = [-1] * (columns * rows)
 for nation in scenario.all_nations():
     provinces = scenario.get_provinces_of_nation(nation)
     for province in provinces:
@@ -23,19 +24,16 @@ for nation in scenario.all_nations():
         for column, row in tiles:
             map[row * columns + column] = nation
 
-# get outlines
+# get outlines (all tiles of a nation with at least one neighbor outside of the nation)
+neighbors = scenario.neighbor_table()
 for nation in scenario.all_nations():
-    visited = [False] * (columns * rows)
     for i in range(0, columns * rows):
-        column = i % columns
-        row = i // columns
-        visited[i] = True
         if map[i] == nation:
-            for direction in c.TileDirections:
-                position = scenario.get_neighbor_position(column, row, direction)
-                if position is None or map[position[0] + columns * position[1]] != nation: # outside is automatically seen as border
+            for neighbor in neighbors[6 * i:6 * i + 6]:
+                if neighbor == -1 or map[neighbor] != nation:  # outside is automatically seen as border
                     # now that is interesting we are at a border, follow
-                    print(position)
+                    print(i % columns, i // columns)
+                    break
 
 
 app = QtGui.QApplication([])
@@ -0,0 +1,47 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Batches of messages (not Qt): a batch gives back its frames with every compression. Uses the messages of
+    wire_codecs.py next to it. Fails with an AssertionError otherwise.
+
+    Start in the project root folder with source on the Python path, e.g.
+
+        PYTHONPATH=source python test/lib/batching.py
+"""
+
+from lib import protocol as p
+from lib.compression import COMPRESSIONS
+from lib.framing import frame, FrameBuffer
+from wire_codecs import MESSAGES
+
+DICTIONARY = b'channel content reply-to scenario map nations' * 8
+
+
+def check_batches():
+    """
+        A batch gives back its frames.
+    """
+    frames = [frame(p.encode(message)) for message in MESSAGES]
+    for compression in COMPRESSIONS:
+        data = p.encode_batch(frames, compression, dictionary=DICTIONARY)
+        assert p.is_batch(data)
+        assert FrameBuffer().feed(p.decode_batch(data, DICTIONARY)) == [bytes(x[4:]) for x in frames]
+
+
+if __name__ == '__main__':
+    check_batches()
+    print('batches ok')
@@ -0,0 +1,110 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Framing of messages on a stream (not Qt): frames are split correctly however the stream is cut, too large and empty
+    frames are refused and a bad message does not stop the processing of the following ones (on a connection of the
+    headless server, which reads frames like lib.network.Client). Fails with an AssertionError otherwise.
+
+    Start in the project root folder with source on the Python path, e.g.
+
+        PYTHONPATH=source python test/lib/framing.py
+"""
+
+import os
+
+from base.channels import create_protocol, letter
+from lib import protocol as p
+from lib.framing import frame, FrameBuffer
+from server.headless import HeadlessClient
+
+
+def check_framing():
+    """
+        Frames are split correctly however the stream is cut.
+    """
+    messages = [os.urandom(n) for n in (1, 5, 1000, 70000)]
+    stream = b''.join(frame(x) for x in messages)
+    for step in (1, 3, 4096, len(stream)):
+        buffer = FrameBuffer()
+        received = []
+        for start in range(0, len(stream), step):
+            received.extend(buffer.feed(stream[start:start + step]))
+        assert received == messages, step
+        assert buffer.pending() == 0
+
+
+def check_refused_frames():
+    """
+        Frames larger than the maximal size and empty frames are errors.
+    """
+    for data in (frame(bytes(101)), frame(b'')):
+        try:
+            FrameBuffer(100).feed(data)
+        except RuntimeError:
+            pass
+        else:
+            assert False, 'frame of size {} not refused'.format(len(data) - 4)
+
+
+class FakeTransport():
+    """
+        Only what a headless client needs of an asyncio transport here.
+    """
+
+    def __init__(self):
+        self.aborted = False
+
+    def set_write_buffer_limits(self, high, low):
+        pass
+
+    def abort(self):
+        self.aborted = True
+
+
+class FakeServices():
+
+    def add_client(self, client):
+        pass
+
+
+def check_bad_messages():
+    """
+        Bad messages (alone or in a batch) are skipped, the others are processed. An empty frame aborts the connection.
+    """
+    client = HeadlessClient(FakeServices(), (None, None, None))
+    transport = FakeTransport()
+    client.connection_made(transport)
+    received = []
+    client.connect_to_channel('test', lambda client, message: received.append(message))
+
+    protocol = create_protocol()
+    good = [frame(protocol.encode(letter('test', number))) for number in range(4)]
+    bad = [frame(b'\xff'), frame(protocol.encode(letter('unknown', None))), frame(protocol.encode(None))]
+    batch = frame(p.encode_batch([good[2], bad[0], good[3]], 'none'))
+    stream = good[0] + bad[0] + bad[1] + good[1] + bad[2] + batch
+    client.data_received(stream)
+    assert received == [0, 1, 2, 3] and not transport.aborted
+
+    client.data_received(frame(b'') + good[0])
+    assert transport.aborted and received == [0, 1, 2, 3]
+
+
+if __name__ == '__main__':
+    check_framing()
+    check_refused_frames()
+    check_bad_messages()
+    print('framing ok')
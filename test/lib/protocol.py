@@ -0,0 +1,91 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Round trips of the message encoding (not Qt): compressions (including the limit of the decompressed size), encoding
+    with all codecs and compressions and the handshake. Uses the messages of wire_codecs.py next to it. Fails with an
+    AssertionError if anything does not come back unchanged.
+
+    Start in the project root folder with source on the Python path, e.g.
+
+        PYTHONPATH=source python test/lib/protocol.py
+"""
+
+import os
+
+from lib import protocol as p
+from lib.compression import COMPRESSIONS, compress, decompress
+from lib.serialization import get_codec
+from wire_codecs import MESSAGES, normalized
+
+DICTIONARY = b'channel content reply-to scenario map nations' * 8
+
+
+def check_compressions():
+    """
+        Every compression gives back the data and refuses data that would decompress to too much.
+    """
+    data = os.urandom(100) * 100
+    for name in COMPRESSIONS:
+        compressed = compress(data, name, dictionary=DICTIONARY)
+        assert decompress(compressed, name, DICTIONARY) == data, name
+        try:
+            decompress(compressed, name, DICTIONARY, max_size=len(data) - 1)
+        except RuntimeError:
+            pass
+        else:
+            assert False, 'no size limit for {}'.format(name)
+
+
+def check_encoding():
+    """
+        Messages are encoded and decoded with all codecs and compressions, small ones are not compressed.
+    """
+    for codec in ('binary', 'yaml'):
+        for compression in COMPRESSIONS:
+            for message in MESSAGES:
+                data = p.encode(message, get_codec(codec), compression, dictionary=DICTIONARY)
+                assert p.decode(data, DICTIONARY) == normalized(message, typed=codec == 'binary')
+                assert not p.is_control(data) and not p.is_batch(data)
+    assert p.decode(p.encode('x' * 1000, compression='zlib')) == 'x' * 1000
+    assert len(p.encode('x', compression='zlib')) == len(p.encode('x', compression='none'))
+
+
+def check_handshake():
+    """
+        Two protocols agree on the most preferred codec and compression they both support.
+    """
+    client = p.Protocol(dictionary=DICTIONARY, session='abc')
+    server = p.Protocol(compressions=('zlib', 'none'), dictionary=DICTIONARY)
+    hello = p.decode(p.Protocol.encode_control(client.hello()))
+    assert hello['session'] == 'abc'
+    answer = server.process_control(hello)
+    assert client.process_control(answer) is None
+    assert client.settings()[:2] == server.settings()[:2] == (get_codec('binary').id, 'zlib')
+    for message in MESSAGES:
+        assert server.decode(client.encode(message)) == normalized(message, typed=True)
+
+    # different preset dictionaries, no dictionary compression
+    server = p.Protocol(dictionary=b'other')
+    answer = server.process_control(p.Protocol(dictionary=DICTIONARY).hello())
+    assert answer['compression'] != 'zlib-dictionary'
+
+
+if __name__ == '__main__':
+    check_compressions()
+    check_encoding()
+    check_handshake()
+    print('protocol round trips ok')
@@ -0,0 +1,82 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Round trips of the run length encoding of maps (see lib.runlength). Fails with an AssertionError if a map does not
+    come back unchanged.
+
+    Start in the project root folder with source on the Python path, e.g.
+
+        PYTHONPATH=source python test/lib/runlength.py
+"""
+
+import random
+
+from lib.runlength import encode_runs, decode_runs, decode_to_pixels, row_segments
+
+
+def check(values, columns):
+    """
+        Encodes and decodes a map in all ways.
+    """
+    palette, data = encode_runs(values)
+    assert palette == sorted(set(values))
+    pixels = decode_to_pixels(data, len(values))
+    assert [palette[index] for index in pixels] == list(values)
+    assert sum(length for index, length in decode_runs(data)) == len(values)
+
+    # the row segments cover every tile exactly once
+    tiles = [None] * len(values)
+    for index, column, row, length in row_segments(data, columns):
+        assert 0 <= column and column + length <= columns
+        for x in range(column, column + length):
+            assert tiles[row * columns + x] is None
+            tiles[row * columns + x] = palette[index]
+    assert tiles == list(values)
+    return len(data)
+
+
+if __name__ == '__main__':
+    random.seed(0)
+    check([], 1)
+    check([7], 1)
+    check([-1] * 1000, 10)  # one long run (multi-byte length)
+    check(list(range(256)), 16)  # largest palette
+
+    # a map of nations with long runs compresses well
+    columns, rows = 500, 300
+    nations = [-1] * (columns * rows)
+    for row in range(rows):
+        for column in range(columns):
+            nations[row * columns + column] = (column // 60 + row // 50) % 9 - 1
+    size = check(nations, columns)
+    assert size < len(nations) // 20, size
+
+    # random maps
+    for _ in range(20):
+        count = random.randint(1, 2000)
+        values = [random.choice([0, 1, 2, 300, -5]) for _ in range(count)]
+        check(values, random.randint(1, 50))
+
+    # too many values for a palette
+    try:
+        encode_runs(list(range(257)))
+    except RuntimeError:
+        pass
+    else:
+        assert False, 'palette not limited'
+
+    print('runlength round trips ok')
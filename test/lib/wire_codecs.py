@@ -0,0 +1,69 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Round trips of messages through the wire codecs (see lib.serialization): the compact binary codec and YAML. Fails
+    with an AssertionError if anything does not come back unchanged.
+
+    Start in the project root folder with source on the Python path, e.g.
+
+        PYTHONPATH=source python test/lib/wire_codecs.py
+"""
+
+from array import array
+
+from lib.serialization import get_codec
+
+MESSAGES = [
+    None,
+    True,
+    {'channel': 'general.scenario.preview', 'content': {'reply-to': 'request.reply.1', 'scenario': 'a.scenario'}},
+    {'ints': [0, -1, 127, 128, -129, 2 ** 31, -2 ** 63, 2 ** 70], 'float': 0.5, 'text': 'äöü', 'bytes': b'\0\xff'},
+    {'map': list(range(1000)), 'small': [1, 2, 3], 'nested': [[1, [2, {'x': None}]], (3, 4)]},
+    {'typed': array('B', [0, 1, 255] * 10), 'signed': array('i', [-5, 5] * 20)},
+    {1: 'int key', 'empty': {}, 'empty list': [], 'empty bytes': b''}
+]
+
+
+def check_codecs():
+    """
+        Every message survives every codec (tuples come back as lists, YAML has no typed arrays).
+    """
+    for message in MESSAGES:
+        value = get_codec('binary').loads(get_codec('binary').dumps(message))
+        assert value == normalized(message, typed=True), message
+        value = get_codec('yaml').loads(get_codec('yaml').dumps(message))
+        assert value == normalized(message, typed=False), message
+
+
+def normalized(value, typed):
+    """
+        What a codec gives back for a value.
+    """
+    if isinstance(value, tuple):
+        return [normalized(x, typed) for x in value]
+    if isinstance(value, list):
+        return [normalized(x, typed) for x in value]
+    if isinstance(value, dict):
+        return {key: normalized(x, typed) for key, x in value.items()}
+    if isinstance(value, array) and not typed:
+        return value.tolist()
+    return value
+
+
+if __name__ == '__main__':
+    check_codecs()
+    print('codec round trips ok')
@@ -0,0 +1,96 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Publishing and broadcasting to server clients (see server.services.ServerServices.send_to_all), in particular when
+    clients disconnect during the fan-out (their outbound data overflows and their connection is aborted). Fails with
+    an AssertionError if not every remaining client gets the message.
+
+    Start in the project root folder with source on the Python path, e.g.
+
+        PYTHONPATH=source python test/server/fanout.py
+"""
+
+from base.channels import create_protocol, letter
+from server.services import ServerServices
+
+
+class FakeServerClient():
+    """
+        Stands in for a server client (see server.headless.HeadlessServerClient). Counts the sent messages and
+        disconnects when more than max_messages are sent (like an overflow with the 'disconnect' policy).
+    """
+
+    def __init__(self, services, max_messages=None):
+        self.services = services
+        self.max_messages = max_messages
+        self.protocol = create_protocol()
+        self.sent = []
+        self.connected = True
+
+    def connect_to_channel(self, channel_name, callback):
+        pass
+
+    def send_settings(self):
+        return self.protocol.settings(), True
+
+    def encode_letter(self, channel_name, message=None):
+        return self.protocol.encode(letter(channel_name, message))
+
+    def send_bytes(self, data):
+        if not self.connected:
+            return
+        self.sent.append(data)
+        if self.max_messages is not None and len(self.sent) > self.max_messages:
+            # aborting the transport ends up here immediately
+            self.connected = False
+            self.services.client_disconnected(self)
+
+
+def check_fanout(services):
+    """
+        Clients overflowing during a publish or broadcast are removed, all others get every message.
+    """
+    clients = [FakeServerClient(services, max_messages=index % 3 if index % 2 else None) for index in range(12)]
+    for client in clients:
+        services.add_client(client)
+        services.subscribe(client, 'topic')
+    stable = [client for client in clients if client.max_messages is None]
+
+    for number in range(4):
+        services.publish('topic', {'round': number})
+        services.broadcast('channel', {'round': number})
+    for client in stable:
+        assert len(client.sent) == 8
+    for client in clients:
+        if client not in stable:
+            assert not client.connected and len(client.sent) == client.max_messages + 1
+    assert services.topics['topic'] == set(stable) and len(services.server_clients) == len(stable)
+
+    # everyone goes
+    for client in stable:
+        client.max_messages = 0
+    services.publish('topic')
+    assert 'topic' not in services.topics and len(services.server_clients) == 0
+
+
+if __name__ == '__main__':
+    services = ServerServices(lambda function: function())
+    try:
+        check_fanout(services)
+    finally:
+        services.stop()
+    print('fan-out ok')
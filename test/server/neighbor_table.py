@@ -0,0 +1,69 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Checks the neighbor table of the staggered hex grid (see server.scenario.neighbor_table) and the position lookups
+    of a scenario at the edges of the map. Fails with an AssertionError otherwise.
+
+    Start in the project root folder with source on the Python path, e.g.
+
+        PYTHONPATH=source python test/server/neighbor_table.py
+"""
+
+from base import constants as c
+from server.scenario import Scenario, neighbor_table
+
+
+def check_neighbor_table():
+    """
+        Neighbors are mutual and inside the map.
+    """
+    for columns, rows in ((1, 1), (2, 3), (7, 5)):
+        table = neighbor_table(columns, rows)
+        assert len(table) == 6 * columns * rows
+        for index in range(columns * rows):
+            for neighbor in table[6 * index:6 * index + 6]:
+                if neighbor != -1:
+                    assert 0 <= neighbor < columns * rows and neighbor != index
+                    assert index in table[6 * neighbor:6 * neighbor + 6]
+
+
+def check_positions():
+    """
+        Lookups outside of the map do not wrap around to the other edge.
+    """
+    scenario = Scenario()
+    scenario.create_map(5, 4)
+    province = scenario.new_province()
+    scenario.add_province_map_tile(province, [4, 3])
+    scenario.set_terrain_at(4, 3, 2)
+    outside = [[-1, 0], [0, -1], [5, 0], [0, 4]]
+    assert scenario.get_provinces_at(outside + [[4, 3]]) == [None] * 4 + [province]
+    assert scenario.get_province_at(-1, -1) is None
+    assert scenario.get_layer_at('terrain', outside + [[4, 3]]) == [None] * 4 + [2]
+    assert scenario.get_neighbor_position(0, 0, c.TileDirections.West) is None
+    try:
+        scenario.set_layer_at('terrain', [[-1, 0]], 1)
+    except RuntimeError:
+        pass
+    else:
+        assert False, 'wrote outside of the map'
+
+
+if __name__ == '__main__':
+    check_neighbor_table()
+    check_positions()
+    print('neighbor table ok')
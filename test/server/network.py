@@ -1,31 +1,206 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Load test of the server. Starts a server process and many simulated clients, which request core scenario titles and
+    scenario previews in a mix (each client waits for the reply and a random think time before its next request). At
+    the end reports throughput, latencies, CPU and memory usage of the server and the most expensive server handlers.
+
+    Start in the project root folder with source on the Python path, e.g.
+
+        PYTHONPATH=source python test/server/network.py --clients 50 --duration 30
+
+    CPU and memory of the server are only reported if psutil is installed.
+"""
+
+import argparse
+import random
+import time
+from multiprocessing import Pipe
+
 from PySide import QtCore
 
 from base import constants as c
-from server.network import server_manager
-from client.client import network_client
+from base.network import NetworkClient
+from server.network import ServerProcess
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def percentile(values, q):
+    """
+        The q-th quantile (0 <= q <= 1) of a list of values (0 if empty).
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class SimulatedClient():
+    """
+        A client connecting to the server and sending requests in a closed loop.
+    """
+
+    def __init__(self, load_test):
+        self.load_test = load_test
+        self.scenario_files = []
+        self.network_client = NetworkClient()
+        self.network_client.set_socket()
+        # complete titles after the server refreshed its catalog (if the titles were incomplete before)
+        self.network_client.connect_to_channel(c.CH_CORE_SCENARIO_TITLES, self.received_updated_titles)
+        self.network_client.connected.connect(self.next_request)
+        self.network_client.connect_to_host(load_test.options.port)
+
+    def next_request(self):
+        """
+            Sends a preview request (if we know scenario files already and by chance) or a titles request.
+        """
+        if not self.load_test.running:
+            return
+        if self.scenario_files and random.random() < self.load_test.options.preview_ratio:
+            kind = 'preview'
+            channel, message = c.CH_SCENARIO_PREVIEW, {'scenario': random.choice(self.scenario_files)}
+        else:
+            kind = 'titles'
+            channel, message = c.CH_CORE_SCENARIO_TITLES, None
+        start = time.perf_counter()
+        self.network_client.request(channel, message, lambda reply: self.received(kind, start, reply),
+                                    lambda exception: self.failed(kind, exception))
+
+    def received(self, kind, start, reply):
+        self.load_test.latencies[kind].append(time.perf_counter() - start)
+        if kind == 'titles':
+            self.scenario_files = [file_name for title, file_name in reply['scenarios']]
+        self.think()
+
+    def received_updated_titles(self, client, message):
+        self.scenario_files = [file_name for title, file_name in message['scenarios']]
+
+    def failed(self, kind, exception):
+        self.load_test.errors.append('{}: {}'.format(kind, exception))
+        self.think()
+
+    def think(self):
+        """
+            Waits a random time before the next request.
+        """
+        think_time = random.expovariate(1 / self.load_test.options.think_time) if self.load_test.options.think_time \
+            else 0
+        QtCore.QTimer.singleShot(int(think_time * 1000), self.next_request)
+
+
+class LoadTest():
+    """
+        Starts the server and the clients, samples the server process and reports at the end.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.latencies = {'titles': [], 'preview': []}
+        self.errors = []
+        self.running = False
+        self.clients = []
+        self.cpu_samples = []
+        self.memory_samples = []
+
+        self.parent_conn, child_conn = Pipe()
+        self.server_process = ServerProcess(options.port, child_conn, prewarm_previews=options.prewarm)
+        self.server_process.start()
+        self.server_info = psutil.Process(self.server_process.pid) if psutil else None
+
+        self.sample_timer = QtCore.QTimer()
+        self.sample_timer.timeout.connect(self.sample)
+
+        # give the server some time to start listening
+        QtCore.QTimer.singleShot(1000, self.start)
+
+    def start(self):
+        print('{} clients for {} s'.format(self.options.clients, self.options.duration))
+        self.running = True
+        self.start_time = time.perf_counter()
+        self.clients = [SimulatedClient(self) for _ in range(self.options.clients)]
+        if self.server_info is not None:
+            self.server_info.cpu_percent()
+            self.sample_timer.start(1000)
+        QtCore.QTimer.singleShot(self.options.duration * 1000, self.stop)
+
+    def sample(self):
+        """
+            CPU usage (percent of one core) and memory (resident set) of the server process.
+        """
+        self.cpu_samples.append(self.server_info.cpu_percent())
+        self.memory_samples.append(self.server_info.memory_info().rss)
+
+    def stop(self):
+        """
+            Stops the clients and asks the server for its metrics.
+        """
+        self.running = False
+        self.elapsed = time.perf_counter() - self.start_time
+        self.sample_timer.stop()
+        self.clients[0].network_client.request(c.CH_SERVER_METRICS, callback=self.report,
+                                               error_callback=lambda exception: self.report(None))
 
+    def report(self, metrics):
+        completed = sum(len(x) for x in self.latencies.values())
+        print('{} requests in {:.1f} s, {:.1f} requests/s, {} errors'.format(completed, self.elapsed,
+                                                                             completed / self.elapsed, len(self.errors)))
+        for kind, latencies in sorted(self.latencies.items()):
+            print('  {:8} {:6} requests, latency p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms'.format(
+                kind, len(latencies), 1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.99),
+                1000 * max(latencies, default=0)))
+        for error in sorted(set(self.errors))[:10]:
+            print('  error: {}'.format(error))
 
-def setup():
-    server_manager.server.start(c.Network_Port)
-    network_client.connect_to_host(c.Network_Port)
+        if self.cpu_samples:
+            print('server CPU mean {:.0f} %, max {:.0f} %, memory max {:.1f} MiB'.format(
+                sum(self.cpu_samples) / len(self.cpu_samples), max(self.cpu_samples),
+                max(self.memory_samples) / 1024 ** 2))
+        else:
+            print('server CPU and memory not measured (psutil not installed)')
 
-def send():
-    message = {
-        'type': 'chat.register',
-        'message': c.MessageType.scenario_preview.value
-    }
-    network_client.send(message)
+        if metrics is not None:
+            channels = sorted(metrics['channels'].items(), key=lambda item: -item[1]['handler']['total'])
+            print('server handlers (by total time):')
+            for name, values in channels:
+                handler = values['handler']
+                if handler['count']:
+                    print('  {:32} {:6} calls, mean {:.3f} ms, p99 {:.3f} ms'.format(
+                        name, handler['count'], 1000 * handler['mean'], 1000 * handler['p99']))
+            print('server encode p99 {:.3f} ms, decode p99 {:.3f} ms'.format(1000 * metrics['encode']['p99'],
+                                                                             1000 * metrics['decode']['p99']))
 
-    message = {
-        'type' : 'chat.message',
-        'text' : 'Hi guys'
-    }
-    network_client.send(message)
+        self.parent_conn.send('quit')
+        self.server_process.join()
+        QtCore.QCoreApplication.instance().quit()
 
 
-app = QtCore.QCoreApplication([])
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of the server.')
+    parser.add_argument('--clients', type=int, default=20, help='number of simulated clients')
+    parser.add_argument('--duration', type=int, default=10, help='duration in seconds')
+    parser.add_argument('--preview-ratio', type=float, default=0.5, help='fraction of preview requests')
+    parser.add_argument('--think-time', type=float, default=0.05, help='mean time between requests in seconds')
+    parser.add_argument('--port', type=int, default=c.Network_Port + 1, help='port of the server')
+    parser.add_argument('--prewarm', action='store_true', help='prewarm the preview cache')
 
-QtCore.QTimer.singleShot(0, setup)
-QtCore.QTimer.singleShot(100, send)
-QtCore.QTimer.singleShot(3000, app.quit)
-app.exec_()
+    app = QtCore.QCoreApplication([])
+    load_test = LoadTest(parser.parse_args())
+    app.exec_()
@@ -0,0 +1,82 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Replays recorded sessions (see lib.recording, record with ServerManager(record_folder=..)) against a fresh headless
+    server (or a running server on a given port), all sessions at the same time, and reports the time until all replies
+    came and the reply latencies.
+
+    Start in the project root folder with source on the Python path, e.g.
+
+        PYTHONPATH=source python test/server/replay.py recordings/*.recording --paced
+"""
+
+import argparse
+import threading
+import time
+
+from base.channels import create_protocol
+from lib.recording import SessionReplayer
+from server.headless import HeadlessServer
+
+
+def percentile(values, q):
+    """
+        The q-th quantile (0 <= q <= 1) of a list of values (0 if empty).
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays recorded sessions against a server.')
+    parser.add_argument('recordings', nargs='+', help='recording files')
+    parser.add_argument('--paced', action='store_true', help='original pacing instead of as fast as possible')
+    parser.add_argument('--port', type=int, default=None, help='port of a running server (default: start one)')
+
+    options = parser.parse_args()
+
+    server = None
+    port = options.port
+    if port is None:
+        port = 42999
+        server = HeadlessServer(port)
+        server.start()
+        threading.Thread(target=server.loop.run_forever, daemon=True).start()
+
+    replayers = [SessionReplayer(file_name, create_protocol()) for file_name in options.recordings]
+    threads = [threading.Thread(target=replayer.replay, args=('127.0.0.1', port, options.paced)) for replayer in
+               replayers]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    messages = sum(len(replayer.messages) for replayer in replayers)
+    replies = sum(replayer.replies for replayer in replayers)
+    latencies = [latency for replayer in replayers for latency in replayer.latencies]
+    unanswered = sum(len(replayer.pending) for replayer in replayers)
+    print('{} sessions, {} messages sent, {} replies in {:.2f} s ({:.1f} messages/s), {} unanswered'.format(
+        len(replayers), messages, replies, elapsed, messages / elapsed, unanswered))
+    print('reply latency p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms'.format(
+        1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.99), 1000 * max(latencies, default=0)))
+
+    if server is not None:
+        server.stop()
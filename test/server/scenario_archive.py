@@ -0,0 +1,166 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Round trips of scenarios through both file formats (zipped YAML and the binary columnar archive, see lib.utils), in
+    particular saving over the file a scenario was (lazily) loaded from, and failed saves. Works in a temporary
+    folder. Fails with an AssertionError if anything does not come back unchanged.
+
+    Start in the project root folder with source on the Python path, e.g.
+
+        PYTHONPATH=source python test/server/scenario_archive.py
+"""
+
+from array import array
+import os
+import shutil
+import tempfile
+
+from base import constants as c
+from lib import utils as u
+from server.scenario import Scenario
+
+
+def create_scenario():
+    """
+        A small scenario with some content in every section.
+    """
+    scenario = Scenario()
+    scenario.create_map(30, 20)
+    scenario[c.PropertyKeyNames.TITLE] = 'Test'
+    scenario['rules'] = 'standard.rules'
+    scenario.load_rules()
+    scenario.set_layer_rect('terrain', 2, 3, 10, 5, 2)
+    scenario.set_resource_at(4, 4, 1)
+    nation = scenario.new_nation()
+    scenario.set_nation_property(nation, 'name', 'Nation')
+    province = scenario.new_province()
+    for position in ([1, 1], [2, 1], [1, 2]):
+        scenario.add_province_map_tile(province, position)
+    scenario.transfer_province_to_nation(province, nation)
+    return scenario
+
+
+def content(scenario):
+    """
+        Everything of a scenario as plain values (for comparisons).
+    """
+    state = scenario.state()
+    state['map'] = {layer: list(values) for layer, values in state['map'].items()}
+    provinces = {province: sorted(map(tuple, scenario.get_province_property(province, 'tiles'))) for province in
+                 state['provinces']}
+    return state, provinces
+
+
+def check_columnar_archive(folder):
+    """
+        Entries and typed arrays come back unchanged, also when an archive is written over itself while it is read.
+    """
+    file_name = os.path.join(folder, 'archive')
+    writer = u.ColumnarArchiveWriter(file_name)
+    writer.write('raw', b'\0\1\2')
+    writer.write_as_yaml('yaml', {'a': [1, 2]})
+    writer.write_array('bytes', array('B', [1, 2, 3]))
+    writer.write_array('ints', array('i', [-1, 0, 2 ** 31 - 1]))
+    writer.close()
+    assert u.is_columnar_archive(file_name)
+
+    reader = u.ColumnarArchiveReader(file_name)
+    assert reader.read('raw') == b'\0\1\2' and reader.read_as_yaml('yaml') == {'a': [1, 2]}
+    ints = reader.read_array('ints')
+    assert list(reader.read_array('bytes')) == [1, 2, 3] and list(ints) == [-1, 0, 2 ** 31 - 1]
+
+    # write over it, the mapped content stays readable
+    writer = u.ColumnarArchiveWriter(file_name)
+    writer.write_array('ints', ints)
+    writer.close()
+    assert list(ints) == [-1, 0, 2 ** 31 - 1]
+    assert list(u.ColumnarArchiveReader(file_name).read_array('ints')) == [-1, 0, 2 ** 31 - 1]
+    assert os.listdir(folder) == ['archive']
+
+
+def check_scenario(folder):
+    """
+        Save and load in both formats, change and save again over the same file (eagerly and lazily loaded).
+    """
+    file_name = os.path.join(folder, 'test.scenario')
+    scenario = create_scenario()
+    expected = content(scenario)
+
+    scenario.save(file_name)
+    scenario = Scenario()
+    scenario.load(file_name)
+    assert content(scenario) == expected
+    assert scenario.get_terrain_name(1) == 'Plain'
+
+    for lazy in (False, True):
+        scenario.save_binary(file_name)
+        assert u.is_columnar_archive(file_name)
+        scenario = Scenario()
+        scenario.load(file_name, lazy=lazy)
+        assert content(scenario) == expected
+        assert scenario.get_terrain_name(1) == 'Plain'
+
+        # change and save over the file it was loaded from
+        scenario.set_terrain_at(0, 0, 5)
+        scenario.save_binary(file_name)
+        expected = content(scenario)
+        scenario = Scenario()
+        scenario.load(file_name, lazy=lazy)
+        assert content(scenario) == expected
+
+    # back to YAML over the binary file
+    scenario.save(file_name)
+    scenario = Scenario()
+    scenario.load(file_name, lazy=True)
+    assert not u.is_columnar_archive(file_name) and content(scenario) == expected
+
+
+def check_failed_saves(folder):
+    """
+        A writer that is aborted (by an exception in its with block) or never closed leaves the file as it was.
+    """
+    file_name = os.path.join(folder, 'kept')
+    for writer_class in (u.ZipArchiveWriter, u.ColumnarArchiveWriter):
+        with writer_class(file_name) as writer:
+            writer.write_as_yaml('kept', 1)
+        try:
+            with writer_class(file_name) as writer:
+                writer.write_as_yaml('kept', 2)
+                raise ValueError()
+        except ValueError:
+            pass
+        writer = writer_class(file_name)
+        writer.write_as_yaml('kept', 3)
+        del writer
+        reader = u.ColumnarArchiveReader(file_name) if writer_class is u.ColumnarArchiveWriter else u.ZipArchiveReader(
+            file_name)
+        assert reader.read_as_yaml('kept') == 1
+        assert os.listdir(folder) == ['kept']
+        os.remove(file_name)
+
+
+if __name__ == '__main__':
+    folder = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(folder, 'archive'))
+        check_columnar_archive(os.path.join(folder, 'archive'))
+        check_scenario(folder)
+        os.mkdir(os.path.join(folder, 'failed'))
+        check_failed_saves(os.path.join(folder, 'failed'))
+    finally:
+        shutil.rmtree(folder)
+    print('scenario archive round trips ok')
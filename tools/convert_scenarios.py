@@ -0,0 +1,40 @@
+# Imperialism remake
+# Copyright (C) 2014 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+
+import os
+import sys
+os.chdir('..')
+
+from base import constants as c
+from server.scenario import Scenario
+
+"""
+    Converts scenarios (by default all core scenarios) to the binary columnar format (see Scenario.save_binary). Files
+    which are already binary are rewritten in place, too.
+"""
+
+if len(sys.argv) > 1:
+    files = sys.argv[1:]
+else:
+    files = [os.path.join(c.Core_Scenario_Folder, x) for x in os.listdir(c.Core_Scenario_Folder) if
+             x.endswith('.scenario')]
+
+for file in files:
+    print('convert {}'.format(file))
+    scenario = Scenario()
+    scenario.load(file)
+    scenario.save_binary(file)